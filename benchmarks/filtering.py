@@ -0,0 +1,97 @@
+"""
+Times the local speckle filters across window sizes and, optionally, compares
+them against the Earth Engine filters on a small Sentinel-1 patch
+
+usage: python benchmarks/filtering.py [--size 2048] [--windows 3 7 15 33] [--compare]
+"""
+
+import time
+import argparse
+import numpy as np
+from hydrafloods import filtering
+from hydrafloods.local import filtering as local_filtering
+
+
+def synthetic_scene(size, looks=4, seed=0):
+    # gamma distributed speckle over a smooth backscatter field, in dB
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / size
+    field = 0.05 + 0.04 * np.sin(6 * x) * np.cos(4 * y)
+    speckle = rng.gamma(looks, 1 / looks, (size, size))
+    return (10 * np.log10(field * speckle)).astype(np.float32)
+
+
+def timed(func, *args, **kwargs):
+    t1 = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - t1
+
+
+def compare(point, size=256):
+    import ee
+
+    region = ee.Geometry.Point(point).buffer(size * 5).bounds()
+    img = (
+        ee.ImageCollection("COPERNICUS/S1_GRD")
+        .filterBounds(region)
+        .filter(ee.Filter.eq("instrumentMode", "IW"))
+        .select("VV")
+        .first()
+    )
+
+    def to_array(image):
+        props = image.sampleRectangle(region, defaultValue=-9999).getInfo()
+        values = np.array(props["properties"]["VV"], dtype=np.float32)
+        return np.where(values == -9999, np.nan, values)
+
+    original = to_array(img)
+    print(f"{'filter':>12} {'mean abs diff':>14} {'max abs diff':>14}")
+    for name in ("gamma_map", "refined_lee", "lee_sigma"):
+        expected = to_array(getattr(filtering, name)(img))
+        result = getattr(local_filtering, name)(original)
+        # pixels within a window of the patch edge see different neighborhoods
+        diff = np.abs(result - expected)[16:-16, 16:-16]
+        print(f"{name:>12} {np.nanmean(diff):>14.4f} {np.nanmax(diff):>14.4f}")
+
+    return
+
+
+def main(size, windows):
+    img = synthetic_scene(size)
+    pixels = img.size
+
+    print(f"{'filter':>12} {'window':>8} {'seconds':>10} {'Mpixels/s':>10}")
+    for window in windows:
+        for name, func in (
+            ("lee_sigma", local_filtering.lee_sigma),
+            ("gamma_map", local_filtering.gamma_map),
+        ):
+            elapsed = timed(func, img, window=window)
+            print(
+                f"{name:>12} {window:>8} {elapsed:>10.3f} {pixels/elapsed/1e6:>10.2f}"
+            )
+
+    elapsed = timed(local_filtering.refined_lee, img)
+    print(f"{'refined_lee':>12} {7:>8} {elapsed:>10.3f} {pixels/elapsed/1e6:>10.2f}")
+
+    return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=2048)
+    parser.add_argument("--windows", type=int, nargs="+", default=[3, 7, 15, 33])
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="compare the local filters against the Earth Engine filters",
+    )
+    parser.add_argument("--point", type=float, nargs=2, default=[90.4, 23.7])
+    args = parser.parse_args()
+
+    main(args.size, args.windows)
+    if args.compare:
+        import ee
+
+        ee.Initialize()
+        compare(args.point)
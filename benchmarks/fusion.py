@@ -0,0 +1,56 @@
+"""
+Measures the throughput of the tiled local STARFM implementation in pixels per
+second for different tile sizes
+
+usage: python benchmarks/fusion.py [--size 4096] [--tiles 256 512 1024 2048] [--window 33] [--workers 4]
+"""
+
+import time
+import argparse
+import numpy as np
+from hydrafloods.local import fusion
+
+
+def synthetic_inputs(size, n_bands=2, seed=0):
+    rng = np.random.default_rng(seed)
+    shape = (n_bands, size, size)
+    fine_base = rng.uniform(0.02, 0.4, shape).astype(np.float32)
+    coarse_base = fine_base + rng.normal(0, 0.01, shape).astype(np.float32)
+    coarse = coarse_base + rng.normal(0.02, 0.01, shape).astype(np.float32)
+    return coarse, coarse_base, fine_base
+
+
+def main(size, tile_sizes, window_size, n_workers):
+    coarse, coarse_base, fine_base = synthetic_inputs(size)
+    out = np.empty(coarse.shape, dtype=np.float32)
+    pixels = size * size
+
+    print(f"{'tile':>6} {'halo':>6} {'seconds':>10} {'Mpixels/s':>10}")
+    for tile_size in tile_sizes:
+        t1 = time.perf_counter()
+        for window, prediction in fusion.starfm(
+            coarse,
+            coarse_base,
+            fine_base,
+            8,
+            window_size=window_size,
+            tile_size=tile_size,
+            n_workers=n_workers,
+        ):
+            out[(Ellipsis,) + window] = prediction
+        elapsed = time.perf_counter() - t1
+        halo = fusion.halo_size(window_size)
+        print(f"{tile_size:>6} {halo:>6} {elapsed:>10.3f} {pixels/elapsed/1e6:>10.2f}")
+
+    return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=4096)
+    parser.add_argument("--tiles", type=int, nargs="+", default=[256, 512, 1024, 2048])
+    parser.add_argument("--window", type=int, default=33)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    main(args.size, args.tiles, args.window, args.workers)
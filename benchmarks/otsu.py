@@ -0,0 +1,62 @@
+"""
+Compares the iterative and cumulative Earth Engine Otsu implementations
+by the size of the expression graph sent to the server and, optionally,
+the time it takes the server to compute the threshold
+
+usage: python benchmarks/otsu.py [--bins 64 128 255] [--compute]
+"""
+
+import time
+import argparse
+import ee
+import numpy as np
+from hydrafloods import geeutils, thresholding
+
+
+def synthetic_histogram(n_bins, seed=0):
+    # bimodal distribution resembling SAR backscatter over water and land
+    rng = np.random.default_rng(seed)
+    values = np.concatenate([rng.normal(-20, 2, 50000), rng.normal(-8, 3, 150000)])
+    counts, edges = np.histogram(values, bins=n_bins)
+    means = (edges[:-1] + edges[1:]) / 2
+    return dict(histogram=counts.tolist(), bucketMeans=means.tolist())
+
+
+def main(bins, compute=False):
+    print(f"{'bins':>6} {'method':>12} {'nodes':>8} {'bytes':>8} {'seconds':>10}")
+    for n_bins in bins:
+        histogram = synthetic_histogram(n_bins)
+        expected = thresholding.local_thresholding.otsu(histogram)
+        for name, func in thresholding.OTSU_METHODS.items():
+            threshold = func(ee.Dictionary(histogram))
+            size = geeutils.expression_size(threshold)
+
+            elapsed = float("nan")
+            if compute:
+                t1 = time.perf_counter()
+                value = threshold.getInfo()
+                elapsed = time.perf_counter() - t1
+                if not np.isclose(value, expected):
+                    raise AssertionError(
+                        f"{name} threshold {value} does not match local result {expected}"
+                    )
+
+            print(
+                f"{n_bins:>6} {name:>12} {size['nodes']:>8} {size['bytes']:>8} {elapsed:>10.3f}"
+            )
+
+    return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--bins", type=int, nargs="+", default=[32, 64, 128, 255])
+    parser.add_argument(
+        "--compute",
+        action="store_true",
+        help="request the thresholds from the server and time the computation",
+    )
+    args = parser.parse_args()
+
+    ee.Initialize()
+    main(args.bins, args.compute)
@@ -0,0 +1,49 @@
+"""
+Times the conversion of scikit-learn trees to the Earth Engine tree string format
+across tree depths
+
+usage: python benchmarks/trees.py [--samples 100000] [--depths 5 10 20 30] [--trees 10]
+"""
+
+import time
+import argparse
+import numpy as np
+from sklearn.ensemble import ExtraTreesRegressor
+from hydrafloods import ml
+
+
+def synthetic_samples(n_samples, n_features=8, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.random((n_samples, n_features)).astype(np.float32)
+    y = X[:, 0] + np.sin(6 * X[:, 1]) * X[:, 2] + rng.normal(0, 0.05, n_samples)
+    return X, y
+
+
+def main(n_samples, depths, n_trees):
+    X, y = synthetic_samples(n_samples)
+    feature_names = [f"b{i}" for i in range(X.shape[1])]
+
+    print(f"{'depth':>6} {'nodes':>10} {'seconds':>10} {'nodes/s':>12}")
+    for depth in depths:
+        model = ExtraTreesRegressor(
+            n_estimators=n_trees, max_depth=depth, random_state=0, n_jobs=-1
+        ).fit(X, y)
+
+        t1 = time.perf_counter()
+        _ = [ml.sklearn_tree_to_string(e, feature_names) for e in model.estimators_]
+        elapsed = time.perf_counter() - t1
+
+        n_nodes = sum(e.tree_.node_count for e in model.estimators_)
+        print(f"{depth:>6} {n_nodes:>10} {elapsed:>10.3f} {n_nodes/elapsed:>12.0f}")
+
+    return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--samples", type=int, default=100000)
+    parser.add_argument("--depths", type=int, nargs="+", default=[5, 10, 20, 30])
+    parser.add_argument("--trees", type=int, default=10)
+    args = parser.parse_args()
+
+    main(args.samples, args.depths, args.trees)
@@ -2,25 +2,22 @@
 
 import os
 import ee
-from ee.ee_exception import EEException
 import gcsfs
 import logging
 import datetime
 import numpy as np
 import pandas as pd
-from scipy import stats
-import multiprocessing as mp
-from functools import partial
 from pprint import pformat
 from sklearn import metrics, model_selection, preprocessing
 from hydrafloods import (
     datasets,
     timeseries,
     ml,
-    utils,
     geeutils,
     thresholding,
     decorators,
+    tiling,
+    cache,
 )
 
 # temporary to see what is going on
@@ -39,8 +36,41 @@ def export_fusion_samples(
     output_asset_path=None,
     export_kwargs=None,
     skip_empty=True,
+    grid=None,
 ):
     """
+    Function to export training samples for the fusion model from the optical
+    images joined with Sentinel 1. All images are sampled with one server-side map
+    and exported as one table, so an image that fails to sample fails the whole
+    export task rather than ending the export at that image
+
+    Args:
+        region (ee.Geometry): region to sample images over
+        start_time (str | datetime.datetime): start time of the images to sample
+        end_time (str | datetime.datetime): end time of the images to sample
+
+    Keywords:
+        stratification_img (ee.Image): image with the class band to stratify samples by,
+            None samples randomly
+            default = None
+        sample_scale (float): scale in meters to sample at
+            default = 30
+        n_samples (int): number of samples per image, or per class if stratified
+            default = 100
+        img_limit (int): maximum number of images to sample, None samples all images
+            default = 1000
+        export_to (str): export destination, "asset" or "cloud"
+            default = "asset"
+        output_asset_path (str): asset id of the exported table
+            default = None
+        export_kwargs (dict): additional keywords for the export
+            default = None
+        skip_empty (bool): drop images without valid pixels in their footprint before
+            sampling so they do not count towards img_limit or fail stratified sampling
+            default = True
+        grid (ee.FeatureCollection): grid of cells to sample within the image footprints,
+            None samples the footprint bounds
+            default = None
     """
 
     export_opts = dict(
@@ -62,64 +92,83 @@ def export_fusion_samples(
 
     ds = optical.join(s1)
 
-    n = img_limit if img_limit is not None else ds.n_images
-    img_list = ds.collection.toList(n)
-
-    output_features = ee.FeatureCollection([])
+    collection = ds.collection
+    if skip_empty:
+        # count the valid pixels of each image server-side and drop the empty
+        # images before sampling them, reduceRegion gives null for no pixels
+        def _valid_pixels(img):
+            count = img.select(0).reduceRegion(
+                reducer=ee.Reducer.count(),
+                geometry=img.geometry().bounds(),
+                scale=sample_scale,
+                bestEffort=True,
+                tileScale=16,
+            )
+            return img.set("valid_pixels", count.values().get(0))
 
-    for i in range(n):
-        try:
-            sample_img = ee.Image(img_list.get(i))
+        collection = collection.map(_valid_pixels).filter(
+            ee.Filter.And(
+                ee.Filter.notNull(["valid_pixels"]), ee.Filter.gt("valid_pixels", 0)
+            )
+        )
 
+    n = img_limit if img_limit is not None else ds.n_images
+    img_list = collection.toList(n)
+
+    def _sample(i):
+        i = ee.Number(i)
+        sample_img = ee.Image(img_list.get(i))
+
+        if grid is not None:
+            # sample only the grid cells over the image footprint
+            sample_region = tiling.footprint_cells(
+                grid, sample_img.geometry()
+            ).geometry()
+        else:
             sample_region = sample_img.geometry().bounds()
 
-            if stratification_img is not None:
-                class_band = stratification_img.bandNames().get(0)
-                classes = ee.Dictionary(
-                    stratification_img.reduceRegion(
-                        reducer=ee.Reducer.frequencyHistogram(),
-                        geometry=sample_region,
-                        scale=sample_scale,
-                        bestEffort=True,
-                        maxPixel=1e7,
-                    ).get(class_band)
-                ).keys()
-
-                samples = sample_img.addBands(
-                    stratification_img.select(class_band)
-                ).stratifiedSample(
-                    region=sample_region,
-                    numPoints=n_samples,
-                    classBand=class_band,
+        if stratification_img is not None:
+            class_band = stratification_img.bandNames().get(0)
+            classes = ee.Dictionary(
+                stratification_img.reduceRegion(
+                    reducer=ee.Reducer.frequencyHistogram(),
+                    geometry=sample_region,
                     scale=sample_scale,
-                    seed=i,
-                    classValues=classes,
-                    classPoints=ee.List.repeat(n_samples, classes.size()),
-                    tileScale=16,
-                    geometries=True,
-                )
+                    bestEffort=True,
+                    maxPixel=1e7,
+                ).get(class_band)
+            ).keys()
+
+            samples = sample_img.addBands(
+                stratification_img.select(class_band)
+            ).stratifiedSample(
+                region=sample_region,
+                numPoints=n_samples,
+                classBand=class_band,
+                scale=sample_scale,
+                seed=i,
+                classValues=classes,
+                classPoints=ee.List.repeat(n_samples, classes.size()),
+                tileScale=16,
+                geometries=True,
+            )
 
-            else:
-                samples = sample_img.sample(
-                    region=sample_region,
-                    scale=sample_scale,
-                    numPixels=n_samples,
-                    seed=i,
-                    tileScale=16,
-                    geometries=True,
-                )
+        else:
+            samples = sample_img.sample(
+                region=sample_region,
+                scale=sample_scale,
+                numPixels=n_samples,
+                seed=i,
+                tileScale=16,
+                geometries=True,
+            )
 
-            if skip_empty:
-                output_features = (
-                    output_features.merge(samples)
-                    if samples.size().getInfo() > 0
-                    else output_features
-                )
-            else:
-                output_features = output_features.merge(samples)
+        return samples
 
-        except EEException as e:
-            break
+    # sample all images with one server-side map instead of a client-side loop with a
+    # size request per image
+    indices = ee.List.sequence(0, img_list.size()).slice(0, -1)
+    output_features = ee.FeatureCollection(indices.map(_sample)).flatten()
 
     export_info = dict(collection=output_features, assetId=output_asset_path)
     print(export_info)
@@ -152,19 +201,12 @@ def build_fusion_model(
     output_training_report=True,
     filter_outliers=False,
     seed=0,
+    sample_cache=None,
 ):
 
     # framework options = [sklearn, xgboost, lightgbm]
 
-    if sample_path.startswith("gs://"):
-        tables = utils.list_gcs_objs(sample_path.replace("gs://", ""), pattern="*.csv")
-    else:
-        raise NotImplementedError(
-            "Currently only fetching data from Google Cloud Storage is supported"
-        )
-
-    df_list = (pd.read_csv(table) for table in tables)
-    df = pd.concat(df_list, axis=0, ignore_index=True)
+    df = ml.read_samples(sample_path, features, label, cache=sample_cache)
 
     X = df[features]
     y = df[label]
@@ -174,32 +216,9 @@ def build_fusion_model(
 
     if filter_outliers:
         logging.info(f"applying filters on feature coluns")
-        α = 0.05
-        z_threshold = 3
-        masks = np.ones(df.shape)
-        for i, feature in enumerate(list(X.columns)):
-            values = X[feature]
-            # ratio of number of unique values to the total number of unique values
-            # probability is less than α thereshold then do not filter outliers
-            is_categorical = 1.0 * np.unique(values).size / values.size < α
-            if is_categorical:
-                logging.info(f"{feature} is categorial, passing filter")
-                continue
-
-            k2, p = stats.normaltest(values)
-            if p < α:
-                logging.info(f"{feature} is gaussian, using z-score filter")
-                z = np.abs(stats.zscore(values))
-                masks[:, i] = z < z_threshold
-
-            else:
-                logging.info(f"{feature} is not gaussian, using iqr filter")
-                q1, q3 = stats.iqr(values)
-                iqr = q3 - q1
-                masks[:, i] = (values > (q1 - 1.5 * iqr)) & (values < (q3 + 1.5 * iqr))
-
-        X = X[masks.any(axis=1)]
-        y = y[masks.any(axis=1)]
+        mask, _ = ml.outlier_mask(X.to_numpy(np.float32), feature_names, seed=seed)
+        X = X[mask]
+        y = y[mask]
 
     if output_training_report:
         X_train, X_test, y_train, y_test = model_selection.train_test_split(
@@ -291,12 +310,7 @@ def build_fusion_model(
     #         f.write(string)
 
     tree_properties = {}
-    # args = [(est,features) for est in estimators]
-    with mp.Pool(7) as pool:
-        proc = pool.map_async(
-            partial(ml.sklearn_tree_to_string, feature_names=features), estimators
-        )
-        trees = list(proc.get())
+    trees = [ml.sklearn_tree_to_string(est, features) for est in estimators]
 
     df = pd.DataFrame(
         {
@@ -370,7 +384,7 @@ def _fuse_dataset(
         max_img = scaling_img.select(".*_max")
         s1.collection = s1.collection.map(_apply_scaling)
 
-    feature_names = ee.Image(s1.collection.first()).bandNames().getInfo()
+    feature_names = cache.get_info(ee.Image(s1.collection.first()).bandNames())
 
     s1.collection = s1.collection.map(_apply_fusion)
 
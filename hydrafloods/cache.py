@@ -0,0 +1,215 @@
+import os
+import ee
+import copy
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+# collections that are still ingesting images (i.e. near real-time MODIS, VIIRS and
+# Sentinel-1) change size within a session, their metadata is only reused for 10 minutes
+METADATA_TTL = 600
+
+
+class ResultCache:
+    """
+    Content-addressed cache for getInfo() results. Objects are keyed on a hash of
+    their serialized expression graph so identical requests are only sent once.
+    Results are kept in an in-memory LRU and optionally in an on-disk SQLite
+    database so that results persist between runs. Results are returned as copies
+    so callers can modify them without changing the cached values
+
+    Keywords:
+        maxsize (int): maximum number of results to keep in memory
+            default = 256
+        path (str): path to SQLite database file for persistent results, None uses memory only
+            default = None
+        ttl (float): time in seconds results are valid for, None never expires results
+            default = None
+    """
+
+    def __init__(self, maxsize=256, path=None, ttl=None):
+        self.maxsize = maxsize
+        self.path = path
+        self.ttl = ttl
+
+        self._memory = OrderedDict()
+        self._lock = threading.RLock()
+        self._counters = dict(hits=0, misses=0, memory_hits=0, disk_hits=0)
+
+        self._db = None
+        if path is not None:
+            path = os.path.expanduser(path)
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, value TEXT, created REAL)"
+            )
+            self._evict_expired()
+
+        return
+
+    @staticmethod
+    def key(ee_object):
+        """
+        Returns the sha256 hash of the serialized expression graph of an object
+        """
+        graph = ee.serializer.encode(ee_object, for_cloud_api=True)
+        serialized = json.dumps(graph, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def _expired(self, created, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        return ttl is not None and (time.time() - created) > ttl
+
+    def _evict_expired(self):
+        if self.ttl is not None:
+            with self._lock:
+                self._db.execute(
+                    "DELETE FROM results WHERE created < ?", (time.time() - self.ttl,)
+                )
+                self._db.commit()
+        return
+
+    def _remember(self, key, value, created):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+        return
+
+    def get(self, key, ttl=None):
+        """
+        Looks up a result by key, returns a (found, value) tuple. ttl overrides the
+        time in seconds the result is valid for
+        """
+        with self._lock:
+            if key in self._memory:
+                value, created = self._memory[key]
+                if not self._expired(created, ttl):
+                    self._memory.move_to_end(key)
+                    self._counters["hits"] += 1
+                    self._counters["memory_hits"] += 1
+                    return True, copy.deepcopy(value)
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created FROM results WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and not self._expired(row[1], ttl):
+                    value = json.loads(row[0])
+                    self._remember(key, value, row[1])
+                    self._counters["hits"] += 1
+                    self._counters["disk_hits"] += 1
+                    return True, copy.deepcopy(value)
+
+            self._counters["misses"] += 1
+
+        return False, None
+
+    def put(self, key, value):
+        """
+        Stores a result in memory and, if configured, on disk
+        """
+        created = time.time()
+        with self._lock:
+            self._remember(key, copy.deepcopy(value), created)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (key, value, created) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), created),
+                )
+                self._db.commit()
+        return
+
+    def get_info(self, ee_object, ttl=None):
+        """
+        Drop-in replacement for ee_object.getInfo() that returns cached results,
+        ttl overrides the time in seconds a cached result is valid for
+        """
+        key = self.key(ee_object)
+        found, value = self.get(key, ttl)
+        if not found:
+            value = ee_object.getInfo()
+            self.put(key, value)
+        return value
+
+    def stats(self):
+        """
+        Returns a dictionary of the hit/miss counters and number of results in memory
+        """
+        with self._lock:
+            return dict(**self._counters, size=len(self._memory))
+
+    def clear(self):
+        """
+        Removes all results from memory and disk and resets the counters
+        """
+        with self._lock:
+            self._memory.clear()
+            self._counters = {k: 0 for k in self._counters}
+            if self._db is not None:
+                self._db.execute("DELETE FROM results")
+                self._db.commit()
+        return
+
+
+_cache = ResultCache()
+
+
+def configure(maxsize=256, path=None, ttl=None):
+    """
+    Function to replace the package wide result cache, i.e. to add an on-disk tier
+
+    Keywords:
+        maxsize (int): maximum number of results to keep in memory
+            default = 256
+        path (str): path to SQLite database file for persistent results, None uses memory only
+            default = None
+        ttl (float): time in seconds results are valid for, None never expires results
+            default = None
+
+    Returns:
+        cache (ResultCache): the new package wide cache
+    """
+    global _cache
+    _cache = ResultCache(maxsize=maxsize, path=path, ttl=ttl)
+    return _cache
+
+
+def get_info(ee_object, ttl=None):
+    """
+    Function to request an Earth Engine object client-side through the package wide cache
+
+    Args:
+        ee_object (ee.ComputedObject): Earth Engine object to request
+
+    Keywords:
+        ttl (float): time in seconds a cached result is valid for, i.e. METADATA_TTL for
+            results that change while collections ingest new images. None uses the cache ttl
+            default = None
+
+    Returns:
+        result of ee_object.getInfo()
+    """
+    return _cache.get_info(ee_object, ttl)
+
+
+def stats():
+    """
+    Function to get the hit/miss counters of the package wide cache
+    """
+    return _cache.stats()
+
+
+def clear():
+    """
+    Function to clear all results from the package wide cache
+    """
+    return _cache.clear()
@@ -6,7 +6,7 @@ import math
 import datetime
 from pprint import pformat
 from ee.ee_exception import EEException
-from hydrafloods import geeutils, thresholding, fusion, fetch, preprocess, utils, filtering
+from hydrafloods import geeutils, thresholding, fusion, fetch, preprocess, utils, filtering, ensemble
 
 
 BANDREMAP = ee.Dictionary({
@@ -161,24 +161,24 @@ class Atms(hfCollection):
 
         return
 
-    def waterMap(self, hand, permanent=None, probablistic=False, nIters=100, elvStdDev=6, probTreshold=0.75):
-        def _downscaleWrapper(iteration):
-            i = ee.Number(iteration)
-            handErr = hand.add(ee.Image.random(i).subtract(0.5).multiply(6)
-                               .multiply(elvStdDev))
-            return downscale.bathtub(inImage, handErr, permanent)
+    def waterMap(self, hand, permanent=None, probablistic=False, nIters=100, elvStdDev=6, probTreshold=0.75,
+                 batchSize=10, tolerance=None, convergenceScale=None):
+        def _members(seeds):
+            return ensemble.bathtub_members(inImage, hand, seeds, permanent, elvStdDev)
 
         inImage = self.collection.mean().divide(10000)
         if probablistic:
-            iters = ee.List.sequence(0, nIters - 1)
+            if convergenceScale is None:
+                convergenceScale = inImage.projection().nominalScale()
 
-            sims = ee.ImageCollection(iters.map(_downscaleWrapper))
-            probs = sims.sum().divide(nIters).rename(['probability', 'error'])
-            water = probs.select(['probability'], ['water']).gt(probTreshold)
-            mapResult = water.addBands(probs.multiply(10000).uint16())
+            probs, self.nIters = ensemble.run(_members, nIters, batchSize, tolerance=tolerance,
+                                              region=self.region, scale=convergenceScale)
+            error = fusion.bathtub_cdf(inImage, hand, permanent).select('error')
+            water = probs.gt(probTreshold).rename('water')
+            mapResult = water.addBands(probs.addBands(error).multiply(10000).uint16())
 
         else:
-            mapResult = downscale.bathtub(inImage, hand, permanent)
+            mapResult = fusion.bathtub(inImage, hand, permanent)
 
         return mapResult
 
@@ -221,20 +221,22 @@ class Viirs(hfCollection):
         self.downscaled = result
         return
 
-    def waterMap(self, target_date, hand, probablistic=False, nIters=100, probTreshold=0.75, **kwargs):
+    def waterMap(self, target_date, hand, probablistic=False, nIters=100, probTreshold=0.75,
+                 batchSize=10, tolerance=None, convergenceScale=500, **kwargs):
         def _threholdWrapper(iteration):
             i = ee.Number(iteration)
             sim = geeutils.globalOtsu(
                 self.downscaled, target_date, self.region, seed=i, **kwargs)
             return sim.And(hand.lt(30))
 
+        def _members(seeds):
+            return ee.Image.cat([_threholdWrapper(seed) for seed in seeds])
+
         tDate = ee.Date(target_date)
 
         if probablistic:
-            iters = ee.List.sequence(0, nIters - 1)
-
-            sims = ee.ImageCollection(iters.map(_threholdWrapper))
-            probs = sims.sum().divide(nIters).rename(['probability'])
+            probs, self.nIters = ensemble.run(_members, nIters, batchSize, tolerance=tolerance,
+                                              region=self.region, scale=convergenceScale)
             water = probs.select(['probability']).gt(
                 probTreshold).rename('water')
             mapResult = water.addBands(probs.multiply(10000).uint16())
@@ -285,20 +287,22 @@ class Modis(hfCollection):
         self.downscaled = result
         return
 
-    def waterMap(self, target_date, hand, probablistic=False, nIters=100, probTreshold=0.75, **kwargs):
+    def waterMap(self, target_date, hand, probablistic=False, nIters=100, probTreshold=0.75,
+                 batchSize=10, tolerance=None, convergenceScale=500, **kwargs):
         def _threholdWrapper(iteration):
             i = ee.Number(iteration)
             sim = geeutils.globalOtsu(
                 self.downscaled, target_date, self.region, seed=i, **kwargs)
             return sim.And(hand.lt(30))
 
+        def _members(seeds):
+            return ee.Image.cat([_threholdWrapper(seed) for seed in seeds])
+
         tDate = ee.Date(target_date)
 
         if probablistic:
-            iters = ee.List.sequence(0, nIters - 1)
-
-            sims = ee.ImageCollection(iters.map(_threholdWrapper))
-            probs = sims.sum().divide(nIters).rename(['probability'])
+            probs, self.nIters = ensemble.run(_members, nIters, batchSize, tolerance=tolerance,
+                                              region=self.region, scale=convergenceScale)
             water = probs.select(['probability']).gt(
                 probTreshold).rename('water')
             mapResult = water.addBands(probs.multiply(10000).uint16())
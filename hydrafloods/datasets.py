@@ -1,8 +1,8 @@
 from __future__ import absolute_import
 import os
 import ee
-import math
 import copy
+import math
 import datetime
 from pprint import pformat
 from functools import partial
@@ -16,10 +16,93 @@ from hydrafloods import (
     preprocess,
     utils,
     filtering,
+    cache,
 )
 
 
+# band names of each sensor in the same order as the common "new" band names
+# plain python lists so band selections are literals in the expression graph
+BANDREMAP = {
+    "landsat7": ["B1", "B2", "B3", "B4", "B5", "B7"],
+    "landsat8": ["B2", "B3", "B4", "B5", "B6", "B7"],
+    "viirs": ["M2", "M4", "M5", "M7", "M10", "M11"],
+    "sen2": ["B2", "B3", "B4", "B8", "B11", "B12"],
+    "modis": [
+        "sur_refl_b03",
+        "sur_refl_b04",
+        "sur_refl_b01",
+        "sur_refl_b02",
+        "sur_refl_b06",
+        "sur_refl_b07",
+    ],
+    "new": ["blue", "green", "red", "nir", "swir1", "swir2"],
+}
+
+
+def register_sensor(name, bands):
+    """
+    Function to add the band names of a new sensor to BANDREMAP so datasets
+    can select and rename its bands to the common band names with
+    Dataset.select_sensor_bands
+
+    Args:
+        name (str): key to register the sensor under
+        bands (list): band names of the sensor in the order of BANDREMAP["new"]
+    """
+    if len(bands) != len(BANDREMAP["new"]):
+        raise ValueError(
+            f"sensor bands must map to the {len(BANDREMAP['new'])} common bands "
+            f"{BANDREMAP['new']}, got {len(bands)} bands"
+        )
+    BANDREMAP[name] = list(bands)
+    return
+
+
+class Pipeline:
+    """
+    Lazy record of per-image functions to map over an image collection.
+    Pipelines are immutable so copies of a dataset can share them, consecutive
+    functions are fused into a single ee.ImageCollection.map when materialized
+
+    Args:
+        collection (ee.ImageCollection): collection the functions are applied to
+
+    Keywords:
+        transforms (tuple): per-image functions to apply in order
+            default = ()
+    """
+
+    def __init__(self, collection, transforms=()):
+        self.collection = collection
+        self.transforms = tuple(transforms)
+        return
+
+    def then(self, func):
+        """
+        Returns a new pipeline with func appended to the transforms
+        """
+        return Pipeline(self.collection, self.transforms + (func,))
+
+    def materialize(self):
+        """
+        Returns the collection with all transforms applied in one map call
+        """
+        if len(self.transforms) == 0:
+            return self.collection
+
+        transforms = self.transforms
+
+        def _fused(img):
+            for func in transforms:
+                img = ee.Image(func(img))
+            return img
+
+        return self.collection.map(_fused)
+
+
 class Dataset:
+    BANDREMAP = BANDREMAP
+
     def __init__(self, region, start_time, end_time, asset_id="", use_qa=True):
         # TODO: add exceptions to check datatypes
         self.region = region  # dtype = ee.Geometry
@@ -28,36 +111,15 @@ class Dataset:
         self.asset_id = asset_id
         self.use_qa = use_qa
 
-        self.BANDREMAP = ee.Dictionary(
-            {
-                "landsat7": ee.List(["B1", "B2", "B3", "B4", "B5", "B7"]),
-                "landsat8": ee.List(["B2", "B3", "B4", "B5", "B6", "B7"]),
-                "viirs": ee.List(["M2", "M4", "M5", "M7", "M10", "M11"]),
-                "sen2": ee.List(["B2", "B3", "B4", "B8", "B11", "B12"]),
-                "modis": ee.List(
-                    [
-                        "sur_refl_b03",
-                        "sur_refl_b04",
-                        "sur_refl_b01",
-                        "sur_refl_b02",
-                        "sur_refl_b06",
-                        "sur_refl_b07",
-                    ]
-                ),
-                "new": ee.List(["blue", "green", "red", "nir", "swir1", "swir2"]),
-            }
-        )
-
         imgcollection = (
             ee.ImageCollection(self.asset_id)
             .filterBounds(self.region)
             .filterDate(self.start_time, self.end_time)
         )
 
+        self.collection = imgcollection
         if self.use_qa:
-            self.collection = imgcollection.map(self._qa)
-        else:
-            self.collection = imgcollection
+            self.apply_func(self._qa, inplace=True)
 
     def __repr__(self):
         if isinstance(self.start_time, datetime.datetime):
@@ -74,36 +136,78 @@ class Dataset:
             "asset_id": self.asset_id,
             "start_time": ststr,
             "end_time": etstr,
-            "region": self.region.coordinates().getInfo(),
+            "region": cache.get_info(self.region.coordinates()),
         }
         strRepr = pformat(objDict, depth=3)
         return f"HYDRAFloods Collection:\n{strRepr}"
 
     @property
     def collection(self):
-        return self._collection
+        # apply any pending transforms and keep the result so they are only mapped once
+        if self._pipeline.transforms:
+            self._pipeline = Pipeline(self._pipeline.materialize())
+        return self._pipeline.collection
 
     @collection.setter
     def collection(self, value):
-        self._collection = value
+        self._pipeline = Pipeline(value)
         return
 
     @property
     def n_images(self):
-        return self.collection.size().getInfo()
+        return cache.get_info(self.collection.size(), ttl=cache.METADATA_TTL)
 
     @property
     def dates(self):
         eeDates = self.collection.aggregate_array("system:time_start").map(
             lambda x: ee.Date(x).format("YYYY-MM-dd HH:mm:ss.SSS")
         )
-        return eeDates.getInfo()
+        return cache.get_info(eeDates, ttl=cache.METADATA_TTL)
+
+    def metadata(self, properties=None, **kwargs):
+        """
+        Fetches the id, time, footprint, band names and properties of every image
+        in the dataset with bulk requests, see geeutils.collection_metadata
+
+        Keywords:
+            properties (list): image properties to include, None includes all properties
+            **kwargs: keywords passed to geeutils.collection_metadata
+
+        Returns:
+            metadata (list): list of dictionaries with metadata for each image
+        """
+        return geeutils.collection_metadata(
+            self.collection, properties=properties, **kwargs
+        )
+
+    def __copy__(self):
+        # Earth Engine objects and pipelines are immutable so the copy can share
+        # them with the original, only the attribute dictionary is new
+        outCls = self.__class__.__new__(self.__class__)
+        outCls.__dict__.update(self.__dict__)
+        return outCls
+
+    def __deepcopy__(self, memo):
+        # recursively copying Earth Engine computation graphs is expensive and
+        # gives nothing as they are never modified in place, so share them and
+        # deep copy all other attributes
+        outCls = self.__class__.__new__(self.__class__)
+        memo[id(self)] = outCls
+        for key, value in self.__dict__.items():
+            if isinstance(value, (ee.ComputedObject, Pipeline)):
+                outCls.__dict__[key] = value
+            else:
+                outCls.__dict__[key] = copy.deepcopy(value, memo)
+        return outCls
 
     def copy(self):
         """
-        Returns a deep copy of the hydrafloods dataset class
+        Returns a copy of the hydrafloods dataset class
+        The copy shares the immutable Earth Engine state with the original so
+        copying is constant time, assigning a new collection to the copy does
+        not affect the original
         """
-        return copy.deepcopy(self)
+        return self.__copy__()
 
     def apply_qa(self):
         if self.use_qa:
@@ -119,24 +223,22 @@ class Dataset:
         Useful for setting geometries on unbounded imagery in collection
         """
 
+        # capture the region now so reassigning it later does not change this step
+        region = self.region
+
         @decorators.carry_metadata
         def clip(img):
-            return ee.Image(img.clip(self.region))
+            return ee.Image(img.clip(region))
 
-        clipped = self.collection.map(clip)
-        if inplace:
-            self.collection = clipped
-            return
-        else:
-            outCls = self.copy()
-            outCls.collection = clipped
-            return outCls
+        return self.apply_func(clip, inplace=inplace)
 
     def apply_func(self, func, inplace=False, **kwargs):
         """
         Wrapper method to apply a function to all of the image in the dataset
         Makes a copy of the collection and reassigns the image collection propety
-        Function must accept an ee.ImageCollection and return an ee.ImageCollection
+        Function must accept an ee.Image and return an ee.Image
+        The function is recorded lazily and fused with other consecutive functions
+        into one map call when the collection is accessed
 
         Args:
             func: Function to map across image collection
@@ -147,15 +249,42 @@ class Dataset:
         Returns:
             outCls: copy of class with results as image collection property
         """
-        func = partial(func, **kwargs)
+        if kwargs:
+            func = partial(func, **kwargs)
         if inplace:
-            self.collection = self.collection.map(func)
+            self._pipeline = self._pipeline.then(func)
             return
         else:
             outCls = self.copy()
-            outCls.collection = self.collection.map(func)
+            outCls._pipeline = self._pipeline.then(func)
             return outCls
 
+    def select_sensor_bands(self, sensor, inplace=False):
+        """
+        Selects the bands of a sensor in BANDREMAP and renames them to the common
+        band names, new sensors can be added with register_sensor
+
+        Args:
+            sensor (str): name of the sensor in BANDREMAP
+
+        Keywords:
+            inplace (bool): apply the selection to this dataset instead of a copy
+                default = False
+
+        Returns:
+            outCls: copy of class with the selected bands, None if inplace
+        """
+        if sensor not in BANDREMAP:
+            raise ValueError(
+                f"unknown sensor {sensor}, available sensors are {list(BANDREMAP)}"
+            )
+        return self.apply_func(
+            _select_bands,
+            inplace=inplace,
+            bands=BANDREMAP[sensor],
+            new_names=BANDREMAP["new"],
+        )
+
     def merge(self, dataset, inplace=False):
         merged = self.collection.merge(dataset.collection).sort("system:time_start")
 
@@ -205,6 +334,10 @@ class Dataset:
             return outCls
 
 
+def _select_bands(img, bands=None, new_names=None):
+    return img.select(bands, new_names)
+
+
 class Sentinel1(Dataset):
     def __init__(self, *args, asset_id="COPERNICUS/S1_GRD", **kwargs):
         super(Sentinel1, self).__init__(*args, asset_id=asset_id, **kwargs)
@@ -236,7 +369,7 @@ class Sentinel1(Dataset):
 
             return img.addBands(extraFeatures.clip(bounds))
 
-        self.collection = self.collection.map(_add_fusion_features)
+        self.apply_func(_add_fusion_features, inplace=True)
 
         return self.copy()
 
@@ -279,9 +412,8 @@ class Viirs(Dataset):
     def __init__(self, *args, asset_id="NOAA/VIIRS/001/VNP09GA", **kwargs):
         super(Viirs, self).__init__(*args, asset_id=asset_id, **kwargs)
 
-        self.collection = self.collection.select(
-            self.BANDREMAP.get("viirs"), self.BANDREMAP.get("new")
-        ).map(geeutils.add_indices)
+        self.select_sensor_bands("viirs", inplace=True)
+        self.apply_func(geeutils.add_indices, inplace=True)
 
         self.clip_to_region(inplace=True)
 
@@ -314,9 +446,8 @@ class Modis(Dataset):
     def __init__(self, *args, asset_id="MODIS/006/MOD09GA", **kwargs):
         super(Modis, self).__init__(*args, asset_id=asset_id, **kwargs)
 
-        self.collection = self.collection.select(
-            self.BANDREMAP.get("modis"), self.BANDREMAP.get("new")
-        ).map(geeutils.add_indices)
+        self.select_sensor_bands("modis", inplace=True)
+        self.apply_func(geeutils.add_indices, inplace=True)
 
         self.clip_to_region(inplace=True)
 
@@ -347,9 +478,8 @@ class Landsat8(Dataset):
     def __init__(self, *args, asset_id="LANDSAT/LC08/C01/T1_SR", **kwargs):
         super(Landsat8, self).__init__(*args, asset_id=asset_id, **kwargs)
 
-        self.collection = self.collection.select(
-            self.BANDREMAP.get("landsat8"), self.BANDREMAP.get("new")
-        ).map(geeutils.add_indices)
+        self.select_sensor_bands("landsat8", inplace=True)
+        self.apply_func(geeutils.add_indices, inplace=True)
 
         return
 
@@ -376,9 +506,7 @@ class Landsat7(Dataset):
     ):
         super(Landsat7, self).__init__(*args, asset_id=asset_id, **kwargs)
 
-        coll = self.collection.select(
-            self.BANDREMAP.get("landsat7"), self.BANDREMAP.get("new")
-        )
+        self.select_sensor_bands("landsat7", inplace=True)
 
         if apply_band_adjustment:
             # band bass adjustment coefficients taken from Roy et al., 2016 http://dx.doi.org/10.1016/j.rse.2015.12.024
@@ -388,9 +516,9 @@ class Landsat7(Dataset):
             self.bias = ee.Image.constant(
                 [0.0003, 0.0088, 0.0061, 0.0412, 0.0254, 0.0172]
             ).multiply(10000)
-            coll = coll.map(self._band_pass_adjustment)
+            self.apply_func(self._band_pass_adjustment, inplace=True)
 
-        self.collection = coll.map(geeutils.add_indices)
+        self.apply_func(geeutils.add_indices, inplace=True)
 
         return
 
@@ -423,9 +551,7 @@ class Sentinel2(Dataset):
     ):
         super(Sentinel2, self).__init__(*args, asset_id=asset_id, **kwargs)
 
-        coll = self.collection.select(
-            self.BANDREMAP.get("sen2"), self.BANDREMAP.get("new")
-        )
+        self.select_sensor_bands("sen2", inplace=True)
 
         if apply_band_adjustment:
             # band bass adjustment coefficients taken HLS project https://hls.gsfc.nasa.gov/algorithms/bandpass-adjustment/
@@ -435,9 +561,9 @@ class Sentinel2(Dataset):
             self.bias = ee.Image.constant(
                 [-0.00411, -0.00093, 0.00094, -0.0001, -0.0015, -0.0012]
             ).multiply(10000)
-            coll = coll.map(self._band_pass_adjustment)
+            self.apply_func(self._band_pass_adjustment, inplace=True)
 
-        self.collection = coll.map(geeutils.add_indices)
+        self.apply_func(geeutils.add_indices, inplace=True)
 
         return
 
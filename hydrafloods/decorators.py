@@ -8,8 +8,13 @@ def carry_metadata(func):
         # expects an element within args is img
         # will set the metadata to first ee.Image instance
         # this assumption is true for 99% of fuctions used for ee.ImageCollection.map()
-        result = ee.Image(func(*args, **kwargs))
-        img = [i for i in args if isinstance(i, ee.Image)][0]
+        result = func(*args, **kwargs)
+        images = [i for i in args if isinstance(i, ee.Image)]
+        # local array backends have no metadata to carry
+        if len(images) == 0:
+            return result
+        result = ee.Image(result)
+        img = images[0]
         return ee.Image(
             result.copyProperties(img).set(
                 "system:time_start", img.get("system:time_start")
@@ -0,0 +1,178 @@
+import ee
+import logging
+import numpy as np
+from hydrafloods import cache
+
+
+def uniform_noise(seeds, amplitude=1):
+    """
+    Function to create a multi-band image of uniform random noise centered on zero
+    with one independent band per seed
+
+    Args:
+        seeds (list): list of integer seeds, one per ensemble member
+
+    Keywords:
+        amplitude (float): width of the uniform distribution
+            default = 1
+
+    Returns:
+        noise (ee.Image): image with one band per seed named "m<seed>"
+    """
+    bands = [ee.Image.random(s).subtract(0.5).rename(f"m{s}") for s in seeds]
+    return ee.Image.cat(bands).multiply(amplitude)
+
+
+def bathtub_members(
+    wfrac, hand, seeds, permanent=None, elvStdDev=6, maxDepth=20, step=1
+):
+    """
+    Function to evaluate perturbed bathtub HAND fits for a batch of ensemble members
+    as one vectorized array image. Every member perturbs HAND with uniform noise and
+    the fill depth is read off the CDF of the perturbed HAND like fusion.bathtub_cdf,
+    all members and depth levels are reduced in a single reduceResolution
+
+    Args:
+        wfrac (ee.Image): water fraction image, values must be 0-1
+        hand (ee.Image): height above nearest drainage (HAND) image, units in meters
+        seeds (list): list of integer seeds, one per ensemble member
+
+    Keywords:
+        permanent (ee.Image): permanent water image to seed HAND filling
+            default = None
+        elvStdDev (float): standard deviation of the HAND error in meters
+            default = 6
+        maxDepth (float): maximum fill depth in meters
+            default = 20
+        step (float): spacing between the depth levels in meters
+            default = 1
+
+    Returns:
+        members (ee.Image): image with one water band per member
+    """
+    permWater = permanent if permanent else ee.Image(0)
+    proj = wfrac.projection()
+    nMembers = len(seeds)
+    nDepths = int(round(maxDepth / step)) + 1
+
+    perturbed = hand.add(uniform_noise(seeds, 6 * elvStdDev))
+
+    # filled fraction per depth level (axis 0) and member (axis 1)
+    filled = ee.Image.cat([perturbed.lte(i * step) for i in range(nDepths)]).Or(
+        permWater
+    )
+    cdf = (
+        filled.reduceResolution(
+            reducer=ee.Reducer.mean(), bestEffort=True, maxPixels=1024
+        )
+        .reproject(crs=proj)
+        .toArray()
+        .arrayReshape(ee.Image(ee.Array([nDepths, nMembers])), 2)
+    )
+
+    # linear interpolation of the depth where the CDF crosses the water fraction,
+    # each depth interval contributes the part of it that lies below the crossing
+    cdfLower = cdf.arraySlice(0, 0, nDepths - 1)
+    cdfUpper = cdf.arraySlice(0, 1, nDepths)
+    below = (
+        wfrac.subtract(cdfLower)
+        .divide(cdfUpper.subtract(cdfLower).max(1e-6))
+        .max(0)
+        .min(1)
+    )
+    depth = below.arrayReduce(ee.Reducer.sum(), [0]).arrayProject([1]).multiply(step)
+
+    water = perturbed.toArray().lte(depth).Or(permWater)
+
+    return water.arrayFlatten([[f"m{s}" for s in seeds]])
+
+
+def run(
+    member_func,
+    n_members=100,
+    batch_size=10,
+    seed=0,
+    tolerance=None,
+    region=None,
+    scale=None,
+    n_pixels=10000,
+):
+    """
+    Function to run a Monte Carlo ensemble in batches of members. Each batch is
+    evaluated as one multi-band image and batches are added until all members are
+    evaluated or the probability estimate has converged. Convergence is tested on a
+    fixed sample of pixels whose member counts are summed on the client, so every
+    batch only requests its own members from the server instead of the whole ensemble
+
+    Args:
+        member_func (callable): function that accepts a list of integer seeds and returns
+            an ee.Image with one binary band per seed, i.e. bathtub_members()
+
+    Keywords:
+        n_members (int): maximum number of ensemble members
+            default = 100
+        batch_size (int): number of members to evaluate per batch
+            default = 10
+        seed (int): seed of the first member
+            default = 0
+        tolerance (float): stop adding batches once the mean absolute change of the
+            probability within region is below this value, None evaluates all members
+            default = None
+        region (ee.Geometry): region to test convergence in, required with tolerance
+            default = None
+        scale (float): scale in meters to test convergence at, required with tolerance
+            default = None
+        n_pixels (int): approximate number of pixels sampled within region to test convergence
+            default = 10000
+
+    Returns:
+        probability (ee.Image): fraction of members classified as 1, with the number of
+            evaluated members set as the "ensemble_members" property
+        n (int): effective number of members that were evaluated
+    """
+    if tolerance is not None and (region is None or scale is None):
+        raise ValueError("region and scale are required to test for convergence")
+
+    total = None
+    sampled = None
+    n = 0
+    for start in range(0, n_members, batch_size):
+        seeds = list(range(seed + start, seed + min(start + batch_size, n_members)))
+        batch = ee.Image(member_func(seeds)).reduce(ee.Reducer.sum())
+
+        total = batch if total is None else total.add(batch)
+        n += len(seeds)
+
+        if tolerance is None or n >= n_members:
+            continue
+
+        # same seed and dropNulls=False keep the sampled pixels identical between batches,
+        # masked pixels are flagged with -1 so that the values stay aligned
+        counts = (
+            batch.unmask(-1)
+            .sample(
+                region=region,
+                scale=scale,
+                numPixels=n_pixels,
+                seed=0,
+                dropNulls=False,
+                geometries=False,
+            )
+            .aggregate_array("sum")
+        )
+        counts = np.array(cache.get_info(counts), dtype=np.float64)
+        counts[counts < 0] = np.nan
+
+        previous = None if sampled is None else sampled / (n - len(seeds))
+        sampled = counts if sampled is None else sampled + counts
+        if previous is None:
+            continue
+
+        change = float(np.nanmean(np.abs(sampled / n - previous)))
+        logging.info(f"ensemble members: {n}, mean probability change: {change}")
+        if change < tolerance:
+            break
+
+    probability = total.divide(n).rename("probability").set("ensemble_members", n)
+
+    return probability, n
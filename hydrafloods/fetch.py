@@ -1,8 +1,362 @@
 import os
+import time
+import sqlite3
+import hashlib
 import datetime
+import threading
 import requests
 import simplecmr as scmr
 from pathlib import Path
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+CMR_URL = "https://cmr.earthdata.nasa.gov"
+EARTHDATA_HOST = "urs.earthdata.nasa.gov"
+
+
+class EarthdataSession(requests.Session):
+    """
+    requests.Session that keeps the authorization header when data servers redirect
+    to and from the EarthData login host, requests drops it on cross-host redirects
+    """
+
+    def rebuild_auth(self, prepared_request, response):
+        original = urlparse(response.request.url).hostname
+        redirect = urlparse(prepared_request.url).hostname
+        if EARTHDATA_HOST in (original, redirect):
+            return
+        return super().rebuild_auth(prepared_request, response)
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter that spaces requests to the same host
+
+    Kwargs:
+        requests_per_second (float): maximum requests per second to each host, None disables the limit
+            default = None
+    """
+
+    def __init__(self, requests_per_second=None):
+        self.interval = 1 / requests_per_second if requests_per_second else 0
+        self._next = {}
+        self._lock = threading.Lock()
+        return
+
+    def wait(self, url):
+        """
+        Blocks until a request to the host of url is allowed
+        """
+        if not self.interval:
+            return
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next.get(host, now))
+            self._next[host] = start + self.interval
+        time.sleep(max(0, start - now))
+        return
+
+
+class DownloadManager:
+    """
+    Concurrent downloader for granule urls. Downloads reuse keep-alive connections from
+    one session, failed requests are retried with exponential backoff, partial files are
+    resumed with ranged requests and completed granules are recorded in a SQLite manifest
+    with their size and sha256 checksum so repeat runs skip files that are already on disk.
+    Local file names are prefixed with a hash of the url so granules with the same name
+    from different urls do not overwrite each other
+
+    Args:
+        directory (str|pathlib.Path): Local directory to download data to
+
+    Kwargs:
+        credentials (tuple|list): EarthData username and password login credentials as iterable
+            default = None
+        max_workers (int): number of concurrent downloads
+            default = 4
+        requests_per_second (float): maximum requests per second to each host, None disables the limit
+            default = None
+        manifest (str|pathlib.Path): path to the SQLite manifest
+            default = None (<directory>/.manifest.sqlite)
+        verify (bool): recompute the checksum of files in the manifest before skipping them
+            default = False
+        chunk_size (int): number of bytes to read from the stream at once
+            default = 1048576
+        timeout (float): seconds to wait for the server to respond
+            default = 60
+        retries (int): number of times a download is retried after network errors, server
+            errors or incomplete responses
+            default = 3
+        backoff (float): seconds to wait before the first retry, doubled for every further retry
+            default = 1
+        session (requests.Session): session to use for requests, i.e. for a local test server.
+            The session is used as is, connection pools are only sized for sessions the manager creates
+            default = None (EarthdataSession with the credentials)
+    """
+
+    def __init__(
+        self,
+        directory,
+        credentials=None,
+        max_workers=4,
+        requests_per_second=None,
+        manifest=None,
+        verify=False,
+        chunk_size=2**20,
+        timeout=60,
+        retries=3,
+        backoff=1,
+        session=None,
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_workers = max_workers
+        self.verify = verify
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.limiter = RateLimiter(requests_per_second)
+
+        self._owns_session = session is None
+        if session is None:
+            session = EarthdataSession()
+            if credentials is not None:
+                session.auth = tuple(credentials)
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=max_workers, pool_maxsize=max_workers
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+
+        manifest = manifest or self.directory / ".manifest.sqlite"
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(manifest), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS granules "
+            "(url TEXT PRIMARY KEY, path TEXT, size INTEGER, sha256 TEXT, completed REAL)"
+        )
+        self._db.commit()
+        return
+
+    def completed(self, url):
+        """
+        Returns the local path of a granule if it was downloaded and is unchanged, otherwise None
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT path, size, sha256 FROM granules WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+
+        path, size, checksum = row
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            return None
+        if self.verify:
+            digest = hashlib.sha256()
+            _hash_file(path, digest)
+            if digest.hexdigest() != checksum:
+                return None
+        return Path(path)
+
+    def _record(self, url, path, size, checksum):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO granules VALUES (?, ?, ?, ?, ?)",
+                (url, str(path), size, checksum, time.time()),
+            )
+            self._db.commit()
+        return
+
+    def download(self, url):
+        """
+        Downloads a single url, resuming a partial download if there is one and retrying
+        failed attempts
+
+        Args:
+            url (str): url of the granule
+
+        Returns:
+            Local path of the granule
+        """
+        path = self.completed(url)
+        if path is not None:
+            return path
+
+        for attempt in range(self.retries + 1):
+            try:
+                return self._download(url)
+            except IOError as e:
+                if attempt == self.retries or not _retryable(e):
+                    raise
+                time.sleep(self.backoff * 2**attempt)
+
+    def _download(self, url):
+        path = self.directory / _local_name(url)
+        partial = path.with_name(path.name + ".part")
+
+        digest = hashlib.sha256()
+        offset = 0
+        if partial.exists():
+            offset = _hash_file(partial, digest)
+
+        # ask for the file as is, ranges and lengths of compressed responses refer to
+        # the encoded bytes and not to the bytes written to disk
+        headers = {"Accept-Encoding": "identity"}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        self.limiter.wait(url)
+        with self.session.get(
+            url, headers=headers, stream=True, timeout=self.timeout
+        ) as response:
+            if response.status_code == 416:
+                # nothing is left after offset, the partial file is only complete if
+                # it has the size of the remote file from the Content-Range header
+                total = response.headers.get("Content-Range", "").rpartition("/")[2]
+                if total != str(offset):
+                    partial.unlink()
+                    raise IOError(
+                        f"partial download of {url} has {offset} bytes, remote file has {total or 'unknown'}"
+                    )
+            else:
+                response.raise_for_status()
+                if offset and response.status_code != 206:
+                    # server ignored the range request, start over
+                    digest = hashlib.sha256()
+                    offset = 0
+                expected = response.headers.get("Content-Length")
+                if response.headers.get("Content-Encoding", "identity") != "identity":
+                    # Content-Length counts the encoded bytes, iter_content decodes them
+                    expected = None
+                with open(partial, "ab" if offset else "wb") as f:
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        f.write(chunk)
+                        digest.update(chunk)
+
+                size = partial.stat().st_size
+                if expected is not None and size != offset + int(expected):
+                    raise IOError(
+                        f"incomplete download of {url}, received {size - offset} of {expected} bytes"
+                    )
+
+        os.replace(partial, path)
+        self._record(url, path, path.stat().st_size, digest.hexdigest())
+
+        return path
+
+    def fetch(self, urls):
+        """
+        Downloads urls concurrently, granules in the manifest are skipped
+
+        Args:
+            urls (list): urls of the granules
+
+        Returns:
+            List of local paths that data was downloaded to
+        """
+        urls = list(dict.fromkeys(urls))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self.download, urls))
+
+    def close(self):
+        """
+        Closes the manifest and the session if it was created by the manager
+        """
+        if self._owns_session:
+            self.session.close()
+        self._db.close()
+        return
+
+
+def _local_name(url):
+    # the hash prefix has no dots so the fields of dotted granule names keep their position
+    name = os.path.basename(urlparse(url).path)
+    return f"{hashlib.sha256(url.encode('utf-8')).hexdigest()[:10]}_{name}"
+
+
+def _retryable(error):
+    # network errors, server errors and incomplete downloads are retried, client errors
+    # like a missing granule or failed login are not
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status in (408, 429) or status >= 500
+    return True
+
+
+def _hash_file(path, digest, chunk_size=2**20):
+    # updates digest with the contents of a file and returns the number of bytes read
+    size = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+            size += len(chunk)
+    return size
+
+
+def search_granules(
+    conceptid,
+    start_time,
+    end_time,
+    region,
+    max_results=500,
+    cmr_url=CMR_URL,
+    session=None,
+):
+    """
+    Function to search CMR for granules and extract their data download urls
+
+    Args:
+        conceptid (str): String of dataset concept id to search for
+        start_time (datetime.datetime): Start of the search period
+        end_time (datetime.datetime): End of the search period
+        region (tuple|list): Bounding box of region to search as iterable in W,S,E,N order
+
+    Kwargs:
+        max_results (int): Maximum number of granules to return
+            default = 500
+        cmr_url (str): Base url of the CMR search API, i.e. for a local test server
+            default = "https://cmr.earthdata.nasa.gov"
+        session (requests.Session): session to use for requests
+            default = None
+
+    Returns:
+        List of granule data urls
+    """
+    session = session or requests.Session()
+    params = {
+        "collection_concept_id": conceptid,
+        "temporal": ",".join(
+            t.strftime("%Y-%m-%dT%H:%M:%SZ") for t in (start_time, end_time)
+        ),
+        "bounding_box": ",".join(str(v) for v in region),
+        "page_size": min(max_results, 2000),
+    }
+
+    urls = []
+    page = 1
+    while len(urls) < max_results:
+        response = session.get(
+            f"{cmr_url}/search/granules.json", params=dict(params, page_num=page)
+        )
+        response.raise_for_status()
+        entries = response.json()["feed"]["entry"]
+        if not entries:
+            break
+        for entry in entries:
+            links = [
+                link["href"]
+                for link in entry.get("links", [])
+                if link.get("rel", "").endswith("/data#")
+                and not link.get("inherited", False)
+            ]
+            if links:
+                urls.append(links[0])
+        page += 1
+
+    return urls[:max_results]
 
 
 def fetching(
@@ -13,10 +367,16 @@ def fetching(
     out_directory,
     max_results=500,
     end_time=None,
+    max_workers=4,
+    requests_per_second=None,
+    cmr_url=CMR_URL,
+    session=None,
 ):
     """
     Function to download data from NASA by specifying a datase, time and region.
-    Uses CMR to handle spatio-temporal query and extracts data download urls
+    Uses CMR to handle spatio-temporal query and extracts data download urls, the
+    granules are downloaded with a DownloadManager so interrupted downloads are resumed
+    and granules that were already downloaded to out_directory are skipped
 
     Args:
         conceptid (str): String of dataset concept id to search for
@@ -29,6 +389,14 @@ def fetching(
             default = 500
         end_time (str): Date as string preferrably as ISO8601 format (YYYY-MM-dd)
             default = None (end_time = start_time + 1day)
+        max_workers (int): number of concurrent downloads
+            default = 4
+        requests_per_second (float): maximum requests per second to each host, None disables the limit
+            default = None
+        cmr_url (str): Base url of the CMR search API
+            default = "https://cmr.earthdata.nasa.gov"
+        session (requests.Session): session to use for requests, i.e. for a local test server
+            default = None (EarthdataSession with the credentials)
 
     Returns:
         List of local paths that data was downloaded to
@@ -40,25 +408,30 @@ def fetching(
     else:
         end_time = scmr.utils.decode_date(end_time)
 
-    # construct query
-    query = scmr.Query(
-        conceptid=conceptid,
-        startTime=start_time,
-        endTime=end_time,
-        spatialExtent=region,
-        maxResults=max_results,
+    urls = search_granules(
+        conceptid,
+        start_time,
+        end_time,
+        region,
+        max_results=max_results,
+        cmr_url=cmr_url,
+        session=session,
     )
 
-    # fetch datasets from query
-    query.granules.fetch(
+    manager = DownloadManager(
+        out_directory,
         credentials=credentials,
-        directory=out_directory,
-        limit=max_results,
-        maxWorkers=4,
+        max_workers=max_workers,
+        requests_per_second=requests_per_second,
+        session=session,
     )
+    try:
+        paths = manager.fetch(urls)
+    finally:
+        manager.close()
 
     # return a list of the granules for later processing
-    return query.granules.getLocalPaths(directory=out_directory)
+    return paths
 
 
 def viirs(
@@ -67,6 +440,7 @@ def viirs(
     end_time=None,
     region=[-180, 60, 180, 85],
     out_directory="./",
+    **kwargs,
 ):
     """
     Function to download Suomi-NPP VIIRS surface reflectance data for specified time and region,
@@ -84,6 +458,7 @@ def viirs(
             default = [-180,60,180,85]
         out_directory (str|pathlib.Path): Local directory to downaload data to
             default = './' (current working directory)
+        **kwargs: additional keywords passed to fetching(), i.e. max_workers
 
     Returns:
         List of local paths that data was downloaded to
@@ -107,6 +482,7 @@ def viirs(
         out_directory=out_directory,
         max_results=500,
         end_time=end_time,
+        **kwargs,
     )
 
 
@@ -116,6 +492,7 @@ def modis(
     end_time=None,
     region=[-180, 60, 180, 85],
     out_directory="./",
+    **kwargs,
 ):
     """
     Function to download Terra MODIS surface reflectance data for specified time and region,
@@ -133,6 +510,7 @@ def modis(
             default = [-180,60,180,85]
         out_directory (str|pathlib.Path): Local directory to downaload data to
             default = './' (current working directory)
+        **kwargs: additional keywords passed to fetching(), i.e. max_workers
 
     Returns:
         List of local paths that data was downloaded to
@@ -156,6 +534,7 @@ def modis(
         out_directory=out_directory,
         max_results=500,
         end_time=end_time,
+        **kwargs,
     )
 
 
@@ -165,6 +544,7 @@ def atms(
     end_time=None,
     region=[-180, 60, 180, 85],
     out_directory="./",
+    **kwargs,
 ):
     """
     Function to download Suomi-NPP ATMS passive microwave data for specified time and region,
@@ -182,6 +562,7 @@ def atms(
             default = [-180,60,180,85]
         out_directory (str|pathlib.Path): Local directory to downaload data to
             default = './' (current working directory)
+        **kwargs: additional keywords passed to fetching(), i.e. max_workers
 
     Returns:
         List of local paths that data was downloaded to
@@ -196,4 +577,5 @@ def atms(
         out_directory=out_directory,
         max_results=500,
         end_time=end_time,
+        **kwargs,
     )
@@ -1,6 +1,48 @@
 import ee
 import math
+import functools
 from hydrafloods import geeutils, decorators
+from hydrafloods.local.filtering import SIGMA_LOOKUP
+
+
+@functools.lru_cache(maxsize=None)
+def _square_kernel(window, focus):
+    # kernels are cached so every mapped image references the same kernel objects
+    weights = [[1] * window] * window
+    return ee.Kernel.fixed(window, window, weights, focus, focus, False)
+
+
+@functools.lru_cache(maxsize=None)
+def _refined_lee_kernels():
+    # Use a sample of the 3x3 windows inside a 7x7 windows to determine gradients and directions
+    sample_weights = [
+        [0, 0, 0, 0, 0, 0, 0],
+        [0, 1, 0, 1, 0, 1, 0],
+        [0, 0, 0, 0, 0, 0, 0],
+        [0, 1, 0, 1, 0, 1, 0],
+        [0, 0, 0, 0, 0, 0, 0],
+        [0, 1, 0, 1, 0, 1, 0],
+        [0, 0, 0, 0, 0, 0, 0],
+    ]
+
+    # Set up the 7*7 kernels for directional statistics
+    rect_weights = [[0] * 7] * 3 + [[1] * 7] * 4
+    diag_weights = [[1] * (i + 1) + [0] * (6 - i) for i in range(7)]
+
+    rect_kernel = ee.Kernel.fixed(7, 7, rect_weights, 3, 3, False)
+    diag_kernel = ee.Kernel.fixed(7, 7, diag_weights, 3, 3, False)
+
+    # directional kernels in the same order as the directions 1-8
+    directional = []
+    for i in range(4):
+        directional.append(rect_kernel.rotate(i) if i > 0 else rect_kernel)
+        directional.append(diag_kernel.rotate(i) if i > 0 else diag_kernel)
+
+    return dict(
+        kernel3=_square_kernel(3, 1),
+        sample=ee.Kernel.fixed(7, 7, sample_weights, 3, 3, False),
+        directional=directional,
+    )
 
 
 @decorators.carry_metadata
@@ -8,65 +50,14 @@ def lee_sigma(img, window=9, sigma=0.9, looks=4, tk=7):
     bandNames = img.bandNames()
 
     midPt = (window // 2) + 1 if (window % 2) != 0 else window // 2
-    kernelWeights = ee.List.repeat(ee.List.repeat(1, window), window)
-    kernel = ee.Kernel.fixed(window, window, kernelWeights, midPt, midPt)
-
-    targetWeights = ee.List.repeat(ee.List.repeat(1, 3), 3)
-    targetkernel = ee.Kernel.fixed(3, 3, targetWeights, 1, 1)
-
-    # Lookup table for range and eta values for intensity
-    sigmaLookup = ee.Dictionary(
-        {
-            1: ee.Dictionary(
-                {
-                    0.5: ee.Dictionary({"A1": 0.436, "A2": 1.92, "η": 0.4057}),
-                    0.6: ee.Dictionary({"A1": 0.343, "A2": 2.21, "η": 0.4954}),
-                    0.7: ee.Dictionary({"A1": 0.254, "A2": 2.582, "η": 0.5911}),
-                    0.8: ee.Dictionary({"A1": 0.168, "A2": 3.094, "η": 0.6966}),
-                    0.9: ee.Dictionary({"A1": 0.084, "A2": 3.941, "η": 0.8191}),
-                    0.95: ee.Dictionary({"A1": 0.043, "A2": 4.840, "η": 0.8599}),
-                }
-            ),
-            2: ee.Dictionary(
-                {
-                    0.5: ee.Dictionary({"A1": 0.582, "A2": 1.584, "η": 0.2763}),
-                    0.6: ee.Dictionary({"A1": 0.501, "A2": 1.755, "η": 0.3388}),
-                    0.7: ee.Dictionary({"A1": 0.418, "A2": 1.972, "η": 0.4062}),
-                    0.8: ee.Dictionary({"A1": 0.327, "A2": 2.260, "η": 0.4819}),
-                    0.9: ee.Dictionary({"A1": 0.221, "A2": 2.744, "η": 0.5699}),
-                    0.95: ee.Dictionary({"A1": 0.152, "A2": 3.206, "η": 0.6254}),
-                }
-            ),
-            3: ee.Dictionary(
-                {
-                    0.5: ee.Dictionary({"A1": 0.652, "A2": 1.458, "η": 0.2222}),
-                    0.6: ee.Dictionary({"A1": 0.580, "A2": 1.586, "η": 0.2736}),
-                    0.7: ee.Dictionary({"A1": 0.505, "A2": 1.751, "η": 0.3280}),
-                    0.8: ee.Dictionary({"A1": 0.419, "A2": 1.865, "η": 0.3892}),
-                    0.9: ee.Dictionary({"A1": 0.313, "A2": 2.320, "η": 0.4624}),
-                    0.95: ee.Dictionary({"A1": 0.238, "A2": 2.656, "η": 0.5084}),
-                }
-            ),
-            4: ee.Dictionary(
-                {
-                    0.5: ee.Dictionary({"A1": 0.694, "A2": 1.385, "η": 0.1921}),
-                    0.6: ee.Dictionary({"A1": 0.630, "A2": 1.495, "η": 0.2348}),
-                    0.7: ee.Dictionary({"A1": 0.560, "A2": 1.627, "η": 0.2825}),
-                    0.8: ee.Dictionary({"A1": 0.480, "A2": 1.804, "η": 0.3354}),
-                    0.9: ee.Dictionary({"A1": 0.378, "A2": 2.094, "η": 0.3991}),
-                    0.95: ee.Dictionary({"A1": 0.302, "A2": 2.360, "η": 0.4391}),
-                }
-            ),
-        }
-    )
+    kernel = _square_kernel(window, midPt)
+    targetkernel = _square_kernel(3, 1)
 
-    # extract data from lookup
-    looksDict = ee.Dictionary(sigmaLookup.get(ee.String(str(looks))))
-    sigmaImage = ee.Dictionary(looksDict.get(ee.String(str(sigma)))).toImage()
-    a1 = sigmaImage.select("A1")
-    a2 = sigmaImage.select("A2")
-    aRange = a2.subtract(a1)
-    eta = sigmaImage.select("η").pow(2)
+    # extract data from lookup, values are inserted into the graph as constants
+    lookup = SIGMA_LOOKUP[looks][sigma]
+    a1 = lookup["A1"]
+    a2 = lookup["A2"]
+    eta = lookup["η"] ** 2
 
     img = geeutils.db_to_power(img)
 
@@ -76,7 +67,7 @@ def lee_sigma(img, window=9, sigma=0.9, looks=4, tk=7):
     oneImg = ee.Image(1)
     z = mmseIn.reduceNeighborhood(ee.Reducer.mean(), kernel, None, True)
     varz = mmseIn.reduceNeighborhood(ee.Reducer.variance(), kernel)
-    varx = (varz.subtract(z.abs().pow(2).multiply(eta))).divide(oneImg.add(eta))
+    varx = (varz.subtract(z.abs().pow(2).multiply(eta))).divide(1 + eta)
     b = varx.divide(varz)
     mmse = oneImg.subtract(b).multiply(z.abs()).add(b.multiply(mmseIn))
 
@@ -107,31 +98,12 @@ def refined_lee(image):
         img = power.select([b])
 
         # img must be in natural units, i.e. not in dB!
-        # Set up 3x3 kernels
-        weights3 = ee.List.repeat(ee.List.repeat(1, 3), 3)
-        kernel3 = ee.Kernel.fixed(3, 3, weights3, 1, 1, False)
-
-        mean3 = img.reduceNeighborhood(ee.Reducer.mean(), kernel3)
-        variance3 = img.reduceNeighborhood(ee.Reducer.variance(), kernel3)
-
-        # Use a sample of the 3x3 windows inside a 7x7 windows to determine gradients and directions
-        sample_weights = ee.List(
-            [
-                [0, 0, 0, 0, 0, 0, 0],
-                [0, 1, 0, 1, 0, 1, 0],
-                [0, 0, 0, 0, 0, 0, 0],
-                [0, 1, 0, 1, 0, 1, 0],
-                [0, 0, 0, 0, 0, 0, 0],
-                [0, 1, 0, 1, 0, 1, 0],
-                [0, 0, 0, 0, 0, 0, 0],
-            ]
-        )
-
-        sample_kernel = ee.Kernel.fixed(7, 7, sample_weights, 3, 3, False)
+        mean3 = img.reduceNeighborhood(ee.Reducer.mean(), kernels["kernel3"])
+        variance3 = img.reduceNeighborhood(ee.Reducer.variance(), kernels["kernel3"])
 
         # Calculate mean and variance for the sampled windows and store as 9 bands
-        sample_mean = mean3.neighborhoodToBands(sample_kernel)
-        sample_var = variance3.neighborhoodToBands(sample_kernel)
+        sample_mean = mean3.neighborhoodToBands(kernels["sample"])
+        sample_var = variance3.neighborhoodToBands(kernels["sample"])
 
         # Determine the 4 gradients for the sampled windows
         gradients = sample_mean.select(1).subtract(sample_mean.select(7)).abs()
@@ -201,67 +173,21 @@ def refined_lee(image):
             .arrayReduce(ee.Reducer.mean(), [0])
         )
 
-        # Set up the 7*7 kernels for directional statistics
-        rect_weights = ee.List.repeat(ee.List.repeat(0, 7), 3).cat(
-            ee.List.repeat(ee.List.repeat(1, 7), 4)
-        )
-
-        diag_weights = ee.List(
-            [
-                [1, 0, 0, 0, 0, 0, 0],
-                [1, 1, 0, 0, 0, 0, 0],
-                [1, 1, 1, 0, 0, 0, 0],
-                [1, 1, 1, 1, 0, 0, 0],
-                [1, 1, 1, 1, 1, 0, 0],
-                [1, 1, 1, 1, 1, 1, 0],
-                [1, 1, 1, 1, 1, 1, 1],
-            ]
-        )
-
-        rect_kernel = ee.Kernel.fixed(7, 7, rect_weights, 3, 3, False)
-        diag_kernel = ee.Kernel.fixed(7, 7, diag_weights, 3, 3, False)
-
-        # Create stacks for mean and variance using the original kernels. Mask with relevant direction.
-        dir_mean = img.reduceNeighborhood(ee.Reducer.mean(), rect_kernel).updateMask(
-            directions.eq(1)
-        )
-        dir_var = img.reduceNeighborhood(ee.Reducer.variance(), rect_kernel).updateMask(
-            directions.eq(1)
-        )
-
-        dir_mean = dir_mean.addBands(
-            img.reduceNeighborhood(ee.Reducer.mean(), diag_kernel).updateMask(
-                directions.eq(2)
-            )
-        )
-        dir_var = dir_var.addBands(
-            img.reduceNeighborhood(ee.Reducer.variance(), diag_kernel).updateMask(
-                directions.eq(2)
-            )
-        )
-
-        # and add the bands for rotated kernels
-        for i in range(1, 4):
-            dir_mean = dir_mean.addBands(
-                img.reduceNeighborhood(
-                    ee.Reducer.mean(), rect_kernel.rotate(i)
-                ).updateMask(directions.eq(2 * i + 1))
-            )
-            dir_var = dir_var.addBands(
-                img.reduceNeighborhood(
-                    ee.Reducer.variance(), rect_kernel.rotate(i)
-                ).updateMask(directions.eq(2 * i + 1))
-            )
-            dir_mean = dir_mean.addBands(
-                img.reduceNeighborhood(
-                    ee.Reducer.mean(), diag_kernel.rotate(i)
-                ).updateMask(directions.eq(2 * i + 2))
+        # Create stacks for mean and variance using the directional kernels. Mask with relevant direction.
+        dir_mean = []
+        dir_var = []
+        for i, kernel in enumerate(kernels["directional"]):
+            direction = directions.eq(i + 1)
+            dir_mean.append(
+                img.reduceNeighborhood(ee.Reducer.mean(), kernel).updateMask(direction)
             )
-            dir_var = dir_var.addBands(
-                img.reduceNeighborhood(
-                    ee.Reducer.variance(), diag_kernel.rotate(i)
-                ).updateMask(directions.eq(2 * i + 2))
+            dir_var.append(
+                img.reduceNeighborhood(ee.Reducer.variance(), kernel).updateMask(
+                    direction
+                )
             )
+        dir_mean = ee.Image.cat(dir_mean)
+        dir_var = ee.Image.cat(dir_var)
 
         # "collapse" the stack into a single band image (due to masking, each pixel has just one value in it's directional band, and is otherwise masked)
         dir_mean = dir_mean.reduce(ee.Reducer.sum())
@@ -282,6 +208,7 @@ def refined_lee(image):
             .float()
         )
 
+    kernels = _refined_lee_kernels()
     bandNames = image.bandNames()
     power = geeutils.db_to_power(image)
 
@@ -292,13 +219,12 @@ def refined_lee(image):
 @decorators.carry_metadata
 def gamma_map(img, window=7, enl=5):
 
-    bandNames = ee.Image(collection.first()).bandNames()
+    bandNames = img.bandNames()
     # Square kernel, window should be odd (typically 3, 5 or 7)
-    weights = ee.List.repeat(ee.List.repeat(1, window), window)
     midPt = (window // 2) + 1 if (window % 2) != 0 else window // 2
 
     # ~~(window/2) does integer division in JavaScript
-    kernel = ee.Kernel.fixed(window, window, weights, midPt, midPt, False)
+    kernel = _square_kernel(window, midPt)
 
     # Convert image from dB to natural values
     nat_img = geeutils.db_to_power(img)
@@ -326,7 +252,9 @@ def gamma_map(img, window=7, enl=5):
     )
     f = b.multiply(mean).add(d.sqrt()).divide(alpha.multiply(2.0))
 
-    caster = ee.Dictionary.fromLists(bandNames, ee.List.repeat("float", 3))
+    caster = ee.Dictionary.fromLists(
+        bandNames, ee.List.repeat("float", bandNames.length())
+    )
     img1 = (
         geeutils.power_to_db(mean.updateMask(ci.lte(cu))).rename(bandNames).cast(caster)
     )
@@ -1,11 +1,33 @@
 from __future__ import print_function, division
 import ee
-from hydrafloods import decorators
+from hydrafloods import decorators, cache
 
 
 def starfm(
-    coarseCollection, fineCollection=None, targetDate="1970-01-01", windowSize=33, A=0.5
+    coarseCollection,
+    fineCollection=None,
+    targetDate="1970-01-01",
+    windowSize=33,
+    A=0.5,
+    baseWindow=2,
+    baseUnit="month",
+    searchDays=5,
 ):
+    """
+    Function to apply the STARFM spatiotemporal fusion to coarse resolution imagery
+    A local array implementation is available as hydrafloods.local.fusion.starfm
+
+    args:
+        coarseCollection (ee.ImageCollection): coarse resolution imagery to predict fine resolution images from
+        fineCollection (ee.ImageCollection | hf.hfCollection): fine resolution imagery with a "time" band
+        targetDate (str): date to predict imagery around, YYYY-MM-dd
+        windowSize (int): size of the moving window in pixels
+        A (float): distance scaling factor
+        baseWindow (int): length of the period before the target date to search for base images
+        baseUnit (str): unit of baseWindow, one of "day", "week", "month" or "year"
+        searchDays (int): number of days around the target date to predict images for
+    """
+
     @decorators.carry_metadata
     def apply_starfm(img):
         t = ee.Date(img.get("system:time_start"))
@@ -42,7 +64,7 @@ def starfm(
                 "or hf.hfCollection"
             )
 
-    bandList = ee.Image(coarseCollection.first()).bandNames().getInfo()
+    bandList = cache.get_info(ee.Image(coarseCollection.first()).bandNames())
 
     one = ee.Image.constant(1)
     centerPos = ee.Number((windowSize - 1) / 2)
@@ -71,19 +93,19 @@ def starfm(
     )
 
     base = (
-        fineCollection.filterDate(target.advance(-2, "month"), target)
+        fineCollection.filterDate(target.advance(-baseWindow, baseUnit), target)
         .sort("system:time_start", False)
         .reduce(ee.Reducer.firstNonNull())
     )
 
     slv = (
-        coarseCollection.filterDate(target.advance(-2, "month"), target)
+        coarseCollection.filterDate(target.advance(-baseWindow, baseUnit), target)
         .sort("system:time_start", False)
         .reduce(ee.Reducer.firstNonNull())
     )
 
     result = coarseCollection.filterDate(
-        target.advance(-5, "day"), target.advance(5, "day")
+        target.advance(-searchDays, "day"), target.advance(searchDays, "day")
     ).map(apply_starfm, True)
 
     return result
@@ -143,3 +165,57 @@ def bathtub(wfrac, hand, permanent=None):
     )
 
     return final
+
+
+def bathtub_cdf(wfrac, hand, permanent=None, maxDepth=20, step=1):
+    """
+    Function to fit hi-resolution HAND model to water fraction estimate by reading the
+    fill depth off the cumulative distribution of HAND within each coarse pixel.
+    The filled fraction for every depth is calculated in a single multi-band
+    reduceResolution and the depth is linearly interpolated between depth levels,
+    so results are not restricted to integer depths.
+    A local array implementation is available as hydrafloods.local.fusion.bathtub
+    args:
+        wfrac (ee.Image): water fraction image, values must be 0-1
+        hand (ee.Image): height above nearest drainage (HAND) image, units in meters
+        permanent (ee.Image): permanent water image to seed HAND filling
+        maxDepth (float): maximum fill depth in meters
+        step (float): spacing between the depth levels in meters
+    """
+    if permanent:
+        permWater = permanent
+    else:
+        permWater = ee.Image(0)
+    proj = wfrac.projection()
+
+    nDepths = int(round(maxDepth / step)) + 1
+    depths = [i * step for i in range(nDepths)]
+
+    # fraction of filled fine pixels at each depth, i.e. the CDF of HAND per coarse pixel
+    cdf = (
+        hand.lte(ee.Image.constant(depths))
+        .Or(permWater)
+        .reduceResolution(reducer=ee.Reducer.mean(), bestEffort=True, maxPixels=1024)
+        .reproject(crs=proj)
+        .toArray()
+    )
+
+    # first depth level where the filled fraction reaches the water fraction
+    below = cdf.lt(wfrac).arrayReduce(ee.Reducer.sum(), [0]).arrayGet([0])
+    upper = below.clamp(1, nDepths - 1).int()
+    lower = upper.subtract(1)
+
+    cdfLower = cdf.arrayGet(lower)
+    cdfUpper = cdf.arrayGet(upper)
+    offset = (
+        wfrac.subtract(cdfLower)
+        .divide(cdfUpper.subtract(cdfLower))
+        .clamp(0, 1)
+        .unmask(0)
+    )
+    depth = lower.add(offset).multiply(step)
+
+    water = hand.lte(depth).Or(permWater)
+    error = cdf.subtract(wfrac).abs().arrayReduce(ee.Reducer.min(), [0]).arrayGet([0])
+
+    return water.rename("water").addBands(error.rename("error").float())
@@ -1,10 +1,12 @@
 import ee
 from ee.ee_exception import EEException
 import math
+import json
 import string
 import random
 import datetime
-from hydrafloods import decorators
+from concurrent.futures import ThreadPoolExecutor
+from hydrafloods import decorators, tiling, cache
 
 
 # helper function to convert qa bit image to flag
@@ -31,6 +33,143 @@ def get_tile_layer_url(ee_image_object):
     return tile_url_template.format(**map_id)
 
 
+def expression_size(ee_object):
+    """
+    Serializes an Earth Engine object locally to measure the size of the request
+    sent to the server, useful for comparing different implementations
+
+    Args:
+        ee_object (ee.ComputedObject): Earth Engine object to measure
+
+    Returns:
+        dict with the number of nodes in the expression graph ("nodes")
+        and size of the serialized request in bytes ("bytes")
+    """
+    graph = ee.serializer.encode(ee_object, for_cloud_api=True)
+    serialized = json.dumps(graph, separators=(",", ":"))
+    return dict(nodes=len(graph["values"]), bytes=len(serialized.encode("utf-8")))
+
+
+def _metadata_request(collection, count, offset, properties):
+    def _image_metadata(img):
+        img = ee.Image(img)
+        props = (
+            img.toDictionary() if properties is None else img.toDictionary(properties)
+        )
+        return ee.Dictionary(
+            {
+                "id": img.get("system:index"),
+                "time": img.get("system:time_start"),
+                "footprint": img.geometry(),
+                "bands": img.bandNames(),
+                "properties": props,
+            }
+        )
+
+    return collection.toList(count, offset).map(_image_metadata)
+
+
+# error messages from Earth Engine when a request or its response is too large,
+# these can be retried with fewer images per request unlike other errors
+PAYLOAD_ERRORS = (
+    "memory limit exceeded",
+    "payload size exceeds",
+    "response size exceeds",
+    "too large",
+)
+
+
+def _is_payload_error(error):
+    message = str(error).lower()
+    return any(e in message for e in PAYLOAD_ERRORS)
+
+
+def _metadata_chunk(collection, count, offset, properties):
+    try:
+        return cache.get_info(
+            _metadata_request(collection, count, offset, properties),
+            ttl=cache.METADATA_TTL,
+        )
+    except EEException as e:
+        if count <= 1 or not _is_payload_error(e):
+            raise
+        # payload was too large for one request, split the chunk in half and retry
+        half = count // 2
+        first = _metadata_chunk(collection, half, offset, properties)
+        return first + _metadata_chunk(
+            collection, count - half, offset + half, properties
+        )
+
+
+def collection_metadata(collection, properties=None, chunk_size=1000, max_workers=4):
+    """
+    Function to fetch the metadata of every image in a collection with as few
+    requests as possible. The whole collection is requested at once, large
+    collections are split into chunks which are requested concurrently. Chunks
+    that exceed the Earth Engine payload or memory limits are split in half until
+    they succeed, other errors are raised
+
+    Args:
+        collection (ee.ImageCollection): image collection to get metadata for
+
+    Keywords:
+        properties (list): image properties to include, None includes all properties
+            default = None
+        chunk_size (int): maximum number of images per request
+            default = 1000
+        max_workers (int): maximum number of concurrent requests for chunks
+            default = 4
+
+    Returns:
+        metadata (list): list of dictionaries with the "id", "time", "footprint" (GeoJSON),
+            "bands" and "properties" of each image in collection order
+    """
+    n = cache.get_info(collection.size(), ttl=cache.METADATA_TTL)
+
+    if n <= chunk_size:
+        return _metadata_chunk(collection, n, 0, properties)
+
+    offsets = range(0, n, chunk_size)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        chunks = executor.map(
+            lambda offset: _metadata_chunk(
+                collection, min(chunk_size, n - offset), offset, properties
+            ),
+            offsets,
+        )
+        metadata = [item for chunk in chunks for item in chunk]
+
+    return metadata
+
+
+def geojson_bounds(geojson):
+    """
+    Function to calculate the bounding box coordinates of a GeoJSON geometry client-side
+
+    Args:
+        geojson (dict): GeoJSON geometry, i.e. footprint from collection_metadata()
+
+    Returns:
+        coordinates (list): rectangle coordinates in the format used by exports
+    """
+
+    def _points(coords):
+        if isinstance(coords[0], (int, float)):
+            yield coords
+        else:
+            for c in coords:
+                yield from _points(c)
+
+    if geojson["type"] == "GeometryCollection":
+        points = [p for g in geojson["geometries"] for p in _points(g["coordinates"])]
+    else:
+        points = list(_points(geojson["coordinates"]))
+
+    xs, ys = [p[0] for p in points], [p[1] for p in points]
+    w, s, e, n = min(xs), min(ys), max(xs), max(ys)
+    return [[[w, s], [e, s], [e, n], [w, n], [w, s]]]
+
+
 def export_image(
     image,
     region,
@@ -39,20 +178,23 @@ def export_image(
     scale=1000,
     crs="EPSG:4326",
     pyramiding=None,
+    manager=None,
 ):
     if (description == None) or (type(description) != str):
         description = "".join(
             random.SystemRandom().choice(string.ascii_letters) for _ in range(8)
         ).lower()
     # get serializable geometry for export
-    export_region = region.bounds(maxError=1).getInfo()["coordinates"]
+    # coordinates that are already client-side are used as is
+    if isinstance(region, (list, tuple)):
+        export_region = region
+    else:
+        export_region = cache.get_info(region.bounds(maxError=1))["coordinates"]
 
     if pyramiding is None:
         pyramiding = {".default": "mean"}
 
-    # set export process
-    export = ee.batch.Export.image.toAsset(
-        image,
+    export_kwargs = dict(
         description=description,
         assetId=asset_id,
         scale=scale,
@@ -61,10 +203,17 @@ def export_image(
         crs=crs,
         pyramidingPolicy=pyramiding,
     )
+
+    # hand the export to a hydrafloods.tasks.TaskManager to be scheduled
+    if manager is not None:
+        return manager.submit(ee.batch.Export.image.toAsset, image, **export_kwargs)
+
+    # set export process
+    export = ee.batch.Export.image.toAsset(image, **export_kwargs)
     # start export process
     export.start()
 
-    return
+    return export
 
 
 def export_table(
@@ -81,7 +230,7 @@ def export_table(
             random.SystemRandom().choice(string.ascii_letters) for _ in range(8)
         ).lower()
     # get serializable geometry for export
-    exportRegion = region.bounds(maxError=1).getInfo()["coordinates"]
+    exportRegion = cache.get_info(region.bounds(maxError=1))["coordinates"]
 
     if pyramiding is None:
         pyramiding = {".default": "mean"}
@@ -114,6 +263,8 @@ def batch_export(
     metadata=None,
     pyramiding=None,
     verbose=False,
+    grid=None,
+    manager=None,
 ):
     if type(collection) is not ee.imagecollection.ImageCollection:
         try:
@@ -124,45 +275,59 @@ def batch_export(
                 "or hydrafloods.hfCollection"
             )
 
-    n = collection.size()
-    exportImages = collection.sort("system:time_start", False).toList(n)
-    nIter = n.getInfo()
+    exportCollection = collection.sort("system:time_start", False)
+    # times and footprints of all images are fetched in bulk instead of per image
+    imageMetadata = collection_metadata(exportCollection, properties=[])
+    exportImages = exportCollection.toList(len(imageMetadata))
+
+    if not collection_asset.endswith("/"):
+        collection_asset += "/"
 
-    for i in range(nIter):
+    # grid from hydrafloods.tiling, each image is exported as one asset per cell
+    # cells are fetched once for the region and reused for every image
+    if grid is not None:
+        if region is not None:
+            grid = tiling.footprint_cells(grid, region)
+        cells = tiling.cell_list(grid)
+
+    for i, info in enumerate(imageMetadata):
         img = ee.Image(exportImages.get(i))
-        if _metadata is not None:
-            img = img.set(_metadata)
+        if metadata is not None:
+            img = img.set(metadata)
 
-        t = img.get("system:time_start").getInfo()
+        t = info["time"]
         date = datetime.datetime.utcfromtimestamp(t / 1e3).strftime("%Y%m%d")
 
-        if region is None:
-            region = img.geometry()
-
         exportName = date
         if prefix is not None:
             exportName = f"{prefix}_" + exportName
         if suffix is not None:
             exportName = exportName + f"_{suffix}"
 
-        description = exportName
-        if verbose:
-            print(f"running export for {description}")
-
-        if not collectionAsset.endswith("/"):
-            collectionAsset += "/"
-
-        exportName = collection_asset + description
-
-        exportImage(
-            img,
-            region,
-            exportName,
-            description=description,
-            scale=scale,
-            crs=crs,
-            pyramiding=pyramiding,
-        )
+        if grid is not None:
+            exports = [
+                (geojson_bounds(cell["geometry"]), f"{exportName}_{cell['tile_id']}")
+                for cell in cells
+            ]
+        elif region is None:
+            exports = [(geojson_bounds(info["footprint"]), exportName)]
+        else:
+            exports = [(region, exportName)]
+
+        for export_region, description in exports:
+            if verbose:
+                print(f"running export for {description}")
+
+            export_image(
+                img,
+                export_region,
+                collection_asset + description,
+                description=description,
+                scale=scale,
+                crs=crs,
+                pyramiding=pyramiding,
+                manager=manager,
+            )
 
     return
 
@@ -0,0 +1,120 @@
+import logging
+import numpy as np
+from hydrafloods.local import fusion
+
+
+def bathtub_members(
+    wfrac,
+    hand,
+    rng,
+    n,
+    permanent=None,
+    elv_std_dev=6,
+    max_depth=20,
+    step=1,
+    chunk_rows=256,
+):
+    """
+    Local implementation of ensemble.bathtub_members, evaluates a batch of perturbed
+    bathtub HAND fits along a leading member axis. Like fusion.bathtub the fits are
+    processed in blocks of coarse rows so that the perturbed HAND and per-cell values
+    only exist for one block of all members at a time
+
+    Args:
+        wfrac (np.ndarray): 2-d coarse water fraction array, values must be 0-1
+        hand (np.ndarray): 2-d fine resolution height above nearest drainage array in meters, nan is no data
+        rng (np.random.Generator): random generator to draw the perturbations from
+        n (int): number of members to evaluate
+
+    Keywords:
+        permanent (np.ndarray): boolean fine resolution permanent water array to seed HAND filling
+            default = None
+        elv_std_dev (float): standard deviation of the HAND error in meters
+            default = 6
+        max_depth (float): maximum fill depth in meters
+            default = 20
+        step (float): spacing between the depth levels in meters
+            default = 1
+        chunk_rows (int): number of coarse rows to process at once
+            default = 256
+
+    Returns:
+        members (np.ndarray): uint8 array of shape (n, rows, cols) where 1 = water
+    """
+    factor = hand.shape[0] // wfrac.shape[0]
+    wfrac = np.asarray(wfrac, dtype=np.float64)
+    cols = wfrac.shape[1] * factor
+
+    water = np.empty((n, wfrac.shape[0] * factor, cols), dtype=np.uint8)
+
+    for start in range(0, wfrac.shape[0], chunk_rows):
+        stop = min(start + chunk_rows, wfrac.shape[0])
+        fine = slice(start * factor, stop * factor)
+        block_hand = np.asarray(hand[fine, :cols], dtype=np.float32)
+        block_perm = (
+            None if permanent is None else np.asarray(permanent[fine, :cols], bool)
+        )
+
+        noise = rng.random((n,) + block_hand.shape, dtype=np.float32) - 0.5
+        perturbed = block_hand + noise * (6 * elv_std_dev)
+
+        values = np.stack(
+            [fusion._cell_values(p, block_perm, factor) for p in perturbed]
+        )
+        depth, _ = fusion._bathtub_block(wfrac[start:stop], values, max_depth, step)
+
+        fine_depth = np.repeat(np.repeat(depth, factor, axis=1), factor, axis=2)
+        filled = perturbed <= fine_depth
+        if block_perm is not None:
+            filled |= block_perm
+        water[:, fine] = filled
+
+    return water
+
+
+def run(member_func, n_members=100, batch_size=10, seed=0, tolerance=None):
+    """
+    Local implementation of ensemble.run, members are evaluated in batches along a
+    leading array axis until all members are evaluated or the probability estimate
+    has converged
+
+    Args:
+        member_func (callable): function that accepts a np.random.Generator and number of
+            members and returns an array of shape (n, ...) with one binary map per member
+
+    Keywords:
+        n_members (int): maximum number of ensemble members
+            default = 100
+        batch_size (int): number of members to evaluate per batch
+            default = 10
+        seed (int): seed for the random generator
+            default = 0
+        tolerance (float): stop adding batches once the mean absolute change of the
+            probability is below this value, None evaluates all members
+            default = None
+
+    Returns:
+        probability (np.ndarray): float32 fraction of members classified as 1
+        n (int): effective number of members that were evaluated
+    """
+    rng = np.random.default_rng(seed)
+
+    total = None
+    n = 0
+    for start in range(0, n_members, batch_size):
+        size = min(batch_size, n_members - start)
+        batch = np.asarray(member_func(rng, size)).sum(axis=0, dtype=np.float64)
+
+        previous = None if total is None else total / n
+        total = batch if total is None else total + batch
+        n += size
+
+        if tolerance is None or previous is None or n >= n_members:
+            continue
+
+        change = float(np.nanmean(np.abs(total / n - previous)))
+        logging.info(f"ensemble members: {n}, mean probability change: {change}")
+        if change < tolerance:
+            break
+
+    return (total / n).astype(np.float32), n
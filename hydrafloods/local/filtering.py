@@ -0,0 +1,298 @@
+import numpy as np
+from hydrafloods.local import stats
+
+# Lookup table for range and eta values for intensity, same values as filtering.lee_sigma
+SIGMA_LOOKUP = {
+    1: {
+        0.5: {"A1": 0.436, "A2": 1.92, "η": 0.4057},
+        0.6: {"A1": 0.343, "A2": 2.21, "η": 0.4954},
+        0.7: {"A1": 0.254, "A2": 2.582, "η": 0.5911},
+        0.8: {"A1": 0.168, "A2": 3.094, "η": 0.6966},
+        0.9: {"A1": 0.084, "A2": 3.941, "η": 0.8191},
+        0.95: {"A1": 0.043, "A2": 4.840, "η": 0.8599},
+    },
+    2: {
+        0.5: {"A1": 0.582, "A2": 1.584, "η": 0.2763},
+        0.6: {"A1": 0.501, "A2": 1.755, "η": 0.3388},
+        0.7: {"A1": 0.418, "A2": 1.972, "η": 0.4062},
+        0.8: {"A1": 0.327, "A2": 2.260, "η": 0.4819},
+        0.9: {"A1": 0.221, "A2": 2.744, "η": 0.5699},
+        0.95: {"A1": 0.152, "A2": 3.206, "η": 0.6254},
+    },
+    3: {
+        0.5: {"A1": 0.652, "A2": 1.458, "η": 0.2222},
+        0.6: {"A1": 0.580, "A2": 1.586, "η": 0.2736},
+        0.7: {"A1": 0.505, "A2": 1.751, "η": 0.3280},
+        0.8: {"A1": 0.419, "A2": 1.865, "η": 0.3892},
+        0.9: {"A1": 0.313, "A2": 2.320, "η": 0.4624},
+        0.95: {"A1": 0.238, "A2": 2.656, "η": 0.5084},
+    },
+    4: {
+        0.5: {"A1": 0.694, "A2": 1.385, "η": 0.1921},
+        0.6: {"A1": 0.630, "A2": 1.495, "η": 0.2348},
+        0.7: {"A1": 0.560, "A2": 1.627, "η": 0.2825},
+        0.8: {"A1": 0.480, "A2": 1.804, "η": 0.3354},
+        0.9: {"A1": 0.378, "A2": 2.094, "η": 0.3991},
+        0.95: {"A1": 0.302, "A2": 2.360, "η": 0.4391},
+    },
+}
+
+# 7x7 directional kernels of the refined lee filter, rotations are clockwise like ee.Kernel.rotate
+_RECT_KERNEL = np.vstack([np.zeros((3, 7)), np.ones((4, 7))])
+_DIAG_KERNEL = np.tril(np.ones((7, 7)))
+DIRECTION_KERNELS = []
+for _i in range(4):
+    DIRECTION_KERNELS.append(np.rot90(_RECT_KERNEL, -_i))
+    DIRECTION_KERNELS.append(np.rot90(_DIAG_KERNEL, -_i))
+
+
+def _as_float(block):
+    # masked arrays are filled so no data is carried as nan through the filters
+    if isinstance(block, np.ma.MaskedArray):
+        return block.astype(np.float64).filled(np.nan)
+    return np.asarray(block, dtype=np.float64)
+
+
+def _db_to_power(x):
+    return np.power(10.0, x / 10.0)
+
+
+def _power_to_db(x):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return 10.0 * np.log10(x)
+
+
+def _anchor(window):
+    # filtering.py defines the kernel focus as window // 2 + 1 for odd windows
+    return (window // 2) + 1 if (window % 2) != 0 else window // 2
+
+
+def _shift(a, dy, dx):
+    # value of a at pixel (i+dy, j+dx), nan outside of the array
+    h, w = a.shape
+    out = np.full_like(a, np.nan)
+    out[max(-dy, 0) : h - max(dy, 0), max(-dx, 0) : w - max(dx, 0)] = a[
+        max(dy, 0) : h - max(-dy, 0), max(dx, 0) : w - max(-dx, 0)
+    ]
+    return out
+
+
+def _chunked(func, img, halo, chunk_rows=1024, out=None):
+    # applies func to row blocks padded with a halo of neighboring rows so that
+    # windowed statistics match a single pass over the array, pixels outside of
+    # the scene are padded as no data
+    n_rows, n_cols = img.shape
+    if out is None:
+        out = np.empty(img.shape, dtype=np.float32)
+
+    for start in range(0, n_rows, chunk_rows):
+        stop = min(start + chunk_rows, n_rows)
+        top, bottom = max(start - halo, 0), min(stop + halo, n_rows)
+        block = np.pad(
+            _as_float(img[top:bottom]),
+            ((halo - (start - top), halo - (bottom - stop)), (halo, halo)),
+            constant_values=np.nan,
+        )
+        result = func(block)
+        out[start:stop] = result[halo : halo + (stop - start), halo : halo + n_cols]
+
+    return out
+
+
+def _percentile(img, q, max_pixels=1e6):
+    # approximate percentile from a strided sample, like the bestEffort reduction in
+    # filtering.lee_sigma which uses at most 1e6 raw values
+    step = max(1, int(np.ceil(np.sqrt(img.shape[0] * img.shape[1] / max_pixels))))
+    sample = _as_float(img[::step, ::step])
+    return float(np.nanpercentile(sample, q))
+
+
+def lee_sigma(img, window=9, sigma=0.9, looks=4, tk=7, chunk_rows=1024, out=None):
+    """
+    Local implementation of filtering.lee_sigma for in-memory or memory-mapped arrays
+    Window statistics are calculated with summed-area tables so the cost per pixel
+    does not depend on the window size
+
+    Args:
+        img (np.ndarray): 2-d array of backscatter in dB, nan or masked values are treated as no data
+
+    Keywords:
+        window (int): size of the filter window in pixels
+            default = 9
+        sigma (float): speckle sigma value, one of 0.5, 0.6, 0.7, 0.8, 0.9 or 0.95
+            default = 0.9
+        looks (int): number of looks of the imagery, one of 1, 2, 3 or 4
+            default = 4
+        tk (int): minimum number of bright pixels in the 3x3 target window to keep a pixel unfiltered
+            default = 7
+        chunk_rows (int): number of rows to process at once
+            default = 1024
+        out (np.ndarray): array to write the results to, i.e. a np.memmap. If None, a new float32 array is created
+            default = None
+
+    Returns:
+        filtered (np.ndarray): filtered backscatter in dB
+    """
+    lookup = SIGMA_LOOKUP[looks][sigma]
+    eta = lookup["η"] ** 2
+    anchor = _anchor(window)
+
+    z99 = _db_to_power(_percentile(img, 99))
+
+    def _filter(block):
+        x = _db_to_power(block)
+
+        # MMSE estimator
+        window_stats = stats.box_stats(x, window, anchor)
+        z, varz = window_stats["mean"], window_stats["variance"]
+        varx = (varz - np.abs(z) ** 2 * eta) / (1 + eta)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            b = varx / varz
+            mmse = (1 - b) * np.abs(z) + b * x
+
+        over_thresh = (x >= z99).astype(np.float64)
+        k = stats.box_sum(over_thresh, -1, 1, -1, 1)
+
+        x_hat = np.where(k >= tk, x, mmse)
+        return _power_to_db(np.where(np.isfinite(x), x_hat, np.nan))
+
+    halo = max(anchor, window - 1 - anchor, 1)
+    return _chunked(_filter, img, halo, chunk_rows, out)
+
+
+def _refined_lee_block(x):
+    stats3 = stats.box_stats(x, 3)
+    mean3, variance3 = stats3["mean"], stats3["variance"]
+
+    # sample the 3x3 windows inside a 7x7 window, same order as neighborhoodToBands
+    offsets = [(dy, dx) for dy in (-2, 0, 2) for dx in (-2, 0, 2)]
+    sample_mean = np.stack([_shift(mean3, dy, dx) for dy, dx in offsets])
+    sample_var = np.stack([_shift(variance3, dy, dx) for dy, dx in offsets])
+
+    # determine the 4 gradients for the sampled windows
+    s = sample_mean
+    with np.errstate(invalid="ignore"):
+        gradients = np.stack(
+            [
+                np.abs(s[1] - s[7]),
+                np.abs(s[6] - s[2]),
+                np.abs(s[3] - s[5]),
+                np.abs(s[0] - s[8]),
+            ]
+        )
+    gradmask = gradients == np.fmax.reduce(gradients, axis=0)
+
+    # determine the 8 directions, the last 4 are the not() of the first 4
+    with np.errstate(invalid="ignore"):
+        directions = np.stack(
+            [
+                (s[1] - s[4] > s[4] - s[7]) * 1,
+                (s[6] - s[4] > s[4] - s[2]) * 2,
+                (s[3] - s[4] > s[4] - s[5]) * 3,
+                (s[0] - s[4] > s[4] - s[8]) * 4,
+            ]
+        )
+    directions = np.concatenate(
+        [directions, (directions == 0) * np.arange(5, 9)[:, None, None]]
+    )
+    direction = (directions * np.concatenate([gradmask, gradmask])).sum(axis=0)
+
+    # local noise variance from the 5 most homogeneous sampled windows
+    with np.errstate(invalid="ignore", divide="ignore"):
+        sample_stats = np.sort(sample_var / (sample_mean * sample_mean), axis=0)
+        sample_stats = sample_stats[:5]
+        sigma_v = np.nansum(sample_stats, axis=0) / np.isfinite(sample_stats).sum(
+            axis=0
+        )
+
+    dir_mean = np.full_like(x, np.nan)
+    dir_var = np.full_like(x, np.nan)
+    for i, kernel in enumerate(DIRECTION_KERNELS):
+        mask = direction == i + 1
+        if mask.any():
+            kernel_stats = stats.weighted_stats(x, kernel)
+            dir_mean[mask] = kernel_stats["mean"][mask]
+            dir_var[mask] = kernel_stats["variance"][mask]
+
+    var_x = (dir_var - dir_mean * dir_mean * sigma_v) / (sigma_v + 1.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        b = var_x / dir_var
+
+    result = dir_mean + b * (x - dir_mean)
+    return _power_to_db(np.where(np.isfinite(x), result, np.nan))
+
+
+def refined_lee(img, chunk_rows=1024, out=None):
+    """
+    Local implementation of filtering.refined_lee for in-memory or memory-mapped arrays
+
+    Args:
+        img (np.ndarray): 2-d array of backscatter in dB, nan or masked values are treated as no data
+
+    Keywords:
+        chunk_rows (int): number of rows to process at once
+            default = 1024
+        out (np.ndarray): array to write the results to, i.e. a np.memmap. If None, a new float32 array is created
+            default = None
+
+    Returns:
+        filtered (np.ndarray): filtered backscatter in dB
+    """
+    return _chunked(
+        lambda block: _refined_lee_block(_db_to_power(block)),
+        img,
+        3,
+        chunk_rows,
+        out,
+    )
+
+
+def gamma_map(img, window=7, enl=5, chunk_rows=1024, out=None):
+    """
+    Local implementation of filtering.gamma_map for in-memory or memory-mapped arrays
+    Window statistics are calculated with summed-area tables so the cost per pixel
+    does not depend on the window size
+
+    Args:
+        img (np.ndarray): 2-d array of backscatter in dB, nan or masked values are treated as no data
+
+    Keywords:
+        window (int): size of the filter window in pixels
+            default = 7
+        enl (float): equivalent number of looks of the imagery
+            default = 5
+        chunk_rows (int): number of rows to process at once
+            default = 1024
+        out (np.ndarray): array to write the results to, i.e. a np.memmap. If None, a new float32 array is created
+            default = None
+
+    Returns:
+        filtered (np.ndarray): filtered backscatter in dB
+    """
+    anchor = _anchor(window)
+
+    # "pure speckle" threshold and maximum coefficient of variation to filter
+    cu = 1.0 / np.sqrt(enl)
+    cmax = np.sqrt(2.0) * cu
+
+    def _filter(block):
+        x = _db_to_power(block)
+        window_stats = stats.box_stats(x, window, anchor)
+        mean, variance = window_stats["mean"], window_stats["variance"]
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ci = np.sqrt(variance) / mean
+            alpha = (1.0 + cu * cu) / (ci * ci - cu * cu)
+            b = alpha - (enl + 1.0)
+            d = mean * mean * b * b + alpha * mean * x * (4.0 * enl)
+            f = (b * mean + np.sqrt(d)) / (alpha * 2.0)
+
+        result = np.where(
+            ci <= cu,
+            _power_to_db(mean),
+            np.where(ci < cmax, _power_to_db(f), block),
+        )
+        return np.where(np.isfinite(block), result, np.nan)
+
+    halo = max(anchor, window - 1 - anchor)
+    return _chunked(_filter, img, halo, chunk_rows, out)
@@ -0,0 +1,310 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from hydrafloods.local import stats
+
+
+def distance_kernel(window_size=33, A=0.5):
+    """
+    Normalized distance weighting kernel used by starfm, same weights as fusion.starfm
+
+    Keywords:
+        window_size (int): size of the moving window in pixels
+            default = 33
+        A (float): distance scaling factor
+            default = 0.5
+
+    Returns:
+        kernel (np.ndarray): window_size x window_size array of weights that sum to 1
+    """
+    center = (window_size - 1) / 2
+    y, x = np.mgrid[0:window_size, 0:window_size]
+    d = np.sqrt((center - x) ** 2 + (center - y) ** 2)
+    weights = 1 + d / A
+    return weights / weights.sum()
+
+
+def halo_size(window_size=33):
+    """
+    Number of overlapping pixels tiles need so that tiled results match a single
+    pass over the scene, starfm stacks four convolutions with the window
+
+    Keywords:
+        window_size (int): size of the moving window in pixels
+            default = 33
+
+    Returns:
+        halo (int): overlap in pixels on each side of a tile
+    """
+    return 4 * (window_size // 2)
+
+
+def _as_bands(a):
+    a = np.ma.filled(np.ma.asarray(a, dtype=np.float64), np.nan)
+    return a[np.newaxis] if a.ndim == 2 else a
+
+
+def _convolve(a, kernel):
+    return np.stack([stats.weighted_sum(band, kernel) for band in a])
+
+
+def starfm_block(coarse, coarse_base, fine_base, dt, window_size=33, A=0.5):
+    """
+    Local implementation of the fusion.starfm prediction for one block of pixels
+    The function only operates on the last two axes so it can be used with
+    dask.array.map_overlap(..., depth=halo_size(window_size)) or xarray.apply_ufunc
+
+    Args:
+        coarse (np.ndarray): coarse resolution image at the prediction time, shape (bands, rows, cols) or (rows, cols)
+        coarse_base (np.ndarray): coarse resolution image at the base time resampled to the fine grid, same shape as coarse
+        fine_base (np.ndarray): fine resolution image at the base time, same shape as coarse
+        dt (float | np.ndarray): time between the base and prediction images, scalar or (rows, cols) array
+
+    Keywords:
+        window_size (int): size of the moving window in pixels
+            default = 33
+        A (float): distance scaling factor
+            default = 0.5
+
+    Returns:
+        prediction (np.ndarray): fine resolution prediction with the same shape as coarse
+    """
+    squeeze = np.ndim(coarse) == 2
+    coarse, coarse_base, fine_base = (
+        _as_bands(coarse),
+        _as_bands(coarse_base),
+        _as_bands(fine_base),
+    )
+    kernel = distance_kernel(window_size, A)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        spectral = _convolve(np.abs(coarse - coarse_base), kernel)
+        combined = _convolve(spectral * dt, kernel)
+        inverse = 1 / combined
+        weights = inverse / _convolve(inverse, kernel)
+        prediction = fine_base / _convolve(weights, kernel) + spectral
+
+    prediction = prediction.astype(np.float32)
+    return prediction[0] if squeeze else prediction
+
+
+def tiles(shape, tile_size=1024, halo=0):
+    """
+    Generator of tile windows over the last two axes of an array
+
+    Args:
+        shape (tuple): shape of the array, only the last two values are used
+
+    Keywords:
+        tile_size (int): size of the tiles in pixels, excluding the halo
+            default = 1024
+        halo (int): number of overlapping pixels to read on each side of a tile
+            default = 0
+
+    Yields:
+        tuple of (read, write, inner) windows, read is the tile with halo, write is the
+        location of the result and inner is the location of the result within the read window.
+        Each window is a tuple of row and column slices
+    """
+    n_rows, n_cols = shape[-2:]
+    for row in range(0, n_rows, tile_size):
+        for col in range(0, n_cols, tile_size):
+            r1, c1 = min(row + tile_size, n_rows), min(col + tile_size, n_cols)
+            r0h, c0h = max(row - halo, 0), max(col - halo, 0)
+            r1h, c1h = min(r1 + halo, n_rows), min(c1 + halo, n_cols)
+            read = (slice(r0h, r1h), slice(c0h, c1h))
+            write = (slice(row, r1), slice(col, c1))
+            inner = (slice(row - r0h, r1 - r0h), slice(col - c0h, c1 - c0h))
+            yield read, write, inner
+
+
+def _starfm_tile(args):
+    coarse, coarse_base, fine_base, dt, window_size, A, inner = args
+    prediction = starfm_block(coarse, coarse_base, fine_base, dt, window_size, A)
+    return prediction[(Ellipsis,) + inner]
+
+
+def starfm(
+    coarse,
+    coarse_base,
+    fine_base,
+    dt,
+    window_size=33,
+    A=0.5,
+    tile_size=1024,
+    n_workers=None,
+):
+    """
+    Tiled local implementation of fusion.starfm for large or memory-mapped arrays
+    Tiles are read with an overlapping halo, predicted in a process pool and yielded
+    as they are finished so memory use scales with the tile size and number of workers
+    rather than the scene size
+
+    Args:
+        coarse (np.ndarray): coarse resolution image at the prediction time, shape (bands, rows, cols) or (rows, cols)
+        coarse_base (np.ndarray): coarse resolution image at the base time resampled to the fine grid, same shape as coarse
+        fine_base (np.ndarray): fine resolution image at the base time, same shape as coarse
+        dt (float | np.ndarray): time between the base and prediction images, scalar or (rows, cols) array
+
+    Keywords:
+        window_size (int): size of the moving window in pixels
+            default = 33
+        A (float): distance scaling factor
+            default = 0.5
+        tile_size (int): size of the output tiles in pixels
+            default = 1024
+        n_workers (int): number of processes, 0 runs the tiles in the calling process
+            default = None (use ProcessPoolExecutor default)
+
+    Yields:
+        tuple of (window, prediction) where window is a tuple of row and column slices of
+        the tile in the scene and prediction is the float32 result for the tile
+
+    Example:
+        out = np.lib.format.open_memmap("fused.npy", "w+", np.float32, coarse.shape)
+        for window, prediction in starfm(coarse, coarse_base, fine_base, dt):
+            out[(Ellipsis,) + window] = prediction
+    """
+    halo = halo_size(window_size)
+
+    def _jobs():
+        for read, write, inner in tiles(np.shape(coarse), tile_size, halo):
+            tile_dt = dt[read] if np.ndim(dt) == 2 else dt
+            job = (
+                np.asarray(coarse[(Ellipsis,) + read]),
+                np.asarray(coarse_base[(Ellipsis,) + read]),
+                np.asarray(fine_base[(Ellipsis,) + read]),
+                tile_dt,
+                window_size,
+                A,
+                inner,
+            )
+            yield write, job
+
+    if n_workers == 0:
+        for write, job in _jobs():
+            yield write, _starfm_tile(job)
+        return
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        # only keep a few tiles per worker in flight so tiles are not all read at once
+        max_pending = 2 * (n_workers or os.cpu_count() or 1)
+        pending = []
+        for write, job in _jobs():
+            pending.append((write, executor.submit(_starfm_tile, job)))
+            if len(pending) >= max_pending:
+                write, future = pending.pop(0)
+                yield write, future.result()
+        for write, future in pending:
+            yield write, future.result()
+
+    return
+
+
+def _cell_values(hand, permanent, factor):
+    # fine pixels grouped per coarse cell, shape (rows, cols, factor * factor)
+    rows, cols = hand.shape[0] // factor, hand.shape[1] // factor
+    values = np.where(permanent, -np.inf, hand) if permanent is not None else hand
+    values = values[: rows * factor, : cols * factor].reshape(
+        rows, factor, cols, factor
+    )
+    return values.transpose(0, 2, 1, 3).reshape(rows, cols, factor * factor)
+
+
+def _bathtub_block(wfrac, values, max_depth, step):
+    valid = ~np.isnan(values)
+    n = valid.sum(axis=-1)
+
+    if step is None:
+        # exact quantile of HAND within each cell, nan values are sorted last
+        ordered = np.sort(values, axis=-1)
+        k = np.clip(np.round(wfrac * n).astype(np.int64), 0, np.maximum(n, 1))
+        depth = np.take_along_axis(ordered, np.maximum(k - 1, 0)[..., None], -1)[..., 0]
+        depth = np.clip(np.where(k == 0, 0, depth), 0, max_depth)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            filled = (values <= depth[..., None]).sum(axis=-1) / n
+        return depth, np.abs(filled - wfrac)
+
+    depths = np.arange(int(round(max_depth / step)) + 1) * step
+
+    # index of the first depth level that fills each value, nan values sort past the
+    # last level. Offsetting the levels of every cell turns the sorted cells into one
+    # sorted sequence so a single searchsorted counts the filled values per level
+    # without a (cells, values, levels) comparison array
+    levels = np.searchsorted(depths, np.sort(values, axis=-1), side="left")
+    cell = np.arange(n.size).reshape(n.shape + (1,))
+    offsets = cell * (depths.size + 1)
+    ends = np.searchsorted(
+        (levels + offsets).ravel(), np.arange(depths.size) + offsets, side="right"
+    )
+    counts = ends - cell * values.shape[-1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cdf = counts / n[..., None]
+
+    # first depth level where the filled fraction reaches the water fraction
+    below = (cdf < wfrac[..., None]).sum(axis=-1)
+    upper = np.clip(below, 1, depths.size - 1)
+    lower = upper - 1
+    cdf_lower = np.take_along_axis(cdf, lower[..., None], -1)[..., 0]
+    cdf_upper = np.take_along_axis(cdf, upper[..., None], -1)[..., 0]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        offset = np.clip((wfrac - cdf_lower) / (cdf_upper - cdf_lower), 0, 1)
+    depth = (lower + np.nan_to_num(offset, nan=0.0)) * step
+    error = np.abs(cdf - wfrac[..., None]).min(axis=-1)
+
+    return depth, error
+
+
+def bathtub(wfrac, hand, permanent=None, max_depth=20, step=1, chunk_rows=256):
+    """
+    Local implementation of fusion.bathtub_cdf to fit hi-resolution HAND to a
+    coarse water fraction. The fine grid must be aligned with the coarse grid
+    and have an integer number of fine pixels per coarse pixel
+
+    Args:
+        wfrac (np.ndarray): 2-d coarse water fraction array, values must be 0-1
+        hand (np.ndarray): 2-d fine resolution height above nearest drainage array in meters, nan is no data
+
+    Keywords:
+        permanent (np.ndarray): boolean fine resolution permanent water array to seed HAND filling
+            default = None
+        max_depth (float): maximum fill depth in meters
+            default = 20
+        step (float): spacing between the depth levels in meters, None reads the exact quantile
+            of HAND within each coarse pixel instead of interpolating between depth levels
+            default = 1
+        chunk_rows (int): number of coarse rows to process at once
+            default = 256
+
+    Returns:
+        dict with the fine resolution "water" (uint8) and coarse "error" and "depth" (float32) arrays
+    """
+    factor = hand.shape[0] // wfrac.shape[0]
+    wfrac = np.asarray(wfrac, dtype=np.float64)
+
+    depth = np.empty(wfrac.shape, dtype=np.float32)
+    error = np.empty(wfrac.shape, dtype=np.float32)
+    water = np.zeros(hand.shape, dtype=np.uint8)
+
+    for start in range(0, wfrac.shape[0], chunk_rows):
+        stop = min(start + chunk_rows, wfrac.shape[0])
+        fine = slice(start * factor, stop * factor)
+        block_hand = np.asarray(hand[fine], dtype=np.float64)
+        block_perm = None if permanent is None else np.asarray(permanent[fine], bool)
+
+        values = _cell_values(block_hand, block_perm, factor)
+        block_depth, error[start:stop] = _bathtub_block(
+            wfrac[start:stop], values, max_depth, step
+        )
+        depth[start:stop] = block_depth
+
+        # compare with the float64 depth, rounding it to float32 first can drop the
+        # pixel whose HAND value is the exact quantile
+        fine_depth = np.repeat(np.repeat(block_depth, factor, 0), factor, 1)
+        cols = fine_depth.shape[1]
+        filled = block_hand[:, :cols] <= fine_depth
+        if block_perm is not None:
+            filled |= block_perm[:, :cols]
+        water[fine, :cols] = filled
+
+    return dict(water=water, error=error, depth=depth)
@@ -0,0 +1,252 @@
+import os
+import re
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+_LINE = re.compile(
+    r"^\s*(\d+)\)\s*(?:root|(\S+?)\s*(<=|>)\s*(\S+))\s+\S+\s+\S+\s+(\S+)(?:\s+\(.*\))?\s*(\*)?\s*$"
+)
+
+
+def parse_tree(tree_str, feature_names):
+    """
+    Function to parse a tree string in the R-style format used by
+    ee.Classifier.decisionTreeEnsemble (see ml.sklearn_tree_to_string) into flat node arrays
+
+    Args:
+        tree_str (str): string representation of the tree, lines can be separated by "\\n" or "#"
+        feature_names (list): names of the features in the order of the columns to predict on
+
+    Returns:
+        dict of 1-d arrays indexed by node with the "feature" index, "threshold", "left" and
+        "right" child index and "value". Leaves have a feature index of -1 and point to
+        themselves as children, the root is node 0
+    """
+    lines = [l for l in tree_str.replace("#", "\n").splitlines() if l.strip()]
+    n = len(lines)
+    columns = {name: i for i, name in enumerate(feature_names)}
+
+    feature = np.full(n, -1, dtype=np.int64)
+    threshold = np.zeros(n, dtype=np.float64)
+    left = np.arange(n, dtype=np.int64)
+    right = np.arange(n, dtype=np.int64)
+    value = np.zeros(n, dtype=np.float64)
+
+    index = {}
+    for i, line in enumerate(lines):
+        match = _LINE.match(line)
+        if match is None:
+            raise ValueError(f"could not parse tree line: {line!r}")
+        k, fname, sign, split, output, _ = match.groups()
+        k = int(k)
+        index[k] = i
+        value[i] = float(output)
+        if k == 1:
+            continue
+
+        # the split of a line belongs to its parent node k // 2
+        parent = index[k // 2]
+        if sign == "<=":
+            left[parent] = i
+        else:
+            right[parent] = i
+        feature[parent] = columns[fname]
+        threshold[parent] = float(split)
+
+    return dict(
+        feature=feature, threshold=threshold, left=left, right=right, value=value
+    )
+
+
+def _traverse(nodes, X, roots):
+    # moves every (tree, sample) pair down one level per iteration, returns leaf indices
+    n = X.shape[0]
+    current = np.repeat(np.asarray(roots, dtype=np.int64), n)
+    samples = np.tile(np.arange(n), len(roots))
+
+    active = np.arange(current.size)
+    while active.size:
+        node = current[active]
+        feature = nodes["feature"][node]
+        is_split = feature >= 0
+        active, node, feature = active[is_split], node[is_split], feature[is_split]
+        go_left = X[samples[active], feature] <= nodes["threshold"][node]
+        current[active] = np.where(go_left, nodes["left"][node], nodes["right"][node])
+
+    return current.reshape(len(roots), n)
+
+
+def predict_tree(nodes, X):
+    """
+    Function to predict with flat node arrays from parse_tree(). All samples move down
+    the tree one level per iteration so the number of numpy calls scales with the tree
+    depth rather than the number of samples
+
+    Args:
+        nodes (dict): flat node arrays from parse_tree()
+        X (np.ndarray): 2-d array of shape (samples, features)
+
+    Returns:
+        prediction (np.ndarray): 1-d float64 array of the leaf values per sample
+    """
+    # sklearn compares float32 features with float64 thresholds
+    X = np.asarray(X, dtype=np.float32)
+    return nodes["value"][_traverse(nodes, X, [0])[0]]
+
+
+def pack_trees(trees):
+    """
+    Function to concatenate the flat node arrays of several trees so that they can be
+    traversed together
+
+    Args:
+        trees (list): list of flat node arrays from parse_tree()
+
+    Returns:
+        dict of concatenated node arrays with child indices offset into the packed
+        arrays and the "roots" index of every tree
+    """
+    sizes = [t["feature"].size for t in trees]
+    roots = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+    packed = {
+        k: np.concatenate([t[k] for t in trees])
+        for k in ("feature", "threshold", "value")
+    }
+    for k in ("left", "right"):
+        packed[k] = np.concatenate([t[k] + r for t, r in zip(trees, roots)])
+    packed["roots"] = roots
+    return packed
+
+
+def parse_ensemble(tree_strings, feature_names):
+    """
+    Function to parse the tree strings of an ee.Classifier.decisionTreeEnsemble once
+    into flat node arrays, i.e. the "tree" column written by apps.dswfp.build_fusion_model
+
+    Args:
+        tree_strings (list): list of tree strings, lines can be separated by "\n" or "#"
+        feature_names (list): names of the features in the order of the columns to predict on
+
+    Returns:
+        forest (list): list of flat node arrays, one per tree
+    """
+    return [parse_tree(s, feature_names) for s in tree_strings]
+
+
+def scale_features(X, feature_names, min_max):
+    """
+    Function to scale features to 0-1 with the minimum and maximum values of the
+    training data, same scaling as ml.random_forest_ee
+
+    Args:
+        X (np.ndarray): array with features along the last axis
+        feature_names (list): names of the features in the order of the last axis
+        min_max (dict): dictionary with "<feature>_min" and "<feature>_max" values
+
+    Returns:
+        scaled (np.ndarray): float32 array with the same shape as X
+    """
+    fmin = np.array([min_max[f"{f}_min"] for f in feature_names], dtype=np.float64)
+    fmax = np.array([min_max[f"{f}_max"] for f in feature_names], dtype=np.float64)
+    return ((X - fmin) / (fmax - fmin)).astype(np.float32)
+
+
+_GROUPS = None
+
+
+def _init_groups(groups):
+    global _GROUPS
+    _GROUPS = groups
+    return
+
+
+def _predict_group(args):
+    # leaf values of every tree in a group, shape (trees, samples)
+    group, X = args
+    packed = _GROUPS[group]
+    return packed["value"][_traverse(packed, X, packed["roots"])]
+
+
+def _combine(predictions, mode):
+    if mode == "regression":
+        return predictions.mean(axis=0)
+
+    # majority vote, ties go to the smallest class like np.argmax
+    labels, votes = np.unique(predictions, return_inverse=True)
+    votes = votes.reshape(predictions.shape)
+    counts = np.stack([(votes == i).sum(axis=0) for i in range(labels.size)])
+    return labels[counts.argmax(axis=0)]
+
+
+def predict_ensemble(
+    forest,
+    X,
+    feature_names=None,
+    min_max=None,
+    mode="regression",
+    batch_size=2**16,
+    n_workers=None,
+):
+    """
+    Local implementation of ee.Classifier.decisionTreeEnsemble to evaluate a forest
+    on tables or rasters. Trees are split into one packed group per worker and every
+    batch of samples is traversed level by level through all trees of a group at once
+
+    Args:
+        forest (list): list of flat node arrays from parse_ensemble()
+        X (np.ndarray): array with features along the last axis, i.e. (samples, features)
+            or (rows, cols, features)
+
+    Keywords:
+        feature_names (list): names of the features in the order of the last axis, required with min_max
+            default = None
+        min_max (dict): dictionary with "<feature>_min" and "<feature>_max" values to scale the
+            features with like ml.random_forest_ee, None uses the features as is
+            default = None
+        mode (str): "regression" averages the trees and "classification" takes the majority vote
+            default = "regression"
+        batch_size (int): number of samples to evaluate at once
+            default = 65536
+        n_workers (int): number of processes, 0 evaluates the trees in the calling process
+            default = None (use ProcessPoolExecutor default)
+
+    Returns:
+        prediction (np.ndarray): float64 array with the shape of X without the feature axis
+    """
+    if mode not in ("regression", "classification"):
+        raise ValueError(f"mode must be 'regression' or 'classification', got {mode}")
+
+    X = np.asarray(X)
+    shape = X.shape[:-1]
+    X = X.reshape(-1, X.shape[-1])
+    if min_max is not None:
+        X = scale_features(X, feature_names, min_max)
+    X = X.astype(np.float32, copy=False)
+
+    n_groups = (
+        1 if n_workers == 0 else min(n_workers or os.cpu_count() or 1, len(forest))
+    )
+    groups = [pack_trees(forest[i::n_groups]) for i in range(n_groups)]
+
+    prediction = np.empty(X.shape[0], dtype=np.float64)
+
+    def _evaluate(map_func):
+        for i in range(0, X.shape[0], batch_size):
+            batch = X[i : i + batch_size]
+            result = map_func(_predict_group, [(g, batch) for g in range(n_groups)])
+            prediction[i : i + batch_size] = _combine(
+                np.concatenate(list(result)), mode
+            )
+        return
+
+    if n_workers == 0:
+        _init_groups(groups)
+        _evaluate(map)
+        _init_groups(None)
+    else:
+        with ProcessPoolExecutor(
+            max_workers=n_groups, initializer=_init_groups, initargs=(groups,)
+        ) as executor:
+            _evaluate(executor.map)
+
+    return prediction.reshape(shape)
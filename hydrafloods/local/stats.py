@@ -0,0 +1,138 @@
+import numpy as np
+from scipy import signal
+
+
+def window_offsets(window, anchor=None):
+    """
+    Function to get the pixel offsets a square window covers around its focus
+
+    Args:
+        window (int): size of the window in pixels
+
+    Keywords:
+        anchor (int): index of the focus pixel within the window, None uses the center
+            default = None
+
+    Returns:
+        offsets (tuple): first and last offset of the window relative to the focus
+    """
+    anchor = window // 2 if anchor is None else anchor
+    return -anchor, window - 1 - anchor
+
+
+def box_sum(a, y0, y1, x0, x1):
+    """
+    Sum of a[i+y0 : i+y1+1, j+x0 : j+x1+1] for every pixel using a summed-area table,
+    the cost per pixel is constant for any window size. Values outside of the
+    array are treated as zero
+
+    Args:
+        a (np.ndarray): 2-d array to sum, must not contain nan values
+        y0 (int): first row offset of the window
+        y1 (int): last row offset of the window
+        x0 (int): first column offset of the window
+        x1 (int): last column offset of the window
+
+    Returns:
+        sums (np.ndarray): float64 array with the same shape as a
+    """
+    h, w = a.shape
+    pt, pb, pl, pr = max(-y0, 0), max(y1, 0), max(-x0, 0), max(x1, 0)
+    # leading row and column of zeros so that the table can be differenced at the edges
+    sat = np.pad(np.asarray(a, dtype=np.float64), ((pt + 1, pb), (pl + 1, pr))).cumsum(
+        axis=0
+    )
+    sat = sat.cumsum(axis=1, out=sat)
+    r0, r1 = pt + y0, pt + y1 + 1
+    c0, c1 = pl + x0, pl + x1 + 1
+    return (
+        sat[r1 : r1 + h, c1 : c1 + w]
+        - sat[r0 : r0 + h, c1 : c1 + w]
+        - sat[r1 : r1 + h, c0 : c0 + w]
+        + sat[r0 : r0 + h, c0 : c0 + w]
+    )
+
+
+def _moments(count, total, squares):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(count > 0, total / count, np.nan)
+        variance = np.maximum(squares / count - mean**2, 0)
+    return dict(count=count, sum=total, mean=mean, variance=variance)
+
+
+def box_stats(x, window, anchor=None):
+    """
+    Count, sum, mean and population variance of the valid pixels in a square window
+    around every pixel. Uses summed-area tables so a 33x33 window costs the same
+    per pixel as a 3x3 window
+
+    Args:
+        x (np.ndarray): 2-d array, nan or masked values are treated as no data
+        window (int): size of the window in pixels
+
+    Keywords:
+        anchor (int): index of the focus pixel within the window, None uses the center
+            default = None
+
+    Returns:
+        dict of 2-d arrays with the "count", "sum", "mean" and "variance" per pixel
+    """
+    x = np.ma.filled(np.ma.asarray(x, dtype=np.float64), np.nan)
+    lo, hi = window_offsets(window, anchor)
+    valid = np.isfinite(x)
+    z = np.where(valid, x, 0)
+
+    count = box_sum(valid, lo, hi, lo, hi)
+    total = box_sum(z, lo, hi, lo, hi)
+    squares = box_sum(z * z, lo, hi, lo, hi)
+
+    return _moments(count, total, squares)
+
+
+def _correlate(a, kernel):
+    # signal.convolve picks between direct and FFT convolution based on the sizes,
+    # flipping the kernel gives correlation like reduceNeighborhood
+    return signal.convolve(a, kernel[::-1, ::-1], mode="same", method="auto")
+
+
+def weighted_stats(x, kernel):
+    """
+    Count, sum, mean and population variance of the valid pixels in a weighted window
+    around every pixel. Large kernels are evaluated with FFT convolution so the cost
+    grows with the log of the kernel size rather than its area
+
+    Args:
+        x (np.ndarray): 2-d array, nan or masked values are treated as no data
+        kernel (np.ndarray): 2-d array of non-negative weights with odd dimensions, focus at the center
+
+    Returns:
+        dict of 2-d arrays with the "count" (sum of weights), "sum", "mean" and "variance" per pixel
+    """
+    x = np.ma.filled(np.ma.asarray(x, dtype=np.float64), np.nan)
+    kernel = np.asarray(kernel, dtype=np.float64)
+    valid = np.isfinite(x)
+    z = np.where(valid, x, 0)
+
+    count = _correlate(valid.astype(np.float64), kernel)
+    total = _correlate(z, kernel)
+    squares = _correlate(z * z, kernel)
+
+    # FFT round off leaves tiny non-zero weights where no pixel is valid
+    count = np.where(count > 1e-9 * kernel.max(), count, 0)
+
+    return _moments(count, total, squares)
+
+
+def weighted_sum(x, kernel):
+    """
+    Weighted sum of a window around every pixel, nan values are treated as zero
+
+    Args:
+        x (np.ndarray): 2-d array
+        kernel (np.ndarray): 2-d array of weights with odd dimensions, focus at the center
+
+    Returns:
+        sums (np.ndarray): float64 array with the same shape as x
+    """
+    x = np.ma.filled(np.ma.asarray(x, dtype=np.float64), np.nan)
+    return _correlate(np.nan_to_num(x, nan=0.0), np.asarray(kernel, dtype=np.float64))
@@ -0,0 +1,331 @@
+import numpy as np
+from scipy import ndimage
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _as_float(block):
+    # masked arrays are filled so no data is carried as nan through the reductions
+    if isinstance(block, np.ma.MaskedArray):
+        return block.astype(np.float32).filled(np.nan)
+    return np.asarray(block, dtype=np.float32)
+
+
+def histogram(values, max_buckets=255, min_bucket_width=None):
+    """
+    Local equivalent of ee.Reducer.histogram, returns the bucket counts and
+    bucket means as a dictionary with the same keys Earth Engine uses
+
+    Args:
+        values (np.ndarray): array of values to compute histogram from, nan values are ignored
+
+    Keywords:
+        max_buckets (int): maximum number of histogram buckets
+            default = 255
+        min_bucket_width (float): minimum width of a bucket, None allows any width
+            default = None
+
+    Returns:
+        dict with "histogram", "bucketMeans", "bucketMin" and "bucketWidth" keys
+    """
+    values = _as_float(values).ravel()
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        raise ValueError(
+            "cannot compute a histogram from an array with no valid values"
+        )
+
+    vmin, vmax = float(values.min()), float(values.max())
+    width = (vmax - vmin) / max_buckets
+    if min_bucket_width is not None:
+        width = max(width, min_bucket_width)
+    if width == 0:
+        width = 1.0
+    n_buckets = min(int(np.floor((vmax - vmin) / width)) + 1, max_buckets)
+
+    idx = np.minimum(((values - vmin) / width).astype(np.int64), n_buckets - 1)
+    counts = np.bincount(idx, minlength=n_buckets).astype(np.float64)
+    sums = np.bincount(idx, weights=values, minlength=n_buckets)
+
+    # empty buckets take the bucket center, their count of zero removes them from otsu
+    centers = vmin + (np.arange(n_buckets) + 0.5) * width
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = np.where(counts > 0, sums / counts, centers)
+
+    return {
+        "histogram": counts,
+        "bucketMeans": means,
+        "bucketMin": vmin,
+        "bucketWidth": width,
+    }
+
+
+def otsu(histogram):
+    """
+    Otsu threshold from a histogram using a single cumulative sum pass over the buckets
+
+    Args:
+        histogram (dict): dictionary with "histogram" counts and "bucketMeans" arrays,
+            output from histogram()
+
+    Returns:
+        threshold (float): bucket mean that maximizes the between class variance
+    """
+    counts = np.asarray(histogram["histogram"], dtype=np.float64)
+    means = np.asarray(histogram["bucketMeans"], dtype=np.float64)
+
+    total = counts.sum()
+    sums = (means * counts).sum()
+    mean = sums / total
+
+    # class a is every bucket up to and including i, class b is the remainder
+    a_count = np.cumsum(counts)
+    a_sum = np.cumsum(means * counts)
+    b_count = total - a_count
+    with np.errstate(invalid="ignore", divide="ignore"):
+        a_mean = a_sum / a_count
+        b_mean = (sums - a_sum) / b_count
+        bss = a_count * (a_mean - mean) ** 2 + b_count * (b_mean - mean) ** 2
+
+    # empty classes contribute nothing to the between sum of squares
+    bss = np.nan_to_num(bss, nan=0.0, posinf=0.0, neginf=0.0)
+
+    return float(means[np.argmax(bss)])
+
+
+def _block_rows(img, grid_size, initial_threshold, row_start, row_stop):
+    n_cols = img.shape[1] // grid_size
+    chunk = _as_float(
+        img[row_start * grid_size : row_stop * grid_size, : n_cols * grid_size]
+    )
+    # strided view of shape (block rows, grid, block cols, grid) to reduce each box at once
+    blocks = chunk.reshape(row_stop - row_start, grid_size, n_cols, grid_size)
+
+    valid = np.isfinite(blocks)
+    initial = valid & (blocks < initial_threshold)
+    zeros = np.where(valid, blocks, 0)
+
+    count = valid.sum(axis=(1, 3))
+    n1 = initial.sum(axis=(1, 3))
+    n2 = count - n1
+    total = zeros.sum(axis=(1, 3), dtype=np.float64)
+    s1 = np.where(initial, blocks, 0).sum(axis=(1, 3), dtype=np.float64)
+    squares = (zeros.astype(np.float64) ** 2).sum(axis=(1, 3))
+
+    return count, n1, n2, total, s1, squares
+
+
+def box_statistics(img, grid_size, initial_threshold=0, n_workers=None):
+    """
+    Calculates the bmax statistics for every grid_size x grid_size box of an array
+    using strided block reductions, partial boxes at the array edge are dropped
+
+    Args:
+        img (np.ndarray): 2-d array, can be a np.memmap or np.ma.MaskedArray
+        grid_size (int): size of the boxes in pixels
+
+    Keywords:
+        initial_threshold (float): initial value to split the classes
+            default = 0
+        n_workers (int): number of threads to reduce chunks of box rows in parallel
+            default = None (use ThreadPoolExecutor default)
+
+    Returns:
+        dict of 2-d arrays with the "count", "p1", "m1", "m2", "variance" and "bmax" per box
+    """
+    n_rows = img.shape[0] // grid_size
+    if n_rows == 0 or img.shape[1] // grid_size == 0:
+        raise ValueError("grid_size is larger than the array, no boxes can be created")
+
+    # process a handful of box rows at a time to keep memory bounded for memory-mapped arrays
+    step = max(1, (2**24) // (grid_size * img.shape[1]))
+    chunks = [(i, min(i + step, n_rows)) for i in range(0, n_rows, step)]
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        results = list(
+            executor.map(
+                lambda c: _block_rows(img, grid_size, initial_threshold, *c), chunks
+            )
+        )
+    count, n1, n2, total, s1, squares = [
+        np.concatenate(r, axis=0) for r in zip(*results)
+    ]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p1 = n1 / count
+        m1 = s1 / n1
+        m2 = (total - s1) / n2
+        mean = total / count
+        variance = squares / count - mean**2
+
+    # same fallback values as the Earth Engine implementation, ee.Algorithms.If treats
+    # zero as false so zero statistics fall back the same way as missing ones
+    p1 = np.where(np.isfinite(p1) & (p1 != 0), p1, 0.99)
+    m1 = np.where(np.isfinite(m1) & (m1 != 0), m1, -25)
+    m2 = np.where(np.isfinite(m2), m2, 0)
+    variance = np.where(
+        np.isfinite(variance) & (variance != 0) & (count > 1), variance, 2
+    )
+
+    sigmab = p1 * (1 - p1) * (m1 - m2) ** 2
+    bmax = np.where(count > 0, sigmab / variance, np.nan)
+
+    return dict(count=count, p1=p1, m1=m1, m2=m2, variance=variance, bmax=bmax)
+
+
+def _select_boxes(bmax, bmax_threshold, max_boxes, seed):
+    rows, cols = np.where(bmax > bmax_threshold)
+    n_boxes = rows.size
+    if n_boxes == 0:
+        raise ValueError(
+            "no boxes were found with a bmax value greater than the bmax_threshold"
+        )
+    rng = np.random.default_rng(seed)
+    keep = rng.random(n_boxes) < (max_boxes / n_boxes)
+    return rows[keep], cols[keep]
+
+
+def bmax_otsu(
+    img,
+    initial_threshold=0,
+    invert=False,
+    grid_size=100,
+    bmax_threshold=0.75,
+    max_boxes=100,
+    seed=7,
+    max_buckets=255,
+    min_bucket_width=1,
+    n_workers=None,
+):
+    """
+    Local implementation of thresholding.bmax_otsu for in-memory or memory-mapped arrays
+
+    Args:
+        img (np.ndarray): 2-d array to threshold, nan or masked values are treated as no data
+
+    Keywords:
+        initial_threshold (float): initial value to split the classes
+            default = 0
+        invert (bool): flag to return values greater than the threshold as water
+            default = False
+        grid_size (int): size of the boxes in pixels
+            default = 100
+        bmax_threshold (float): minimum bmax value for a box to be sampled
+            default = 0.75
+        max_boxes (int): maximum number of boxes to sample the histogram from
+            default = 100
+        seed (int): random seed for selecting boxes
+            default = 7
+        max_buckets (int): maximum number of histogram buckets
+            default = 255
+        min_bucket_width (float): minimum histogram bucket width
+            default = 1
+        n_workers (int): number of threads to use for the box reductions
+            default = None
+
+    Returns:
+        water (np.ndarray): uint8 array where 1 = water
+    """
+    stats = box_statistics(img, grid_size, initial_threshold, n_workers=n_workers)
+    rows, cols = _select_boxes(stats["bmax"], bmax_threshold, max_boxes, seed)
+
+    samples = np.concatenate(
+        [
+            _as_float(
+                img[
+                    r * grid_size : (r + 1) * grid_size,
+                    c * grid_size : (c + 1) * grid_size,
+                ]
+            ).ravel()
+            for r, c in zip(rows, cols)
+        ]
+    )
+
+    threshold = otsu(histogram(samples, max_buckets, min_bucket_width))
+
+    return _apply_threshold(img, threshold, invert)
+
+
+def edge_otsu(
+    img,
+    initial_threshold=0,
+    canny_threshold=0.05,
+    canny_sigma=0,
+    canny_lt=0.05,
+    connected_pixels=200,
+    edge_length=50,
+    edge_buffer=100,
+    invert=False,
+    scale=90,
+    max_buckets=255,
+    min_bucket_width=2,
+):
+    """
+    Local implementation of thresholding.edge_otsu for in-memory arrays. Edges are the
+    pixels where the Sobel gradient magnitude of the initial water mask exceeds
+    canny_threshold, there is no non-maximum suppression like ee.Algorithms.CannyEdgeDetector
+    so edges are two pixels wide and edge_length counts pixels of both sides of an edge
+
+    Args:
+        img (np.ndarray): 2-d array to threshold, nan or masked values are treated as no data
+
+    Keywords:
+        initial_threshold (float): initial value to split the classes
+            default = 0
+        canny_threshold (float): gradient magnitude threshold for edge detection
+            default = 0.05
+        canny_sigma (float): sigma value for gaussian filter before edge detection
+            default = 0
+        canny_lt (float): edge pixels with a magnitude below canny_lt are connected separately
+            from stronger edge pixels, like canny.mask(canny).lt(canny_lt) in Earth Engine
+            default = 0.05
+        connected_pixels (int): maximum size of the neighborhood in pixels
+            default = 200
+        edge_length (int): minimum length of edges in pixels
+            default = 50
+        edge_buffer (float): buffer around edges to sample histogram in meters
+            default = 100
+        invert (bool): flag to return values greater than the threshold as water
+            default = False
+        scale (float): pixel size of the array in meters
+            default = 90
+        max_buckets (int): maximum number of histogram buckets
+            default = 255
+        min_bucket_width (float): minimum histogram bucket width
+            default = 2
+
+    Returns:
+        water (np.ndarray): uint8 array where 1 = water
+    """
+    data = _as_float(img)
+    valid = np.isfinite(data)
+
+    binary = (valid & (data < initial_threshold)).astype(np.float32)
+    if canny_sigma > 0:
+        binary = ndimage.gaussian_filter(binary, canny_sigma)
+
+    magnitude = np.hypot(ndimage.sobel(binary, axis=0), ndimage.sobel(binary, axis=1))
+    canny = (magnitude > canny_threshold) & valid
+    weak = canny & (magnitude < canny_lt)
+
+    # connectedPixelCount counts connected pixels with the same value
+    edges = np.zeros(canny.shape, dtype=bool)
+    for group in (weak, canny & ~weak):
+        labels, _ = ndimage.label(group, structure=np.ones((3, 3)))
+        sizes = np.minimum(np.bincount(labels.ravel()), connected_pixels)
+        sizes[0] = 0
+        edges |= sizes[labels] >= edge_length
+
+    buffer_pixels = int(np.ceil(edge_buffer / scale))
+    buffered = ndimage.maximum_filter(edges, size=2 * buffer_pixels + 1)
+
+    samples = data[buffered & valid]
+    threshold = otsu(histogram(samples, max_buckets, min_bucket_width))
+
+    return _apply_threshold(img, threshold, invert)
+
+
+def _apply_threshold(img, threshold, invert, chunk_rows=4096):
+    water = np.zeros(img.shape, dtype=np.uint8)
+    for i in range(0, img.shape[0], chunk_rows):
+        data = _as_float(img[i : i + chunk_rows])
+        water[i : i + chunk_rows] = data > threshold if invert else data < threshold
+    return water
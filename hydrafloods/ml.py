@@ -1,7 +1,11 @@
+import os
 import ee
 import copy
+import glob
+import logging
 import numpy as np
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from hydrafloods import geeutils, decorators
 
 
@@ -108,205 +112,375 @@ def random_forest_from_str(path):
     return classifier
 
 
-def optimize(model, features, labels, opt_params=None):
-    from bayes_opt import BayesianOptimization
+def _sample_files(path, pattern="*.csv"):
+    if path.startswith("gs://"):
+        from hydrafloods import utils
+
+        return utils.list_gcs_objs(path.replace("gs://", ""), pattern=pattern)
+    return sorted(glob.glob(os.path.join(path, pattern)))
+
+
+def _stream_tables(files, read_func, n_workers):
+    # yields tables in file order while keeping a few reads per worker in flight
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        pending = []
+        for f in files:
+            pending.append(executor.submit(read_func, f))
+            if len(pending) >= 2 * n_workers:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+def read_samples(
+    path,
+    features,
+    label,
+    pattern="*.csv",
+    label_dtype=np.float32,
+    n_workers=4,
+    cache=None,
+    refresh_cache=False,
+):
+    """
+    Function to read training samples exported as CSV tables, i.e. from apps.dswfp.export_fusion_samples.
+    Only the feature and label columns are parsed with compact dtypes and the tables are
+    read concurrently in a thread pool. Optionally the samples are streamed to a local Arrow
+    file that later runs memory-map instead of reading the tables again
+
+    Args:
+        path (str): Google Cloud Storage path (gs://bucket/prefix) or local directory with the tables
+        features (list): names of the feature columns, read as float32
+        label (str): name of the label column
+
+    Keywords:
+        pattern (str): glob pattern to select the tables with
+            default = "*.csv"
+        label_dtype (np.dtype): dtype to read the label column as, i.e. np.uint8 for class labels
+            default = np.float32
+        n_workers (int): number of tables to read concurrently
+            default = 4
+        cache (str|pathlib.Path): local Arrow IPC file to write the samples to and memory-map
+            them from on later runs, requires pyarrow. None reads the tables into memory
+            default = None
+        refresh_cache (bool): read the tables again even if the cache file exists
+            default = False
+
+    Returns:
+        df (pd.DataFrame): table with the feature and label columns
+    """
+    columns = list(dict.fromkeys(list(features) + [label]))
+    dtypes = {c: np.float32 for c in features}
+    dtypes[label] = label_dtype
+
+    if cache is not None:
+        import pyarrow as pa
+
+        cache = str(cache)
+        if refresh_cache or not os.path.exists(cache):
+            _write_sample_cache(path, columns, dtypes, pattern, n_workers, cache)
+        with pa.memory_map(cache) as source:
+            table = pa.ipc.open_file(source).read_all()
+        return table.to_pandas(split_blocks=True)
+
+    files = _sample_files(path, pattern)
+    if not files:
+        raise ValueError(f"no tables matching {pattern} found in {path}")
+
+    def _read(f):
+        return pd.read_csv(f, usecols=columns, dtype=dtypes)[columns]
+
+    tables = list(_stream_tables(files, _read, n_workers))
+    df = pd.concat(tables, axis=0, ignore_index=True)
+    logging.info(f"read {df.shape[0]} samples from {len(files)} tables")
+
+    return df
+
+
+def _write_sample_cache(path, columns, dtypes, pattern, n_workers, cache):
+    import pyarrow as pa
+
+    files = _sample_files(path, pattern)
+    if not files:
+        raise ValueError(f"no tables matching {pattern} found in {path}")
+
+    def _read(f):
+        df = pd.read_csv(f, usecols=columns, dtype=dtypes)[columns]
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+    # write to a temporary file so an interrupted run does not leave a partial cache
+    tmp = f"{cache}.tmp"
+    n = 0
+    writer = None
+    for table in _stream_tables(files, _read, n_workers):
+        if writer is None:
+            writer = pa.ipc.new_file(tmp, table.schema)
+        writer.write_table(table)
+        n += table.num_rows
+    writer.close()
+    os.replace(tmp, cache)
+    logging.info(f"cached {n} samples from {len(files)} tables to {cache}")
 
-    def crossval(n_estimators, min_samples_split, max_features):
-        """Wrapper of RandomForest cross validation.
-        Notice how we ensure n_estimators and min_samples_split are casted
-        to integer before we pass them along. Moreover, to avoid max_features
-        taking values outside the (0, 1) range, we also ensure it is capped
-        accordingly.
-        """
-        return cv(
-            n_estimators=int(n_estimators),
-            min_samples_split=int(min_samples_split),
-            max_features=max(min(max_features, 0.999), 1e-3),
-            data=data,
-            targets=targets,
+    return
+
+
+def outlier_mask(
+    X,
+    feature_names=None,
+    alpha=0.05,
+    z_threshold=3,
+    iqr_factor=1.5,
+    max_samples=1000000,
+    chunk_rows=1000000,
+    seed=0,
+):
+    """
+    Function to flag outlier samples in a feature matrix. Features with few unique values
+    are treated as categorical and kept, features that pass a normality test are filtered
+    by z-score and all other features by the interquartile range. Constant features are
+    kept as well. The column statistics are computed for all features at once, quantiles
+    and the normality test use a random subsample of rows when there are more than
+    max_samples. Nan values are ignored by the statistics and never flagged as outliers
+
+    Args:
+        X (np.ndarray | pd.DataFrame): 2-d feature matrix of shape (samples, features)
+
+    Keywords:
+        feature_names (list): names of the features for the report
+            default = None (uses the column index)
+        alpha (float): features with a ratio of unique values below alpha are categorical and
+            features with a normaltest p-value of at least alpha are gaussian
+            default = 0.05
+        z_threshold (float): maximum absolute z-score of gaussian features
+            default = 3
+        iqr_factor (float): number of interquartile ranges outside the quartiles to keep
+            default = 1.5
+        max_samples (int): maximum number of rows to estimate quantiles and test normality with
+            default = 1000000
+        chunk_rows (int): number of rows to test against the bounds at once
+            default = 1000000
+        seed (int): seed for the subsample
+            default = 0
+
+    Returns:
+        mask (np.ndarray): boolean array with True for the rows to keep
+        report (dict): number of rows removed per rule ("zscore", "iqr", "total") and the
+            rule used per feature ("features"), one of "categorical", "constant", "zscore" or "iqr"
+    """
+    from scipy import stats
+
+    X = np.asarray(X, dtype=np.float32)
+    n, n_features = X.shape
+    feature_names = feature_names or list(range(n_features))
+
+    if n > max_samples:
+        rng = np.random.default_rng(seed)
+        sample = X[np.sort(rng.choice(n, max_samples, replace=False))]
+    else:
+        sample = X
+
+    # ratio of unique values per column from the sorted subsample, nan values sort last
+    ordered = np.sort(sample, axis=0)
+    n_valid = (~np.isnan(ordered)).sum(axis=0)
+    n_unique = (n_valid > 0) + (
+        (np.diff(ordered, axis=0) != 0) & ~np.isnan(ordered[1:])
+    ).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        categorical = n_unique / n_valid < alpha
+
+    with np.errstate(invalid="ignore"):
+        mean = np.nanmean(X, axis=0, dtype=np.float64)
+        std = np.nanstd(X, axis=0, dtype=np.float64)
+    # constant and empty columns have no outliers
+    constant = ~categorical & ~(std > 0)
+
+    # normaltest can not reject normality at alpha -> treat as gaussian
+    filtered = ~categorical & ~constant
+    p = np.zeros(n_features)
+    if filtered.any():
+        _, p[filtered] = stats.normaltest(
+            sample[:, filtered], axis=0, nan_policy="omit"
         )
+    gaussian = filtered & (p >= alpha)
+    skewed = filtered & ~gaussian
+
+    q1, q3 = np.nanquantile(ordered, [0.25, 0.75], axis=0)
+    iqr = q3 - q1
+
+    lower = np.full(n_features, -np.inf)
+    upper = np.full(n_features, np.inf)
+    lower[gaussian] = (mean - z_threshold * std)[gaussian]
+    upper[gaussian] = (mean + z_threshold * std)[gaussian]
+    lower[skewed] = (q1 - iqr_factor * iqr)[skewed]
+    upper[skewed] = (q3 + iqr_factor * iqr)[skewed]
+
+    mask = np.empty(n, dtype=bool)
+    removed = dict(zscore=0, iqr=0)
+    for start in range(0, n, chunk_rows):
+        block = X[start : start + chunk_rows]
+        outside = (block < lower) | (block > upper)
+        removed["zscore"] += int(outside[:, gaussian].any(axis=1).sum())
+        removed["iqr"] += int(outside[:, skewed].any(axis=1).sum())
+        mask[start : start + chunk_rows] = ~outside.any(axis=1)
+
+    rules = np.select(
+        [categorical, constant, gaussian], ["categorical", "constant", "zscore"], "iqr"
+    )
+    report = dict(
+        removed,
+        total=int(n - mask.sum()),
+        features=dict(zip(feature_names, rules.tolist())),
+    )
+    logging.info(f"outlier filter removed {report['total']} of {n} samples: {report}")
+
+    return mask, report
+
+
+OPTIMIZE_BOUNDS = {
+    "n_estimators": (10, 250),
+    "min_samples_split": (2, 25),
+    "max_features": (0.1, 0.999),
+}
+INTEGER_PARAMS = ("n_estimators", "min_samples_split", "max_depth", "min_samples_leaf")
+
+
+def optimize(
+    model, features, labels, opt_params=None, n_iter=10, classifier=False, seed=1234
+):
+    """
+    Function to find random forest hyperparameters with Bayesian optimization of the
+    cross validation score, requires the bayes_opt package
+
+    Args:
+        model (class): scikit-learn estimator class, i.e. ExtraTreesRegressor
+        features (np.ndarray): 2-d feature matrix of shape (samples, features)
+        labels (np.ndarray): 1-d array of labels
+
+    Keywords:
+        opt_params (dict): bounds of the parameters to search as (min, max) tuples
+            default = None (OPTIMIZE_BOUNDS)
+        n_iter (int): number of optimization iterations
+            default = 10
+        classifier (bool): score with log loss instead of mean squared error
+            default = False
+        seed (int): random state of the optimizer
+            default = 1234
+
+    Returns:
+        best (dict): best "target" score and "params"
+    """
+    from bayes_opt import BayesianOptimization
+
+    def crossval(**params):
+        # integer parameters are cast and max_features is kept within (0, 1)
+        for k in INTEGER_PARAMS:
+            if k in params:
+                params[k] = int(params[k])
+        if "max_features" in params:
+            params["max_features"] = max(min(params["max_features"], 0.999), 1e-3)
+        return cv(model, features, labels, classifier=classifier, **params)
 
     optimizer = BayesianOptimization(
         f=crossval,
-        pbounds={
-            "n_estimators": (10, 250),
-            "min_samples_split": (2, 25),
-            "max_features": (0.1, 0.999),
-        },
-        random_state=1234,
+        pbounds=opt_params or OPTIMIZE_BOUNDS,
+        random_state=seed,
         verbose=2,
     )
-    optimizer.maximize(n_iter=10)
+    optimizer.maximize(n_iter=n_iter)
 
-    print("Final result:", optimizer.max)
+    logging.info(f"Final result: {optimizer.max}")
 
-    return
+    return optimizer.max
 
 
 def cv(model, features, labels, n_cv=5, classifier=False, **kwargs):
-    """Random Forest cross validation.
-    This function will instantiate a random forest classifier with parameters
-    n_estimators, min_samples_split, and max_features. Combined with data and
-    targets this will in turn be used to perform cross validation. The result
-    of cross validation is returned.
-    Our goal is to find combinations of n_estimators, min_samples_split, and
-    max_features that minimzes the log loss.
     """
+    Function to cross validate an estimator with the given parameters
+
+    Args:
+        model (class): scikit-learn estimator class, i.e. ExtraTreesRegressor
+        features (np.ndarray): 2-d feature matrix of shape (samples, features)
+        labels (np.ndarray): 1-d array of labels
+
+    Keywords:
+        n_cv (int): number of cross validation folds
+            default = 5
+        classifier (bool): score with log loss instead of mean squared error
+            default = False
+        **kwargs: parameters passed to model
+
+    Returns:
+        score (float): mean negative log loss or negative mean squared error, higher is better
+    """
+    from sklearn.model_selection import cross_val_score
 
-    score_metric = "neg_log_loss" if classifier else "mean_squared_error"
+    score_metric = "neg_log_loss" if classifier else "neg_mean_squared_error"
     estimator = model(**kwargs)
     cval = cross_val_score(estimator, features, labels, scoring=score_metric, cv=n_cv)
     return cval.mean()
 
 
-def sklearn_tree_to_string(estimator, feature_names):
-
-    # extract out the information need to build the tree string
-    n_nodes = estimator.tree_.node_count
-    children_left = estimator.tree_.children_left
-    children_right = estimator.tree_.children_right
-    feature_idx = estimator.tree_.feature
-    values = estimator.tree_.value
-    impurities = estimator.tree_.impurity
-    n_samples = estimator.tree_.n_node_samples
-    thresholds = estimator.tree_.threshold
-    features = [feature_names[i] for i in feature_idx]
-
-    # use iterative pre-order search to extract node depth and leaf information
-    node_ids = np.zeros(shape=n_nodes, dtype=np.int64)
-    node_depth = np.zeros(shape=n_nodes, dtype=np.int64)
-    is_leaves = np.zeros(shape=n_nodes, dtype=bool)
-    stack = [(0, -1)]  # seed is the root node id and its parent depth
-    while len(stack) > 0:
-        node_id, parent_depth = stack.pop()
-        node_depth[node_id] = parent_depth + 1
-        node_ids[node_id] = node_id
-
-        # If we have a test node
-        if children_left[node_id] != children_right[node_id]:
-            stack.append((children_left[node_id], parent_depth + 1))
-            stack.append((children_right[node_id], parent_depth + 1))
-        else:
-            is_leaves[node_id] = True
-
-    # create a table of the initial structure
-    # each row is a node or leaf
-    df = pd.DataFrame(
-        {
-            "node_id": node_ids,
-            "node_depth": node_depth,
-            "is_leaf": is_leaves,
-            "children_left": children_left,
-            "children_right": children_right,
-            "value": np.squeeze(values),
-            "criterion": impurities,
-            "n_samples": n_samples,
-            "threshold": thresholds,
-            "feature_name": features,
-            "sign": ["<="] * n_nodes,
-        }
-    )
+def _format_number(x, precision=4):
+    # repr is the shortest string that round trips to the same float
+    return repr(float(x)) if precision is None else f"{x:.{precision}f}"
 
-    # the table representation does not have lef vs right node structure
-    # so we need to add in right nodes in the correct location
-    # we do this by first calculating which nodes are right and then insert them at the correct index
-
-    # get a dict of right node rows and assign key based on index where to insert
-    inserts = {}
-    for row in df.itertuples():
-        child_r = row.children_right
-        if child_r > row.Index:
-            ordered_row = np.array(row)
-            ordered_row[-1] = ">"
-            inserts[child_r] = ordered_row[1:]  # drop index value
-    # sort the inserts as to keep track of the additive indexing
-    inserts_sorted = {k: inserts[k] for k in sorted(inserts.keys())}
-
-    # loop through the row inserts and add to table (array)
-    table_values = df.values
-    for i, k in enumerate(inserts_sorted.keys()):
-        table_values = np.insert(table_values, (k + i), inserts_sorted[k], axis=0)
-
-    # make the ordered table array into a dataframe
-    # note: df is dtype "object", need to cast later on
-    ordered_df = pd.DataFrame(table_values, columns=df.columns)
-
-    max_depth = np.max(ordered_df.node_depth.astype(int))
-    tree_str = f"1) root 0 0 0 (0)\n"
-    previous_depth = -1
-    cnts = []
-    # loop through the nodes and calculate the node number and values per node
-    for row in ordered_df.itertuples():
-        node_depth = int(row.node_depth)
-        left = int(row.children_left)
-        right = int(row.children_right)
-        if left != right:
-            if row.Index == 0:
-                cnt = 2
-            elif previous_depth > node_depth:
-                depths = ordered_df.node_depth.values[: row.Index]
-                idx = np.where(depths == node_depth)[0][-1]
-                # cnt = (cnts[row.Index-1] // 2) + 1
-                cnt = cnts[idx] + 1
-            elif previous_depth < node_depth:
-                cnt = cnts[row.Index - 1] * 2
-            elif previous_depth == node_depth:
-                cnt = cnts[row.Index - 1] + 1
-
-            if node_depth == (max_depth - 1):
-                value = float(ordered_df.iloc[row.Index + 1].value)
-                samps = int(ordered_df.iloc[row.Index + 1].n_samples)
-                criterion = float(ordered_df.iloc[row.Index + 1].criterion)
-                tail = " *\n"
-            else:
-                if (
-                    (bool(ordered_df.loc[ordered_df.node_id == left].iloc[0].is_leaf))
-                    and (
-                        bool(
-                            int(row.Index)
-                            < int(ordered_df.loc[ordered_df.node_id == left].index[0])
-                        )
-                    )
-                    and (str(row.sign) == "<=")
-                ):
-                    rowx = ordered_df.loc[ordered_df.node_id == left].iloc[0]
-                    tail = " *\n"
-                    value = float(rowx.value)
-                    samps = int(rowx.n_samples)
-                    criterion = float(rowx.criterion)
-
-                elif (
-                    (bool(ordered_df.loc[ordered_df.node_id == right].iloc[0].is_leaf))
-                    and (
-                        bool(
-                            int(row.Index)
-                            < int(ordered_df.loc[ordered_df.node_id == right].index[0])
-                        )
-                    )
-                    and (str(row.sign) == ">")
-                ):
-                    rowx = ordered_df.loc[ordered_df.node_id == right].iloc[0]
-                    tail = " *\n"
-                    value = float(rowx.value)
-                    samps = int(rowx.n_samples)
-                    criterion = float(rowx.criterion)
-
-                else:
-                    value = float(row.value)
-                    samps = 0  # int(row.n_samples)
-                    criterion = 0  # float(row.criterion)
-                    tail = "\n"
-
-            # extract out the information needed in each line
-            # spacing = (node_depth + 1) * "  "  # for pretty printing
-            fname = str(row.feature_name)  # name of the feature (i.e. band name)
-            tresh = float(row.threshold)  # threshold
-            sign = str(row.sign)
-
-            # tree_str += f"{cnt}) {fname} {sign} {tresh:.6f} {samps} {criterion:.4f} {value:.6f}{tail}"
-            tree_str += f"{cnt}) {fname} {sign} {tresh:.4f} 0 0 {value:.4f}{tail}"
-            previous_depth = node_depth
-        cnts.append(cnt)
-
-    return tree_str
 
+def sklearn_tree_to_string(estimator, feature_names, precision=4):
+    """
+    Function to convert a fitted scikit-learn decision tree to the R-style string format
+    used by ee.Classifier.decisionTreeEnsemble. Nodes are numbered like rpart where the
+    children of node k are 2k (feature <= threshold) and 2k+1 (feature > threshold) and
+    leaves are marked with "*". The tree arrays are traversed once in pre-order so the
+    cost is linear in the number of nodes
+
+    Args:
+        estimator (sklearn.tree.BaseDecisionTree): fitted decision tree, i.e. one of model.estimators_
+        feature_names (list): names of the features in the order the tree was trained with
+
+    Keywords:
+        precision (int): number of decimals for thresholds and values, None writes the
+            shortest representation that reproduces the exact float so predictions match
+            estimator.predict
+            default = 4
+
+    Returns:
+        tree_str (str): string representation of the tree
+    """
+    tree = estimator.tree_
+    children_left = tree.children_left
+    children_right = tree.children_right
+    feature_idx = tree.feature
+
+    values = tree.value[:, 0, :]
+    if values.shape[1] > 1:
+        # classification trees store the class distribution, use the majority class label
+        values = estimator.classes_[values.argmax(axis=1)]
+    else:
+        values = values[:, 0]
+
+    thresholds = [_format_number(t, precision) for t in tree.threshold]
+    outputs = [_format_number(v, precision) for v in values]
+
+    # pre-order traversal writing one line per node into a preallocated list,
+    # the right child is pushed first so the left subtree is written first
+    lines = [None] * tree.node_count
+    root_tail = " *" if children_left[0] == children_right[0] else ""
+    stack = [(0, 1, f"1) root 0 0 {outputs[0]}{root_tail}\n")]
+    i = 0
+    while stack:
+        node, k, line = stack.pop()
+        lines[i] = line
+        i += 1
+
+        left, right = children_left[node], children_right[node]
+        if left == right:
+            continue
+
+        fname = feature_names[feature_idx[node]]
+        threshold = thresholds[node]
+        for child, child_k, sign in ((right, 2 * k + 1, ">"), (left, 2 * k, "<=")):
+            tail = " *" if children_left[child] == children_right[child] else ""
+            line = f"{child_k}) {fname} {sign} {threshold} 0 0 {outputs[child]}{tail}\n"
+            stack.append((child, child_k, line))
+
+    return "".join(lines)
@@ -1,112 +1,298 @@
 import os
+import glob
+import hashlib
+import functools
 import numpy as np
 import xarray as xr
-from scipy import ndimage, interpolate
+from scipy import interpolate
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from osgeo import gdal, osr
 from pyproj import Proj, transform
 from pyresample import bilinear, geometry, utils
 
+VIIRS_TREE = "//HDFEOS/GRIDS/VNP_Grid_{}_2D/Data_Fields/"
+VIIRS_FIELD = "SurfReflect_{0}{1}_1"
+VIIRS_SUBDATASET = 'HDF5:"{0}":{1}{2}'
+VIIRS_PROJ = (
+    "+proj=sinu +lon_0=0 +x_0=0 +y_0=0 +a=6371007.181 +b=6371007.181 +units=m +no_defs"
+)
+# names of the arrays returned by pyresample.bilinear.get_bil_info
+BIL_INFO_NAMES = ("t", "s", "input_idxs", "idx_arr")
+BIL_INFO_CACHE_SIZE = 32
+_BIL_INFO = OrderedDict()
 
-def viirs(infile):
-    tree = "//HDFEOS/GRIDS/VNP_Grid_{}_2D/Data_Fields/"
-    field = "SurfReflect_{0}{1}_1"
-    base = 'HDF5:"{0}":{1}{2}'
+# moderate resolution bands are read at 1km and upsampled to the 500m imagery bands
+VIIRS_BANDS = [("M", b) for b in range(12) if b not in [0, 6, 9]] + [
+    ("I", b) for b in range(1, 4)
+]
 
-    outEpsg = 3857
-    nd = -999
-
-    # sinuWkt = '''PROJCS["Sphere_Sinusoidal",GEOGCS["GCS_Sphere",DATUM["D_Sphere",SPHEROID["Sphere",6371000.0,0.0]],PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]],PROJECTION["Sinusoidal"],PARAMETER["False_Easting",0.0],PARAMETER["False_Northing",0.0],PARAMETER["Central_Meridian",0.0],UNIT["Meter",1.0]]'''
 
-    proj = "+proj=sinu +lon_0=0 +x_0=0 +y_0=0 +datum=WGS84 +ellps=WGS84 +a=6371007.181 +b=6371007.181 +units=m +no_defs"
-    outProj = Proj(proj)
-    inProj = Proj(init="epsg:4326")
-
-    srs = osr.SpatialReference()
-    srs.ImportFromProj4(outProj.definition_string())
+def _extract_bits(values, start, end):
+    mask = (1 << (end - start + 1)) - 1
+    return (values >> start) & mask
 
-    m = [i for i in range(12) if i not in [0, 6, 9]]
-    i = [i for i in range(1, 4)]
-    bands = [m, i]
-    flatBands = [item for sublist in bands for item in sublist]
 
-    res = ["1km", "500m"]
-    mode = ["M", "I"]
+def _upsample(values, factor=2):
+    return np.repeat(np.repeat(values, factor, axis=0), factor, axis=1)
 
-    band = gdal.Open(base.format(infile, tree.format("1km"), field.format("QF", 1)))
-    metadata = band.GetMetadata()
-    # print(metadata)
-    cloudQA = _extractBits(band.ReadAsArray(), 2, 3)
-    hiresCloudQA = ndimage.zoom(cloudQA, 2, order=0)
-    band = None
-
-    band = gdal.Open(base.format(infile, tree.format("1km"), field.format("QF", 2)))
-    shadowQA = _extractBits(band.ReadAsArray(), 3, 3)
-    hiresShadowQA = ndimage.zoom(shadowQA, 2, order=0)
-
-    qa = ~(hiresCloudQA > 0) & (hiresShadowQA < 1)
-
-    ringLatitude = metadata["GRingLatitude"].split(" ")[:-1]
-    ringLongitude = metadata["GRingLongitude"].split(" ")[:-1]
-
-    ll, ul, ur, lr = [
-        transform(inProj, outProj, float(ringLongitude[i]), float(ringLatitude[i]))
-        for i in range(len(ringLatitude))
-    ]
-    iniX, iniY = ul[0], ul[1]
-    print(ll, ul, ur, lr)
 
-    bandNames = [
-        "{0}{1}".format(mode[i], bands[i][j])
-        for i in range(len(res))
-        for j in range(len(bands[i]))
-    ]
+def _viirs_subdataset(infile, mode, b):
+    res = "500m" if mode == "I" else "1km"
+    return gdal.Open(
+        VIIRS_SUBDATASET.format(
+            infile, VIIRS_TREE.format(res), VIIRS_FIELD.format(mode, b)
+        )
+    )
 
-    subdata = [
-        [infile, res[i], mode[i], bands[i][j]]
-        for i in range(len(res))
-        for j in range(len(bands[i]))
-    ]
 
-    data = np.zeros([qa.shape[0], qa.shape[1], len(subdata) + 1])
+def _viirs_blocks(infile, block_rows=512, no_data=-999):
+    # yields (row offset, block) with block of shape (bands, rows, cols) at 500m
+    # where the last band is the clear sky QA flag
+    qf1, qf2 = _viirs_subdataset(infile, "QF", 1), _viirs_subdataset(infile, "QF", 2)
+    bands = [_viirs_subdataset(infile, m, b) for m, b in VIIRS_BANDS]
+
+    y_size, x_size = bands[-1].RasterYSize, bands[-1].RasterXSize
+    # keep blocks aligned with the 1km rows
+    block_rows += block_rows % 2
+
+    for row in range(0, y_size, block_rows):
+        n_rows = min(block_rows, y_size - row)
+        coarse_row, coarse_rows = row // 2, (n_rows + 1) // 2
+
+        cloud = _extract_bits(
+            qf1.ReadAsArray(0, coarse_row, x_size // 2, coarse_rows), 2, 3
+        )
+        shadow = _extract_bits(
+            qf2.ReadAsArray(0, coarse_row, x_size // 2, coarse_rows), 3, 3
+        )
+        qa = _upsample((cloud == 0) & (shadow < 1))[:n_rows]
+
+        block = np.empty((len(bands) + 1, n_rows, x_size), dtype=np.int16)
+        for i, ((mode, _), band) in enumerate(zip(VIIRS_BANDS, bands)):
+            if mode == "M":
+                values = _upsample(
+                    band.ReadAsArray(0, coarse_row, x_size // 2, coarse_rows)
+                )
+                values = values[:n_rows]
+            else:
+                values = band.ReadAsArray(0, row, x_size, n_rows)
+            block[i] = np.where(values < 0, no_data, values)
+        block[-1] = qa
+
+        yield row, block
 
-    for i, s in enumerate(subdata):
-        infile, r, m, b = s
+    return
 
-        subdataset = base.format(infile, tree.format(r), field.format(m, b))
 
-        band = gdal.Open(subdataset)
-        if m == "M":
-            data = ndimage.zoom(band.ReadAsArray(), 2, order=0)
+def _viirs_geotransform(infile):
+    metadata = _viirs_subdataset(infile, "QF", 1).GetMetadata()
 
-        else:
-            sd = np.array(band.ReadAsArray())
-        band = None
+    # the grid ring is ordered as lower left, upper left, upper right, lower right
+    ring_lats = [float(v) for v in metadata["GRingLatitude"].split(" ")[:-1]]
+    ring_lons = [float(v) for v in metadata["GRingLongitude"].split(" ")[:-1]]
+    ul_x, ul_y = Proj(VIIRS_PROJ)(ring_lons[1], ring_lats[1])
 
-        sd[np.where(sd < 0)] = nd
+    res = float(metadata["CharacteristicBinSize500M"])
+    return (ul_x, res, 0, ul_y, 0, -res)
+
+
+def viirs(infile, out_name=None, block_rows=512, no_data=-999, **kwargs):
+    """
+    Function to convert a VIIRS VNP09GA HDF-EOS granule to an int16 Cloud Optimized
+    GeoTIFF. Subdatasets are read in blocks of rows, the 1km bands are upsampled to
+    500m and the QA bits are decoded per block so only a few blocks are held in memory
+
+    Args:
+        infile (str): path to the VNP09GA HDF5 file
+
+    Keywords:
+        out_name (str): path of the output GeoTIFF, None uses the input path with a .TIF extension
+            default = None
+        block_rows (int): number of 500m rows to process at once
+            default = 512
+        no_data (int): value for invalid pixels
+            default = -999
+        **kwargs: keywords passed to write_cog(), i.e. compress="ZSTD"
+
+    Returns:
+        out_name (str): path of the output GeoTIFF
+    """
+    if out_name is None:
+        name, _ = os.path.splitext(infile)
+        out_name = name + ".TIF"
+
+    template = _viirs_subdataset(infile, "I", 1)
+    x_size, y_size = template.RasterXSize, template.RasterYSize
+    template = None
+
+    blocks = (
+        (row, 0, block) for row, block in _viirs_blocks(infile, block_rows, no_data)
+    )
+    write_cog(
+        out_name,
+        blocks,
+        x_size,
+        y_size,
+        len(VIIRS_BANDS) + 1,
+        _viirs_geotransform(infile),
+        VIIRS_PROJ,
+        no_data=no_data,
+        **kwargs,
+    )
 
-        data[:, :, i] = sd
+    return out_name
 
-    data[:, :, -1] = qa
 
-    res = float(metadata["CharacteristicBinSize500M"])
-    yskew = math.sin(_getSkew(ur, ul)) * res
-    xskew = math.cos(_getSkew(ul, ll)) * res
-    print(xskew, yskew)
-    yDim, xDim = qa.shape
-    gt = (10007554.677, res, 0, 2223901.039333, 0, -res)
-    print(gt)
-
-    name, _ = os.path.splitext(infile)
-    out_name = name + ".TIF"
+def viirs_directory(indir, pattern="*.h5", n_workers=None, **kwargs):
+    """
+    Function to convert all VIIRS granules in a directory with a pool of processes
+
+    Args:
+        indir (str): directory with VNP09GA HDF5 files
+
+    Keywords:
+        pattern (str): glob pattern to match granules
+            default = "*.h5"
+        n_workers (int): number of processes
+            default = None (use ProcessPoolExecutor default)
+        **kwargs: keywords passed to viirs()
+
+    Returns:
+        out_names (list): paths of the output GeoTIFFs
+    """
+    files = sorted(glob.glob(os.path.join(indir, pattern)))
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(functools.partial(viirs, **kwargs), files))
+
+
+def _orbit_position(lons, lats, decimals=1):
+    # the ends of the first scan line place a granule on the repeating orbit track,
+    # both ends are used so ascending and descending passes over a point differ
+    ends = np.array([lons[0, [0, -1]], lats[0, [0, -1]]], dtype=np.float64)
+    # adding 0.0 turns -0.0 into 0.0 so both round to the same key
+    return tuple((np.round(ends, decimals) + 0.0).ravel().tolist())
+
+
+def _grid_tiles(xx, yy, grid_bounds, res, tile_size=64):
+    # extent of the tiles of a fixed global grid that cover the swath, snapping the
+    # extent to tiles gives granules on the same orbit track the same target grid
+    min_x, min_y, max_x, max_y = grid_bounds
+    tile = res * tile_size
+
+    def _snap(values, origin, upper):
+        first = np.floor((np.nanmin(values) - origin) / tile)
+        last = np.floor((np.nanmax(values) - origin) / tile) + 1
+        return max(origin + first * tile, origin), min(origin + last * tile, upper)
+
+    x0, x1 = _snap(xx, min_x, max_x)
+    y0, y1 = _snap(yy, min_y, max_y)
+    return (float(x0), float(y0), float(x1), float(y1))
+
+
+def _bilinear_info(
+    lons,
+    lats,
+    area_def,
+    radius,
+    neighbours=32,
+    nprocs=1,
+    segments=None,
+    epsilon=0,
+    cache_dir=None,
+    decimals=1,
+):
+    # bilinear resampling coefficients are keyed on the orbit geometry of the swath,
+    # the position of the first scan rounded to decimals and the swath shape, and
+    # the target grid. Granules of a repeating orbit track share coefficients even
+    # though their coordinates jitter slightly, the coefficients of the first granule
+    # are reused for the others. Coefficients are kept in memory and optionally as
+    # .npz files to share them between processes and runs
+    key = repr(
+        (
+            _orbit_position(lons, lats, decimals),
+            tuple(np.shape(lons)),
+            area_def.proj_str,
+            tuple(area_def.shape),
+            tuple(float(v) for v in area_def.area_extent),
+            radius,
+            neighbours,
+            epsilon,
+        )
+    )
+    key = hashlib.sha256(key.encode("utf-8")).hexdigest()
 
-    write_geotiff(out_name, data, gt, outEpsg, no_data=nd)
+    if key in _BIL_INFO:
+        _BIL_INFO.move_to_end(key)
+        return _BIL_INFO[key]
 
-    return out_name
+    path = os.path.join(cache_dir, f"{key}.npz") if cache_dir else None
+    if path is not None and os.path.exists(path):
+        with np.load(path) as cached:
+            info = tuple(cached[name] for name in BIL_INFO_NAMES)
+    else:
+        swath_def = geometry.SwathDefinition(lons=lons, lats=lats)
+        info = bilinear.get_bil_info(
+            swath_def,
+            area_def,
+            radius=radius,
+            neighbours=neighbours,
+            nprocs=nprocs,
+            masked=False,
+            reduce_data=True,
+            segments=segments,
+            epsilon=epsilon,
+        )
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            # write to a temporary file first so other processes never read partial files
+            tmp = f"{path[:-4]}.{os.getpid()}.npz"
+            np.savez(tmp, **dict(zip(BIL_INFO_NAMES, info)))
+            os.replace(tmp, path)
+
+    _BIL_INFO[key] = info
+    while len(_BIL_INFO) > BIL_INFO_CACHE_SIZE:
+        _BIL_INFO.popitem(last=False)
+
+    return info
 
 
 def atms(
-    infile, gridding_radius=25000,
+    infile,
+    gridding_radius=25000,
+    nprocs=1,
+    segments=None,
+    cache_dir=None,
+    decimals=1,
+    tile_size=64,
 ):
+    """
+    Function to grid ATMS water fraction to a 16km Web Mercator GeoTIFF with bilinear
+    resampling. Granules are gridded onto the tiles of a fixed global grid that cover
+    the swath and the resampling coefficients are cached on the orbit geometry, so
+    granules on a repeating orbit track skip the neighbour search
+
+    Args:
+        infile (str): path to the ATMS netCDF file
+
+    Keywords:
+        gridding_radius (float): search radius for neighbouring swath pixels in meters
+            default = 25000
+        nprocs (int): number of processes pyresample uses for the neighbour search
+            default = 1
+        segments (int): number of segments pyresample splits the neighbour search into
+            default = None (let pyresample decide)
+        cache_dir (str): directory to store resampling coefficients in, None only caches in memory
+            default = None
+        decimals (int): decimals the position of the first scan is rounded to for the cache key,
+            granules whose first scan rounds to the same position share coefficients
+            default = 1
+        tile_size (int): size of the global grid tiles in 16km pixels
+            default = 64
+
+    Returns:
+        out_name (str): path of the output GeoTIFF
+    """
     ds = xr.open_dataset(infile)
 
     outEpsg = 3857
@@ -122,13 +308,12 @@ def atms(
     maxx, maxy = transform(inProj, outProj, 180, 86)
     res = 16000
 
-    eastings = np.arange(round(minx), round(maxx), res)
-    northings = np.arange(round(miny), round(maxy), res)
-
-    ee = eastings[np.where((eastings > xx.min()) & (eastings < xx.max()))]
-    nn = northings[np.where((northings > yy.min()) & (northings < yy.max()))]
+    # fixed global grid, the output covers the tiles of the grid the swath falls in
+    min_x, min_y = round(minx), round(miny)
+    max_x = min_x + np.ceil((round(maxx) - min_x) / res) * res
+    max_y = min_y + np.ceil((round(maxy) - min_y) / res) * res
+    x0, y0, x1, y1 = _grid_tiles(xx, yy, (min_x, min_y, max_x, max_y), res, tile_size)
 
-    swath_def = geometry.SwathDefinition(lons=lons, lats=lats)
     area_def = geometry.AreaDefinition(
         "mercator",
         "WGS 84 / Pseudo-Mercator - Projected",
@@ -145,9 +330,9 @@ def atms(
             "a": "6378137",
             "b": "6378137",
         },
-        ee.size,
-        nn.size,
-        [ee.min(), nn.min(), ee.max(), nn.max()],
+        int(round((x1 - x0) / res)),
+        int(round((y1 - y0) / res)),
+        [x0, y0, x1, y1],
     )
 
     data = None
@@ -155,63 +340,253 @@ def atms(
     # TODO: dynamically estimate sigama based on beam footprints
     eps = 0.1
 
-    result = bilinear.resample_bilinear(
-        ds.land_frac.where(ds["sat_zen"] < 50).values,
-        swath_def,
+    info = _bilinear_info(
+        lons,
+        lats,
         area_def,
-        radius=gridding_radius,
+        gridding_radius,
         neighbours=32,
-        nprocs=1,
-        fill_value=nd,
-        reduce_data=True,
-        segments=None,
+        nprocs=nprocs,
+        segments=segments,
         epsilon=eps,
+        cache_dir=cache_dir,
+        decimals=decimals,
+    )
+    result = bilinear.get_sample_from_bil_info(
+        ds.land_frac.where(ds["sat_zen"] < 50).values.ravel(),
+        *info,
+        output_shape=area_def.shape,
     )
+    result = np.ma.masked_invalid(result).filled(nd)
 
     result[np.where(result >= 0)] = np.abs(result[np.where(result >= 0)] - 1) * 10000
 
     name, _ = os.path.splitext(infile)
     out_name = name + "_waterfrac.TIF"
 
-    gt = (ee.min(), res, 0, nn.max(), 0, -res)
+    gt = (x0, res, 0, y1, 0, -res)
 
     write_geotiff(out_name, result, gt, outEpsg, no_data=nd)
 
     return out_name
 
 
-def write_geotiff(out_name, data, gt, epsg, no_data=None):
-    srs = osr.SpatialReference()
-    srs.ImportFromEPSG(epsg)
+def atms_batch(files, n_workers=None, **kwargs):
+    """
+    Function to grid many ATMS granules with a pool of processes, each process keeps
+    its own in-memory cache of resampling coefficients. Pass cache_dir to also share
+    coefficients between processes and runs
+
+    Args:
+        files (list): paths to ATMS netCDF files
+
+    Keywords:
+        n_workers (int): number of processes
+            default = None (use ProcessPoolExecutor default)
+        **kwargs: keywords passed to atms()
+
+    Returns:
+        out_names (list): paths of the output GeoTIFFs
+    """
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(functools.partial(atms, **kwargs), files))
+
+
+def _create_geotiff(
+    out_name,
+    x_size,
+    y_size,
+    n_bands,
+    gt,
+    wkt,
+    dtype=gdal.GDT_Int16,
+    no_data=None,
+    compress="DEFLATE",
+    block_size=256,
+):
+    # tiled and compressed GeoTIFF that bands can be written to block by block
+    predictor = 3 if dtype in (gdal.GDT_Float32, gdal.GDT_Float64) else 2
+    options = [
+        "TILED=YES",
+        f"BLOCKXSIZE={block_size}",
+        f"BLOCKYSIZE={block_size}",
+        f"COMPRESS={compress}",
+        f"PREDICTOR={predictor}",
+        "BIGTIFF=IF_SAFER",
+    ]
+    driver = gdal.GetDriverByName("GTiff")
+    out_ds = driver.Create(out_name, x_size, y_size, n_bands, dtype, options=options)
+    out_ds.SetGeoTransform(gt)
+    out_ds.SetProjection(wkt)
+    if no_data is not None:
+        for b in range(n_bands):
+            out_ds.GetRasterBand(b + 1).SetNoDataValue(no_data)
+    return out_ds
 
-    if len(data.shape) == 3:
-        yDim, xDim = data.shape[:2]
-        nBands = data.shape[2]
 
-    elif len(data.shape) == 2:
-        yDim, xDim = data.shape
-        nBands = 1
+def _crs_wkt(crs):
+    srs = osr.SpatialReference()
+    if isinstance(crs, int):
+        srs.ImportFromEPSG(crs)
+    elif crs.strip().startswith("+"):
+        srs.ImportFromProj4(crs)
     else:
-        raise
-
-    driver = gdal.GetDriverByName("GTiff")
+        srs.ImportFromWkt(crs)
+    return srs.ExportToWkt()
+
+
+def _overview_levels(x_size, y_size, block_size):
+    levels = []
+    factor = 2
+    while max(x_size, y_size) / factor >= block_size:
+        levels.append(factor)
+        factor *= 2
+    return levels
+
+
+def write_cog(
+    out_name,
+    blocks,
+    x_size,
+    y_size,
+    n_bands,
+    gt,
+    crs,
+    dtype=gdal.GDT_Int16,
+    no_data=None,
+    compress="DEFLATE",
+    block_size=512,
+    resampling="NEAREST",
+):
+    """
+    Function to write a Cloud Optimized GeoTIFF from a stream of blocks. Blocks are
+    written to a tiled intermediate file, internal overviews are built and the file
+    is copied into the COG layout with tiles, overviews and compression
+
+    Args:
+        out_name (str): path of the output GeoTIFF
+        blocks (iterable): iterable of (row, col, block) tuples with the pixel offsets and
+            an array of shape (bands, rows, cols), or (rows, cols) for single band images
+        x_size (int): number of columns of the image
+        y_size (int): number of rows of the image
+        n_bands (int): number of bands of the image
+        gt (tuple): GDAL geotransform of the image
+        crs (int | str): EPSG code, proj4 string or WKT of the coordinate reference system
+
+    Keywords:
+        dtype (int): GDAL data type of the output
+            default = gdal.GDT_Int16
+        no_data (float): no data value of the bands
+            default = None
+        compress (str): compression algorithm, i.e. "DEFLATE" or "ZSTD"
+            default = "DEFLATE"
+        block_size (int): size of the internal tiles in pixels
+            default = 512
+        resampling (str): resampling method for the overviews
+            default = "NEAREST"
+
+    Returns:
+        out_name (str): path of the output GeoTIFF
+    """
+    tmp_name = f"{os.path.splitext(out_name)[0]}.{os.getpid()}.tmp.tif"
+    tmp_ds = _create_geotiff(
+        tmp_name,
+        x_size,
+        y_size,
+        n_bands,
+        gt,
+        _crs_wkt(crs),
+        dtype=dtype,
+        no_data=no_data,
+        compress=compress,
+        block_size=block_size,
+    )
 
-    outDs = driver.Create(out_name, xDim, yDim, nBands, gdal.GDT_Int16)
-    outDs.SetGeoTransform(gt)
-    # set to something that is not user defined
-    outDs.SetProjection(srs.ExportToWkt())
-
-    for b in range(nBands):
-        band = outDs.GetRasterBand(b + 1)
-        if no_data:
-            band.Setno_dataValue(-999)
-        if nBands > 1:
-            band.WriteArray(data[:, :, b])
+    for row, col, block in blocks:
+        block = block[np.newaxis] if block.ndim == 2 else block
+        for b in range(n_bands):
+            tmp_ds.GetRasterBand(b + 1).WriteArray(block[b], col, row)
+
+    levels = _overview_levels(x_size, y_size, block_size)
+    if levels:
+        tmp_ds.BuildOverviews(resampling, levels)
+    tmp_ds.FlushCache()
+
+    try:
+        if gdal.GetDriverByName("COG") is not None:
+            options = [
+                f"COMPRESS={compress}",
+                "PREDICTOR=YES",
+                f"BLOCKSIZE={block_size}",
+                f"OVERVIEW_RESAMPLING={resampling}",
+                "BIGTIFF=IF_SAFER",
+            ]
+            driver = gdal.GetDriverByName("COG")
         else:
-            band.WriteArray(data)
+            # GDAL < 3.1, the GTiff driver creates the same layout from a file with overviews
+            predictor = 3 if dtype in (gdal.GDT_Float32, gdal.GDT_Float64) else 2
+            options = [
+                "TILED=YES",
+                f"BLOCKXSIZE={block_size}",
+                f"BLOCKYSIZE={block_size}",
+                f"COMPRESS={compress}",
+                f"PREDICTOR={predictor}",
+                "COPY_SRC_OVERVIEWS=YES",
+                "BIGTIFF=IF_SAFER",
+            ]
+            driver = gdal.GetDriverByName("GTiff")
+        out_ds = driver.CreateCopy(out_name, tmp_ds, options=options)
+        out_ds.FlushCache()
+        out_ds = None
+    finally:
+        tmp_ds = None
+        gdal.GetDriverByName("GTiff").Delete(tmp_name)
 
-        band = None
+    return out_name
 
-    outDs.FlushCache()
 
-    return
+def _array_blocks(data, block_rows):
+    for row in range(0, data.shape[-2], block_rows):
+        yield row, 0, data[..., row : row + block_rows, :]
+
+
+def write_geotiff(out_name, data, gt, epsg, no_data=None, block_rows=512, **kwargs):
+    """
+    Function to write an array to a Cloud Optimized GeoTIFF, see write_cog()
+
+    Args:
+        out_name (str): path of the output GeoTIFF
+        data (np.ndarray): array of shape (rows, cols, bands) or (rows, cols)
+        gt (tuple): GDAL geotransform of the image
+        epsg (int): EPSG code of the coordinate reference system
+
+    Keywords:
+        no_data (float): no data value of the bands
+            default = None
+        block_rows (int): number of rows to write at once
+            default = 512
+        **kwargs: keywords passed to write_cog()
+
+    Returns:
+        out_name (str): path of the output GeoTIFF
+    """
+    if data.ndim == 3:
+        # write_cog expects bands first, transposing only creates a view
+        data = np.moveaxis(data, -1, 0)
+    elif data.ndim != 2:
+        raise ValueError(f"data must be a 2-d or 3-d array, got {data.ndim} dimensions")
+
+    y_size, x_size = data.shape[-2:]
+    n_bands = data.shape[0] if data.ndim == 3 else 1
+
+    return write_cog(
+        out_name,
+        _array_blocks(data, block_rows),
+        x_size,
+        y_size,
+        n_bands,
+        gt,
+        epsg,
+        no_data=no_data,
+        **kwargs,
+    )
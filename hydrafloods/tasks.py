@@ -0,0 +1,313 @@
+import ee
+import time
+import asyncio
+import logging
+
+# states reported by Earth Engine, the legacy and Cloud API use different names
+SUCCESS_STATES = ("COMPLETED", "SUCCEEDED")
+FAILURE_STATES = ("FAILED", "CANCELLED")
+# states for tasks that will not change anymore
+FINISHED_STATES = SUCCESS_STATES + FAILURE_STATES
+# states for tasks that are queued or running
+ACTIVE_STATES = (
+    "UNSUBMITTED",
+    "READY",
+    "PENDING",
+    "RUNNING",
+    "CANCEL_REQUESTED",
+    "CANCELLING",
+)
+# error messages from failed tasks that are worth retrying
+TRANSIENT_ERRORS = (
+    "internal error",
+    "too many",
+    "timed out",
+    "deadline",
+    "try again",
+    "unavailable",
+)
+
+
+class TaskRecord:
+    """
+    Bookkeeping for a single export managed by TaskManager
+
+    Args:
+        func (callable): function that creates an ee.batch.Task, i.e. ee.batch.Export.image.toAsset
+        args (tuple): positional arguments for func
+        kwargs (dict): keyword arguments for func
+    """
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.description = kwargs.get("description")
+
+        self.task = None
+        self.task_id = None
+        self.state = "PENDING"
+        self.attempts = 0
+        self.error = None
+        self.submitted = None
+        self.finished = None
+        self.unknown_polls = 0
+        return
+
+    def __repr__(self):
+        return (
+            f"TaskRecord(description={self.description!r}, task_id={self.task_id!r}, "
+            f"state={self.state!r}, attempts={self.attempts})"
+        )
+
+    @property
+    def elapsed(self):
+        """
+        Seconds between submitting the task and it finishing (or now if running)
+        """
+        if self.submitted is None:
+            return 0.0
+        end = self.finished if self.finished is not None else time.time()
+        return end - self.submitted
+
+
+def _is_transient(message):
+    message = (message or "").lower()
+    return any(err in message for err in TRANSIENT_ERRORS)
+
+
+class TaskManager:
+    """
+    Asynchronous scheduler for Earth Engine export tasks. Tasks are submitted while
+    staying under a concurrency cap, the status of all running tasks is requested
+    with one batched call per poll and polling backs off exponentially while
+    nothing changes. Tasks that fail with transient errors are resubmitted
+
+    Keywords:
+        max_concurrent (int): maximum number of tasks running on Earth Engine at once
+            default = 10
+        poll_interval (float): initial seconds between status requests
+            default = 5
+        max_poll_interval (float): maximum seconds between status requests
+            default = 120
+        backoff (float): factor to increase the poll interval by when no task changed state
+            default = 2
+        max_retries (int): maximum number of times a task is resubmitted after a transient failure
+            default = 3
+        max_unknown_polls (int): number of consecutive polls a task can report an unknown state,
+            i.e. "UNKNOWN", before it is no longer tracked
+            default = 10
+        callback (callable): function called with the TaskRecord whenever a task changes state
+            default = None
+    """
+
+    def __init__(
+        self,
+        max_concurrent=10,
+        poll_interval=5,
+        max_poll_interval=120,
+        backoff=2,
+        max_retries=3,
+        max_unknown_polls=10,
+        callback=None,
+    ):
+        self.max_concurrent = max_concurrent
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.backoff = backoff
+        self.max_retries = max_retries
+        self.max_unknown_polls = max_unknown_polls
+        self.callback = callback
+
+        self.records = []
+        return
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queues an export, the task is created and started when the manager runs
+
+        Args:
+            func (callable): function that creates an ee.batch.Task, i.e. ee.batch.Export.image.toAsset
+            *args: positional arguments for func
+            **kwargs: keyword arguments for func
+
+        Returns:
+            record (TaskRecord): record used to track the task
+        """
+        record = TaskRecord(func, args, kwargs)
+        self.records.append(record)
+        return record
+
+    def progress(self):
+        """
+        Returns a dictionary with the number of tasks in each state
+        """
+        counts = {}
+        for record in self.records:
+            counts[record.state] = counts.get(record.state, 0) + 1
+        return counts
+
+    def _update(self, record, state, error=None):
+        changed = record.state != state
+        record.state = state
+        record.error = error
+        if state in FINISHED_STATES:
+            record.finished = time.time()
+        if changed:
+            logging.info(f"{record.description} {state} ({self.progress()})")
+            if self.callback is not None:
+                self.callback(record)
+        return changed
+
+    def _start(self, record):
+        record.attempts += 1
+        record.task = record.func(*record.args, **record.kwargs)
+        record.task.start()
+        record.task_id = record.task.id
+        record.submitted = time.time()
+        return
+
+    def _retry_or_fail(self, record, queue, state, error):
+        if _is_transient(error) and record.attempts <= self.max_retries:
+            self._update(record, "PENDING", error)
+            queue.append(record)
+        else:
+            self._update(record, state, error)
+        return
+
+    async def run_async(self):
+        """
+        Submits and tracks all queued tasks until every task has finished
+
+        Returns:
+            records (list): TaskRecords of all tasks
+        """
+        loop = asyncio.get_running_loop()
+        queue = [r for r in self.records if r.state == "PENDING"]
+        active = {}
+        interval = self.poll_interval
+
+        while queue or active:
+            changed = False
+
+            # fill up open slots, starting tasks is a blocking request so use a thread
+            while queue and len(active) < self.max_concurrent:
+                record = queue.pop(0)
+                try:
+                    await loop.run_in_executor(None, self._start, record)
+                except Exception as e:
+                    # any error only fails this task, i.e. network errors from the client
+                    self._retry_or_fail(record, queue, "FAILED", str(e))
+                    changed = True
+                    if record.state == "PENDING":
+                        # earth engine is refusing tasks, wait before trying again
+                        break
+                    continue
+                active[record.task_id] = record
+                changed |= self._update(record, "READY")
+
+            if active:
+                try:
+                    statuses = await loop.run_in_executor(
+                        None, ee.data.getTaskStatus, list(active.keys())
+                    )
+                except Exception as e:
+                    logging.warning(f"could not request task status: {e}")
+                    statuses = []
+
+                for status in statuses:
+                    record = active[status["id"]]
+                    state = status["state"]
+                    if state == "FAILED":
+                        del active[status["id"]]
+                        self._retry_or_fail(
+                            record, queue, state, status.get("error_message")
+                        )
+                        changed = True
+                    elif state in FINISHED_STATES or state in ACTIVE_STATES:
+                        record.unknown_polls = 0
+                        if state in FINISHED_STATES:
+                            del active[status["id"]]
+                        changed |= self._update(record, state)
+                    else:
+                        # stop tracking tasks that keep reporting an unknown state
+                        record.unknown_polls += 1
+                        if record.unknown_polls >= self.max_unknown_polls:
+                            del active[status["id"]]
+                            record.finished = time.time()
+                        changed |= self._update(record, state)
+
+            if not (queue or active):
+                break
+
+            # poll quickly while tasks are changing and back off while they are not
+            if changed:
+                interval = self.poll_interval
+            else:
+                interval = min(interval * self.backoff, self.max_poll_interval)
+            await asyncio.sleep(interval)
+
+        return self.records
+
+    def run(self):
+        """
+        Blocking version of run_async()
+
+        Returns:
+            records (list): TaskRecords of all tasks
+        """
+        return asyncio.run(self.run_async())
+
+
+def wait_for(
+    task_id,
+    poll_interval=5,
+    max_poll_interval=120,
+    backoff=2,
+    timeout=None,
+    max_unknown_polls=10,
+):
+    """
+    Function to block until a task has finished, polling with exponential backoff
+
+    Args:
+        task_id (str): id of the Earth Engine task
+
+    Keywords:
+        poll_interval (float): initial seconds between status requests
+            default = 5
+        max_poll_interval (float): maximum seconds between status requests
+            default = 120
+        backoff (float): factor to increase the poll interval by after each request
+            default = 2
+        timeout (float): maximum seconds to wait, None waits until the task finished
+            default = None
+        max_unknown_polls (int): number of consecutive polls the task can report an unknown
+            state, i.e. "UNKNOWN", before its status is returned as final
+            default = 10
+
+    Returns:
+        status (dict): final status of the task, check the state against SUCCESS_STATES
+    """
+    start = time.time()
+    interval = poll_interval
+    unknown_polls = 0
+    while True:
+        status = ee.data.getTaskStatus(task_id)[0]
+        if status["state"] in FINISHED_STATES:
+            return status
+
+        if status["state"] in ACTIVE_STATES:
+            unknown_polls = 0
+        else:
+            unknown_polls += 1
+            if unknown_polls >= max_unknown_polls:
+                logging.warning(f"task {task_id} reported state {status['state']}")
+                return status
+
+        if timeout is not None and (time.time() - start) > timeout:
+            raise TimeoutError(
+                f"task {task_id} did not finish within {timeout} seconds"
+            )
+        time.sleep(interval)
+        interval = min(interval * backoff, max_poll_interval)
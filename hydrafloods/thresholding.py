@@ -1,7 +1,13 @@
 import ee
 from ee.ee_exception import EEException
 import random
-from hydrafloods import geeutils, decorators
+import numpy as np
+from hydrafloods import geeutils, decorators, tiling
+from hydrafloods.local import thresholding as local_thresholding
+
+# approximate length of one degree at the equator in meters
+# used to convert degree based keywords for the local array backend
+DEGREE_LENGTH = 111320
 
 
 @decorators.carry_metadata
@@ -15,7 +21,22 @@ def bmax_otsu(
     bmax_threshold=0.75,
     max_boxes=100,
     seed=7,
+    otsu_method="iterative",
+    batch_reduction=False,
+    grid=None,
 ):
+    # numpy arrays are thresholded locally, reduction_scale is the pixel size in meters
+    if isinstance(img, np.ndarray):
+        return local_thresholding.bmax_otsu(
+            img,
+            initial_threshold=initial_threshold,
+            invert=invert,
+            grid_size=max(1, int(round(grid_size * DEGREE_LENGTH / reduction_scale))),
+            bmax_threshold=bmax_threshold,
+            max_boxes=max_boxes,
+            seed=seed,
+        )
+
     def constuctGrid(i):
         def contructXGrid(j):
             j = ee.Number(j)
@@ -77,6 +98,23 @@ def bmax_otsu(
         bmax = sigmab.divide(sigmat)
         return feature.set({"bmax": bmax})
 
+    def calcBatchedBmax(feature):
+        # box statistics are already properties from the single reduceRegions call
+        p1 = feature.get("initial_mean")
+        p1 = ee.Number(ee.Algorithms.If(p1, p1, 0.99))
+        p2 = ee.Number(1).subtract(p1)
+
+        m1 = feature.get("m1_mean")
+        m2 = feature.get("m2_mean")
+        m1 = ee.Number(ee.Algorithms.If(m1, m1, -25))
+        m2 = ee.Number(ee.Algorithms.If(m2, m2, 0))
+
+        sigmab = p1.multiply(p2.multiply(m1.subtract(m2).pow(2)))
+        sigmat = feature.get("total_variance")
+        sigmat = ee.Number(ee.Algorithms.If(sigmat, sigmat, 2))
+        bmax = sigmab.divide(sigmat)
+        return feature.set({"bmax": bmax})
+
     if band is None:
         img = img.select([0])
         histBand = ee.String(img.bandNames().get(0))
@@ -86,30 +124,57 @@ def bmax_otsu(
         img = img.select(histBand)
 
     geom = img.geometry()
-    bounds = geom.bounds(maxError=1)
-    coords = ee.List(bounds.coordinates().get(0))
-    gridRes = ee.Number(grid_size)
-
-    west = ee.Number(ee.List(coords.get(0)).get(0))
-    south = ee.Number(ee.List(coords.get(0)).get(1))
-    east = ee.Number(ee.List(coords.get(2)).get(0))
-    north = ee.Number(ee.List(coords.get(2)).get(1))
-
-    west = west.subtract(west.mod(gridRes))
-    south = south.subtract(south.mod(gridRes))
-    east = east.add(gridRes.subtract(east.mod(gridRes)))
-    north = north.add(gridRes.subtract(north.mod(gridRes)))
-
-    grid = ee.FeatureCollection(
-        ee.List.sequence(south, north.subtract(gridRes), gridRes)
-        .map(constuctGrid)
-        .flatten()
-    )
 
-    bmaxes = (
-        grid.map(calcBmax)
-        .filter(ee.Filter.gt("bmax", bmax_threshold))
-        .randomColumn("random", seed)
+    if grid is not None:
+        # precomputed grid from hydrafloods.tiling, only use cells within the image
+        grid = tiling.footprint_cells(grid, geom, contained=True)
+
+    else:
+        bounds = geom.bounds(maxError=1)
+        coords = ee.List(bounds.coordinates().get(0))
+        gridRes = ee.Number(grid_size)
+
+        west = ee.Number(ee.List(coords.get(0)).get(0))
+        south = ee.Number(ee.List(coords.get(0)).get(1))
+        east = ee.Number(ee.List(coords.get(2)).get(0))
+        north = ee.Number(ee.List(coords.get(2)).get(1))
+
+        west = west.subtract(west.mod(gridRes))
+        south = south.subtract(south.mod(gridRes))
+        east = east.add(gridRes.subtract(east.mod(gridRes)))
+        north = north.add(gridRes.subtract(north.mod(gridRes)))
+
+        grid = ee.FeatureCollection(
+            ee.List.sequence(south, north.subtract(gridRes), gridRes)
+            .map(constuctGrid)
+            .flatten()
+        )
+
+    if batch_reduction:
+        initial = img.lt(initial_threshold)
+        stacked = ee.Image.cat(
+            [
+                initial.rename("initial"),
+                img.updateMask(initial).rename("m1"),
+                img.updateMask(initial.Not()).rename("m2"),
+                img.rename("total"),
+            ]
+        )
+        # one grouped reduction over all boxes, outputs are named <band>_<statistic>
+        boxStats = stacked.reduceRegions(
+            collection=grid,
+            reducer=ee.Reducer.mean()
+            .combine(ee.Reducer.variance(), None, True)
+            .combine(ee.Reducer.count(), None, True),
+            scale=reduction_scale,
+            tileScale=16,
+        )
+        scored = boxStats.map(calcBatchedBmax)
+    else:
+        scored = grid.map(calcBmax)
+
+    bmaxes = scored.filter(ee.Filter.gt("bmax", bmax_threshold)).randomColumn(
+        "random", seed
     )
 
     nBoxes = ee.Number(bmaxes.size())
@@ -126,7 +191,7 @@ def bmax_otsu(
         tileScale=16,
     )
 
-    threshold = otsu(histogram.get(histBand.cat("_histogram")))
+    threshold = OTSU_METHODS[otsu_method](histogram.get(histBand.cat("_histogram")))
 
     water = ee.Image(ee.Algorithms.If(invert, img.gt(threshold), img.lt(threshold)))
 
@@ -148,7 +213,22 @@ def edge_otsu(
     reduction_scale=90,
     invert=False,
     seed=7,
+    otsu_method="iterative",
 ):
+    # numpy arrays are thresholded locally, reduction_scale is the pixel size in meters
+    if isinstance(img, np.ndarray):
+        return local_thresholding.edge_otsu(
+            img,
+            initial_threshold=initial_threshold,
+            canny_threshold=canny_threshold,
+            canny_sigma=canny_sigma,
+            canny_lt=canny_lt,
+            connected_pixels=connected_pixels,
+            edge_length=edge_length,
+            edge_buffer=edge_buffer,
+            invert=invert,
+            scale=reduction_scale,
+        )
 
     if band is None:
         img = img.select([0])
@@ -182,14 +262,25 @@ def edge_otsu(
         tileScale=16,
     )
 
-    threshold = otsu(histogram.get(histBand.cat("_histogram")))
+    threshold = OTSU_METHODS[otsu_method](histogram.get(histBand.cat("_histogram")))
 
     water = ee.Image(ee.Algorithms.If(invert, img.gt(threshold), img.lt(threshold)))
 
     return water.rename("water").uint8()
 
 
+def _is_local_histogram(histogram):
+    # histograms computed locally are plain dictionaries of lists or arrays,
+    # a dictionary can also hold ee objects which must stay on the server
+    return isinstance(histogram, dict) and not isinstance(
+        histogram.get("histogram"), ee.ComputedObject
+    )
+
+
 def otsu(histogram):
+    if _is_local_histogram(histogram):
+        return local_thresholding.otsu(histogram)
+
     counts = ee.Array(ee.Dictionary(histogram).get("histogram"))
     means = ee.Array(ee.Dictionary(histogram).get("bucketMeans"))
     size = means.length().get([0])
@@ -218,3 +309,32 @@ def otsu(histogram):
     bss = indices.map(bss_function)
     output = means.sort(bss).get([-1])
     return output
+
+
+def cumulative_otsu(histogram):
+    if _is_local_histogram(histogram):
+        return local_thresholding.otsu(histogram)
+
+    counts = ee.Array(ee.Dictionary(histogram).get("histogram"))
+    means = ee.Array(ee.Dictionary(histogram).get("bucketMeans"))
+    total = counts.reduce(ee.Reducer.sum(), [0]).get([0])
+    sums = means.multiply(counts).reduce(ee.Reducer.sum(), [0]).get([0])
+    mean = sums.divide(total)
+
+    # prefix sums give the class counts and means for every candidate threshold
+    # so the between sum of squares is one array expression instead of a list map
+    aCounts = counts.accum(0)
+    aSums = means.multiply(counts).accum(0)
+    aMeans = aSums.divide(aCounts)
+    bCounts = aCounts.multiply(-1).add(total)
+    bMeans = aSums.multiply(-1).add(sums).divide(bCounts)
+
+    bss = aCounts.multiply(aMeans.subtract(mean).pow(2)).add(
+        bCounts.multiply(bMeans.subtract(mean).pow(2))
+    )
+    # the last bucket leaves class b empty so its bss is 0/0, drop it before sorting
+    output = means.slice(0, 0, -1).sort(bss.slice(0, 0, -1)).get([-1])
+    return output
+
+
+OTSU_METHODS = dict(iterative=otsu, cumulative=cumulative_otsu)
@@ -0,0 +1,117 @@
+import ee
+import math
+from hydrafloods import cache
+
+# grids are cached by the serialized region and grid definition so that
+# the same grid is only constructed once per region
+_GRIDS = {}
+
+
+def _set_tile_id(feature):
+    # grid ids are "x,y" strings, commas are not allowed in asset names
+    tile_id = ee.String(feature.get("system:index")).replace(",", "_", "g")
+    return feature.set("tile_id", tile_id)
+
+
+def covering_grid(region, cell_size, crs="EPSG:3857"):
+    """
+    Function to create a grid of square cells in a projected coordinate system
+    that covers a region, cells have equal area independent of latitude
+
+    Args:
+        region (ee.Geometry): geographic region to cover with the grid
+        cell_size (float): size of the grid cells in the units of the crs (i.e. meters)
+
+    Keywords:
+        crs (str): projected coordinate reference system to define grid in
+            default = "EPSG:3857"
+
+    Returns:
+        grid (ee.FeatureCollection): grid cells intersecting the region with a "tile_id" property
+    """
+    key = ("covering", region.serialize(), cell_size, crs)
+    if key not in _GRIDS:
+        proj = ee.Projection(crs).atScale(cell_size)
+        _GRIDS[key] = region.coveringGrid(proj).map(_set_tile_id)
+
+    return _GRIDS[key]
+
+
+def local_grid(bounds, cell_size, crs="EPSG:3857"):
+    """
+    Function to create a grid of square cells from a bounding box in projected
+    coordinates, the grid is computed client-side so no server request is needed
+
+    Args:
+        bounds (tuple|list): bounding box in crs units as iterable in W,S,E,N order
+        cell_size (float): size of the grid cells in the units of the crs (i.e. meters)
+
+    Keywords:
+        crs (str): projected coordinate reference system the bounds are defined in
+            default = "EPSG:3857"
+
+    Returns:
+        grid (ee.FeatureCollection): grid cells covering the bounds with a "tile_id" property
+    """
+    key = ("local", tuple(bounds), cell_size, crs)
+    if key not in _GRIDS:
+        west, south, east, north = bounds
+        # snap the grid origin to multiples of the cell size, same as covering_grid
+        x0 = math.floor(west / cell_size)
+        y0 = math.floor(south / cell_size)
+        nx = math.ceil(east / cell_size) - x0
+        ny = math.ceil(north / cell_size) - y0
+
+        features = []
+        for j in range(ny):
+            for i in range(nx):
+                x, y = (x0 + i) * cell_size, (y0 + j) * cell_size
+                cell = ee.Geometry.Rectangle(
+                    [x, y, x + cell_size, y + cell_size], proj=crs, geodesic=False
+                )
+                features.append(ee.Feature(cell, {"tile_id": f"{x0 + i}_{y0 + j}"}))
+
+        _GRIDS[key] = ee.FeatureCollection(features)
+
+    return _GRIDS[key]
+
+
+def footprint_cells(grid, footprint, contained=False):
+    """
+    Function to index the cells of a grid that intersect a footprint
+
+    Args:
+        grid (ee.FeatureCollection): grid from covering_grid() or local_grid()
+        footprint (ee.Geometry): geometry to find intersecting cells for, i.e. img.geometry()
+
+    Keywords:
+        contained (bool): flag to only keep cells that are completely within the footprint
+            default = False
+
+    Returns:
+        cells (ee.FeatureCollection): subset of the grid cells
+    """
+    if contained:
+        return grid.filter(
+            ee.Filter.isContained(leftField=".geo", rightValue=footprint, maxError=1)
+        )
+    else:
+        return grid.filterBounds(footprint)
+
+
+def cell_list(grid):
+    """
+    Function to fetch the grid cells client-side, for looping over cells in exports
+    Requests go through the package result cache so they are only made once per grid
+
+    Args:
+        grid (ee.FeatureCollection): grid from covering_grid() or local_grid()
+
+    Returns:
+        cells (list): list of dictionaries with the "tile_id" and "geometry" (GeoJSON) of each cell
+    """
+    features = cache.get_info(grid.select(["tile_id"]))["features"]
+    return [
+        dict(tile_id=f["properties"]["tile_id"], geometry=f["geometry"])
+        for f in features
+    ]
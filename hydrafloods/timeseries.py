@@ -1,8 +1,7 @@
 import ee
 import math
-import copy
 from functools import partial
-from hydrafloods import decorators, datasets
+from hydrafloods import decorators, datasets, cache
 
 
 def add_time_band(img, offset="year"):
@@ -14,8 +13,9 @@ def add_time_band(img, offset="year"):
 
 def prep_inputs(collection):
     first = ee.Image(collection.first())
-    bands = first.bandNames().getInfo()
-    outCollection = copy.deepcopy(collection)
+    bands = cache.get_info(first.bandNames())
+    # ee objects are immutable, no need to copy the collection before mapping
+    outCollection = collection
     if "time" not in bands:
         outCollection = outCollection.map(add_time_band)
     if "constant" not in bands:
@@ -0,0 +1,282 @@
+import os
+import json
+import math
+import time
+import hashlib
+import logging
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from hydrafloods import ml
+
+SEARCH_SPACE = {
+    "n_estimators": (10, 250),
+    "min_samples_split": (2, 25),
+    "max_features": (0.1, 0.999),
+    "max_depth": [10, 20, 30, None],
+}
+
+
+def sample_params(space, n, seed=0):
+    """
+    Function to draw random parameter configurations from a search space
+
+    Args:
+        space (dict): parameter names with (min, max) tuples or lists of choices. Tuples of
+            integers are sampled as integers and tuples with floats uniformly
+        n (int): number of configurations to draw
+
+    Keywords:
+        seed (int): seed for the random generator
+            default = 0
+
+    Returns:
+        candidates (list): list of parameter dictionaries
+    """
+    rng = np.random.default_rng(seed)
+    candidates = [{} for _ in range(n)]
+    for name, values in space.items():
+        if isinstance(values, tuple):
+            low, high = values
+            if isinstance(low, int) and isinstance(high, int):
+                draws = rng.integers(low, high + 1, n).tolist()
+            else:
+                draws = rng.uniform(low, high, n).tolist()
+        else:
+            draws = [values[i] for i in rng.integers(0, len(values), n)]
+        for params, v in zip(candidates, draws):
+            params[name] = v
+    return candidates
+
+
+_DATA = None
+
+
+def _load_data(paths):
+    # workers open the training data as read-only memory maps so pages are shared
+    global _DATA
+    _DATA = {k: np.load(v, mmap_mode="r") for k, v in paths.items()}
+    return
+
+
+def _evaluate(job):
+    trial, rung, n_rows, params, model, n_cv, classifier = job
+    t1 = time.perf_counter()
+    idx = np.sort(_DATA["order"][:n_rows])
+    score = ml.cv(
+        model,
+        _DATA["X"][idx],
+        _DATA["y"][idx],
+        n_cv=n_cv,
+        classifier=classifier,
+        **params,
+    )
+    return dict(
+        trial=trial,
+        rung=rung,
+        n_samples=n_rows,
+        params=params,
+        score=float(score),
+        seconds=time.perf_counter() - t1,
+    )
+
+
+def _fingerprint(X, y):
+    # shapes and checksum of the training data a work_dir was created with
+    digest = hashlib.sha256()
+    for a in (X, y):
+        a = np.ascontiguousarray(a)
+        digest.update(a.dtype.str.encode("utf-8"))
+        digest.update(a.view(np.uint8))
+    return dict(X_shape=list(X.shape), y_shape=list(y.shape), sha256=digest.hexdigest())
+
+
+def _read_history(path):
+    history = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    history[(record["trial"], record["rung"])] = record
+    return history
+
+
+def successive_halving(
+    model,
+    X,
+    y,
+    work_dir,
+    space=None,
+    n_candidates=27,
+    eta=3,
+    min_samples=None,
+    n_cv=3,
+    classifier=False,
+    time_budget=None,
+    n_workers=None,
+    seed=0,
+    reset=False,
+):
+    """
+    Function to search hyperparameters of an estimator with successive halving. All
+    candidates are cross validated on a small subset of the samples, the best 1/eta are
+    promoted to the next rung with eta times more samples until one candidate is left.
+    Evaluations run concurrently in a process pool that shares one memory-mapped copy of
+    the training data and every result is appended to a history file so an interrupted
+    search resumes where it stopped when called again with the same work_dir and data.
+    The shapes and checksum of the data are stored with it to detect a work_dir that
+    was created with other data
+
+    Args:
+        model (class): scikit-learn estimator class, i.e. ExtraTreesRegressor
+        X (np.ndarray): 2-d feature matrix of shape (samples, features)
+        y (np.ndarray): 1-d array of labels
+        work_dir (str|pathlib.Path): directory for the memory-mapped data, candidates and history
+
+    Keywords:
+        space (dict): parameter names with (min, max) tuples or lists of choices, see sample_params()
+            default = None (SEARCH_SPACE)
+        n_candidates (int): number of configurations evaluated in the first rung
+            default = 27
+        eta (int): reduction factor between rungs
+            default = 3
+        min_samples (int): number of samples used in the first rung
+            default = None (number of samples divided by eta for every rung after the first)
+        n_cv (int): number of cross validation folds
+            default = 3
+        classifier (bool): score with log loss instead of mean squared error
+            default = False
+        time_budget (float): wall-clock budget in seconds, no new evaluations are started once it
+            has passed and the best result so far is returned
+            default = None
+        n_workers (int): number of processes, 0 runs the evaluations in the calling process
+            default = None (use ProcessPoolExecutor default)
+        seed (int): seed for the candidates and sample subsets
+            default = 0
+        reset (bool): start a new search if work_dir holds a search with other data, False
+            raises a ValueError instead
+            default = False
+
+    Returns:
+        best (dict): history record with the "params" and "score" of the best candidate in the
+            highest rung that was evaluated
+        history (list): all history records
+    """
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+    os.makedirs(work_dir, exist_ok=True)
+    X, y = np.asarray(X), np.asarray(y)
+    n = len(y)
+
+    paths = {k: os.path.join(work_dir, f"{k}.npy") for k in ("X", "y", "order")}
+    data_path = os.path.join(work_dir, "data.json")
+    candidates_path = os.path.join(work_dir, "candidates.json")
+    history_path = os.path.join(work_dir, "history.jsonl")
+
+    fingerprint = _fingerprint(X, y)
+    if os.path.exists(paths["order"]):
+        stored = None
+        if os.path.exists(data_path):
+            with open(data_path) as f:
+                stored = json.load(f)
+        if stored != fingerprint:
+            if not reset:
+                raise ValueError(
+                    f"{work_dir} holds a search with other training data, "
+                    "use another work_dir or reset=True to start over"
+                )
+            logging.info(f"training data changed, starting a new search in {work_dir}")
+            for path in list(paths.values()) + [candidates_path, history_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    if not os.path.exists(paths["order"]):
+        np.save(paths["X"], X)
+        np.save(paths["y"], y)
+        with open(data_path, "w") as f:
+            json.dump(fingerprint, f)
+        # nested random subsets, each rung uses the first rows of the same permutation
+        np.save(paths["order"], np.random.default_rng(seed).permutation(n))
+
+    if os.path.exists(candidates_path):
+        with open(candidates_path) as f:
+            candidates = json.load(f)
+    else:
+        candidates = sample_params(space or SEARCH_SPACE, n_candidates, seed)
+        with open(candidates_path, "w") as f:
+            json.dump(candidates, f)
+
+    # a resumed search keeps the candidates it started with
+    n_rungs = int(math.log(len(candidates), eta) + 1e-9) + 1
+    min_samples = min_samples or max(n // eta ** (n_rungs - 1), n_cv)
+
+    history = _read_history(history_path)
+    if history:
+        logging.info(
+            f"resuming search with {len(history)} evaluations from {history_path}"
+        )
+
+    def _expired():
+        return deadline is not None and time.monotonic() > deadline
+
+    def _record(record):
+        history[(record["trial"], record["rung"])] = record
+        with open(history_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        logging.info(
+            f"trial {record['trial']} rung {record['rung']} "
+            f"({record['n_samples']} samples): {record['score']:.6g}"
+        )
+        return
+
+    if n_workers == 0:
+        _load_data(paths)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(
+            max_workers=n_workers, initializer=_load_data, initargs=(paths,)
+        )
+
+    alive = list(range(len(candidates)))
+    futures = []
+    try:
+        for rung in range(n_rungs):
+            # the last rung always uses all samples, rounding min_samples down can leave a few out
+            n_rows = n if rung == n_rungs - 1 else min(min_samples * eta**rung, n)
+            jobs = [
+                (t, rung, n_rows, candidates[t], model, n_cv, classifier)
+                for t in alive
+                if (t, rung) not in history
+            ]
+
+            if executor is None:
+                for job in jobs:
+                    if _expired():
+                        break
+                    _record(_evaluate(job))
+            else:
+                futures = [executor.submit(_evaluate, job) for job in jobs]
+                for future in as_completed(futures):
+                    _record(future.result())
+                    if _expired():
+                        break
+
+            if _expired() or any((t, rung) not in history for t in alive):
+                logging.info("time budget reached, stopping search")
+                break
+
+            alive.sort(key=lambda t: history[(t, rung)]["score"], reverse=True)
+            alive = alive[: max(1, len(alive) // eta)]
+    finally:
+        if executor is not None:
+            # evaluations that did not start are cancelled, running ones are not waited for.
+            # cancel_futures=True of shutdown requires python 3.9
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    records = sorted(history.values(), key=lambda r: (r["rung"], r["trial"]))
+    if not records:
+        raise RuntimeError("time budget passed before any evaluation finished")
+    best = max(records, key=lambda r: (r["rung"], r["score"]))
+
+    return best, records
@@ -1,11 +1,12 @@
 from __future__ import print_function, division
 import datetime
-import ee
 import os
+import re
 import sys
 import subprocess
 import numpy as np
 import gcsfs
+from hydrafloods import tasks
 
 
 def list_gcs_objs(bucket_path, pattern=None, output_url=False):
@@ -36,39 +37,45 @@ def push_to_gcs(file, bucketPath):
 
 
 def push_to_gee(bucket_obj, asset_collection, properties=None, delete_bucket_obj=False):
-    name = os.path.basename(bucketObj).replace(".", "_")
-    asset = assetCollection + name
+    name = os.path.basename(bucket_obj).replace(".", "_")
+    asset = asset_collection + name
 
     pStr = ""
-    for i in properties:
-        pStr += "--{0} {1} ".format(i, properties[i])
+    if properties:
+        for i in properties:
+            pStr += "--{0} {1} ".format(i, properties[i])
 
     binPath = os.path.dirname(sys.executable)
     cmd = "{0}/earthengine upload image --asset_id={1} {2} {3}".format(
-        binPath, asset, pStr, bucketObj
+        binPath, asset, pStr, bucket_obj
     )
     proc = subprocess.Popen(
         cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
     )
     out, err = proc.communicate()
-    if properties:
-        pStr = ""
-
-        running = True
-        while running == True:
-            tasks = ee.batch.Task.list()
-            if "COMPLETED" in str(tasks[0]):
-                running = False
-            elif "FAILED" in str(tasks[0]):
-                print(
-                    "EE upload process failed for image {}, check Earth Engine for error".format(
-                        bucketObj
-                    )
-                )
-                sys.exit(1)
-
-    if deleteBucketObj:
-        cmd = "gsutil rm {0}".format(bucketObj)
+
+    # the cli reports the id of the upload task, wait on that task specifically
+    # instead of busy polling the task list
+    match = re.search(r"ID:\s*(\S+)", out.decode("utf-8", errors="ignore"))
+    if match is None:
+        print(
+            "EE upload process could not be started for image {}: {}".format(
+                bucket_obj, out
+            )
+        )
+        sys.exit(1)
+
+    status = tasks.wait_for(match.group(1))
+    if status["state"] not in tasks.SUCCESS_STATES:
+        print(
+            "EE upload process failed for image {}, check Earth Engine for error".format(
+                bucket_obj
+            )
+        )
+        sys.exit(1)
+
+    if delete_bucket_obj:
+        cmd = "gsutil rm {0}".format(bucket_obj)
         proc = subprocess.Popen(
             cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
         )
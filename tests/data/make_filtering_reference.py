@@ -0,0 +1,222 @@
+"""
+Writes the reference outputs of the speckle filters used by test_local_filtering.py
+
+filtering_reference.npz holds the outputs for a small synthetic Sentinel-1 patch from
+a brute-force Python port of the Earth Engine algorithms in hydrafloods.filtering.
+Every pixel is filtered with explicit loops over its window, and the sigma lookup
+table and directional kernels are defined again below, so the reference shares no
+code with the vectorized filters in hydrafloods.local.filtering. It is not output
+from Earth Engine.
+
+With --ee the script also writes filtering_reference_ee.npz, the same filters run by
+Earth Engine on a real Sentinel-1 VV patch, like benchmarks/filtering.py --compare.
+This needs an authenticated Earth Engine session.
+
+usage: python tests/data/make_filtering_reference.py [--ee] [--point 90.4 23.7]
+"""
+
+import os
+import argparse
+import numpy as np
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# η of the Lee sigma filter for 4 looks by target sigma, Lee et al. (2009) table 1
+SIGMA_ETA = {4: {0.5: 0.1921, 0.6: 0.2348, 0.7: 0.2825, 0.8: 0.3354, 0.9: 0.3991}}
+
+# 7x7 refined Lee kernels for the directions 1-8 as in filtering._refined_lee_kernels,
+# a rectangle and a triangle rotated clockwise a quarter turn at a time
+RECT_WEIGHTS = [[0] * 7] * 3 + [[1] * 7] * 4
+DIAG_WEIGHTS = [[1] * (i + 1) + [0] * (6 - i) for i in range(7)]
+
+
+def rotate(weights):
+    # one clockwise quarter turn, like ee.Kernel.rotate(1)
+    n = len(weights)
+    return [[weights[n - 1 - c][r] for c in range(n)] for r in range(n)]
+
+
+def direction_kernels():
+    kernels, rect, diag = [], RECT_WEIGHTS, DIAG_WEIGHTS
+    for _ in range(4):
+        kernels += [np.array(rect), np.array(diag)]
+        rect, diag = rotate(rect), rotate(diag)
+    return kernels
+
+
+def synthetic_patch(size=32, looks=4, seed=42):
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / size
+    field = 0.05 + 0.04 * np.sin(6 * x) * np.cos(4 * y)
+    field[:, size // 2 :] *= 0.1  # a dark water body with an edge
+    patch = 10 * np.log10(field * rng.gamma(looks, 1 / looks, (size, size)))
+    patch[3, 5] = np.nan
+    patch[20:23, 10:12] = np.nan
+    return patch.astype(np.float32)
+
+
+def window_values(x, i, j, kernel, focus):
+    # values under a kernel whose focus pixel is placed on (i, j), nan outside
+    values, weights = [], []
+    for u in range(kernel.shape[0]):
+        for v in range(kernel.shape[1]):
+            r, c = i + u - focus[0], j + v - focus[1]
+            if kernel[u, v] and 0 <= r < x.shape[0] and 0 <= c < x.shape[1]:
+                if np.isfinite(x[r, c]):
+                    values.append(x[r, c])
+                    weights.append(kernel[u, v])
+    return np.array(values), np.array(weights)
+
+
+def mean_var(x, i, j, kernel, focus):
+    values, weights = window_values(x, i, j, kernel, focus)
+    if values.size == 0:
+        return np.nan, np.nan
+    mean = (values * weights).sum() / weights.sum()
+    return mean, (weights * (values - mean) ** 2).sum() / weights.sum()
+
+
+def anchor(window):
+    return (window // 2) + 1 if (window % 2) != 0 else window // 2
+
+
+def lee_sigma(db, window=9, sigma=0.9, looks=4, tk=7):
+    x = 10 ** (db.astype(np.float64) / 10)
+    eta = SIGMA_ETA[looks][sigma] ** 2
+    z99 = np.nanpercentile(x, 99)
+    kernel, focus = np.ones((window, window)), (anchor(window),) * 2
+    out = np.full(x.shape, np.nan)
+    for i in range(x.shape[0]):
+        for j in range(x.shape[1]):
+            if not np.isfinite(x[i, j]):
+                continue
+            z, varz = mean_var(x, i, j, kernel, focus)
+            varx = (varz - z**2 * eta) / (1 + eta)
+            b = varx / varz if varz != 0 else np.nan
+            mmse = (1 - b) * abs(z) + b * x[i, j]
+            bright, _ = window_values(x, i, j, np.ones((3, 3)), (1, 1))
+            k = (bright >= z99).sum()
+            out[i, j] = 10 * np.log10(x[i, j] if k >= tk else mmse)
+    return out
+
+
+def gamma_map(db, window=7, enl=5):
+    x = 10 ** (db.astype(np.float64) / 10)
+    cu = 1 / np.sqrt(enl)
+    cmax = np.sqrt(2) * cu
+    kernel, focus = np.ones((window, window)), (anchor(window),) * 2
+    out = np.full(x.shape, np.nan)
+    for i in range(x.shape[0]):
+        for j in range(x.shape[1]):
+            if not np.isfinite(x[i, j]):
+                continue
+            mean, variance = mean_var(x, i, j, kernel, focus)
+            ci = np.sqrt(variance) / mean
+            if ci <= cu:
+                out[i, j] = 10 * np.log10(mean)
+            elif ci < cmax:
+                alpha = (1 + cu**2) / (ci**2 - cu**2)
+                b = alpha - (enl + 1)
+                d = mean**2 * b**2 + alpha * mean * x[i, j] * 4 * enl
+                out[i, j] = 10 * np.log10((b * mean + np.sqrt(d)) / (2 * alpha))
+            else:
+                out[i, j] = db[i, j]
+    return out
+
+
+def refined_lee(db):
+    x = 10 ** (db.astype(np.float64) / 10)
+    h, w = x.shape
+
+    def at(i, j):
+        # 3x3 statistics of any position, pixels outside of the scene are no data
+        # like the masked pixels inside of it
+        return mean_var(x, i, j, np.ones((3, 3)), (1, 1))
+
+    kernels = direction_kernels()
+    out = np.full(x.shape, np.nan)
+    offsets = [(dy, dx) for dy in (-2, 0, 2) for dx in (-2, 0, 2)]
+    for i in range(h):
+        for j in range(w):
+            if not np.isfinite(x[i, j]):
+                continue
+            s, v = np.array([at(i + dy, j + dx) for dy, dx in offsets]).T
+
+            gradients = np.abs([s[1] - s[7], s[6] - s[2], s[3] - s[5], s[0] - s[8]])
+            if np.all(np.isnan(gradients)):
+                continue
+            g = int(np.nanargmax(gradients))
+            pairs = [(1, 7), (6, 2), (3, 5), (0, 8)]
+            a, c = pairs[g]
+            direction = g + 1 if s[a] - s[4] > s[4] - s[c] else g + 5
+
+            ratio = np.sort(v / (s * s))[:5]
+            sigma_v = np.nanmean(ratio)
+
+            kernel = kernels[direction - 1]
+            dir_mean, dir_var = mean_var(x, i, j, kernel, (3, 3))
+            var_x = (dir_var - dir_mean**2 * sigma_v) / (sigma_v + 1)
+            b = var_x / dir_var
+            out[i, j] = 10 * np.log10(dir_mean + b * (x[i, j] - dir_mean))
+    return out
+
+
+FILTERS = dict(lee_sigma=dict(window=5), gamma_map=dict(window=7), refined_lee={})
+
+
+def earth_engine_reference(point, size=256):
+    import ee
+    from hydrafloods import filtering
+
+    region = ee.Geometry.Point(point).buffer(size * 5).bounds()
+    img = (
+        ee.ImageCollection("COPERNICUS/S1_GRD")
+        .filterBounds(region)
+        .filter(ee.Filter.eq("instrumentMode", "IW"))
+        .select("VV")
+        .first()
+    )
+
+    def to_array(image):
+        props = image.sampleRectangle(region, defaultValue=-9999).getInfo()
+        values = np.array(props["properties"]["VV"], dtype=np.float32)
+        return np.where(values == -9999, np.nan, values)
+
+    reference = dict(patch=to_array(img))
+    for name, kwargs in FILTERS.items():
+        reference[name] = to_array(getattr(filtering, name)(img, **kwargs))
+    return reference
+
+
+def main(use_ee=False, point=(90.4, 23.7)):
+    patch = synthetic_patch()
+    with np.errstate(all="ignore"):
+        reference = dict(patch=patch)
+        reference["lee_sigma"] = lee_sigma(patch, **FILTERS["lee_sigma"])
+        reference["gamma_map"] = gamma_map(patch, **FILTERS["gamma_map"])
+        reference["refined_lee"] = refined_lee(patch)
+    np.savez_compressed(os.path.join(DATA_DIR, "filtering_reference.npz"), **reference)
+
+    if use_ee:
+        import ee
+
+        ee.Initialize()
+        np.savez_compressed(
+            os.path.join(DATA_DIR, "filtering_reference_ee.npz"),
+            **earth_engine_reference(point),
+        )
+
+    return
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--ee",
+        action="store_true",
+        help="also write the outputs of the Earth Engine filters on a Sentinel-1 patch",
+    )
+    parser.add_argument("--point", type=float, nargs=2, default=[90.4, 23.7])
+    args = parser.parse_args()
+
+    main(args.ee, args.point)
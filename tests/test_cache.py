@@ -0,0 +1,74 @@
+import time
+import pytest
+from hydrafloods import cache
+
+
+class FakeObject:
+    # stands in for an ee object, counts the getInfo round trips
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    def getInfo(self):
+        self.calls += 1
+        return self.value
+
+
+@pytest.fixture
+def result_cache(monkeypatch):
+    c = cache.ResultCache(maxsize=2)
+    monkeypatch.setattr(c, "key", lambda obj: str(id(obj)))
+    return c
+
+
+def test_get_info_is_cached(result_cache):
+    obj = FakeObject([1, 2, 3])
+    assert result_cache.get_info(obj) == [1, 2, 3]
+    assert result_cache.get_info(obj) == [1, 2, 3]
+    assert obj.calls == 1
+    assert result_cache.stats()["hits"] == 1
+
+
+def test_results_are_copies(result_cache):
+    obj = FakeObject({"bands": ["VV"]})
+    first = result_cache.get_info(obj)
+    first["bands"].append("VH")
+    assert result_cache.get_info(obj) == {"bands": ["VV"]}
+
+
+def test_ttl_expires_results(result_cache, monkeypatch):
+    obj = FakeObject(10)
+    now = time.time()
+    monkeypatch.setattr(cache.time, "time", lambda: now)
+    result_cache.get_info(obj, ttl=cache.METADATA_TTL)
+
+    monkeypatch.setattr(cache.time, "time", lambda: now + cache.METADATA_TTL - 1)
+    result_cache.get_info(obj, ttl=cache.METADATA_TTL)
+    assert obj.calls == 1
+
+    monkeypatch.setattr(cache.time, "time", lambda: now + cache.METADATA_TTL + 1)
+    result_cache.get_info(obj, ttl=cache.METADATA_TTL)
+    assert obj.calls == 2
+
+    # results without a ttl never expire
+    result_cache.get_info(obj)
+    assert obj.calls == 2
+
+
+def test_lru_eviction(result_cache):
+    objs = [FakeObject(i) for i in range(3)]
+    for obj in objs:
+        result_cache.get_info(obj)
+    result_cache.get_info(objs[0])
+    assert objs[0].calls == 2
+
+
+def test_disk_tier_persists(tmp_path, monkeypatch):
+    path = str(tmp_path / "cache.sqlite")
+    obj = FakeObject({"a": 1})
+    for _ in range(2):
+        c = cache.ResultCache(path=path)
+        monkeypatch.setattr(c, "key", lambda o: "fixed")
+        assert c.get_info(obj) == {"a": 1}
+    assert obj.calls == 1
+    assert c.stats()["disk_hits"] == 1
@@ -0,0 +1,92 @@
+import copy
+import pytest
+import ee
+from hydrafloods import datasets
+
+
+class FakeImage:
+    # records the region an image is clipped to
+    def clip(self, region):
+        return ("clipped", region)
+
+
+def make_dataset(region):
+    # datasets are built from attributes so no Earth Engine session is needed
+    ds = datasets.Dataset.__new__(datasets.Dataset)
+    ds.region = region
+    ds.start_time = "2020-01-01"
+    ds.end_time = "2020-02-01"
+    ds.asset_id = ""
+    ds.use_qa = False
+    ds._pipeline = datasets.Pipeline(ee.ComputedObject(None, {"id": "collection"}))
+    return ds
+
+
+def test_copy_shares_state():
+    ds = make_dataset(ee.ComputedObject(None, {"id": "region"}))
+    ds.tags = ["a"]
+    out = copy.copy(ds)
+    assert out._pipeline is ds._pipeline
+    assert out.tags is ds.tags
+
+
+def test_deepcopy_copies_mutable_attributes():
+    ds = make_dataset(ee.ComputedObject(None, {"id": "region"}))
+    ds.tags = ["a"]
+    ds.options = {"scale": [30]}
+    out = copy.deepcopy(ds)
+
+    # earth engine objects and pipelines are shared
+    assert out._pipeline is ds._pipeline
+    assert out.region is ds.region
+
+    out.tags.append("b")
+    out.options["scale"].append(10)
+    assert ds.tags == ["a"]
+    assert ds.options == {"scale": [30]}
+
+
+def test_deepcopy_keeps_references_within_memo():
+    ds = make_dataset(ee.ComputedObject(None, {"id": "region"}))
+    ds.myself = ds
+    out = copy.deepcopy(ds)
+    assert out.myself is out
+
+
+class PassThrough:
+    # replaces ee.Image so the clip function can run without an Earth Engine session
+    def __new__(cls, obj):
+        return obj
+
+
+def test_clip_captures_region(monkeypatch):
+    monkeypatch.setattr(datasets.ee, "Image", PassThrough)
+    ds = make_dataset("first region")
+    clipped = ds.clip_to_region()
+    ds.region = "second region"
+    clipped.region = "third region"
+
+    clip = clipped._pipeline.transforms[-1]
+    assert clip(FakeImage()) == ("clipped", "first region")
+
+
+class FakeBands:
+    # records the band selection of an image
+    def select(self, bands, new_names):
+        return (bands, new_names)
+
+
+def test_select_registered_sensor_bands(monkeypatch):
+    monkeypatch.setattr(datasets, "BANDREMAP", dict(datasets.BANDREMAP))
+    bands = ["b1", "b2", "b3", "b4", "b5", "b6"]
+    datasets.register_sensor("other", bands)
+
+    ds = make_dataset("region")
+    selected = ds.select_sensor_bands("other")
+    assert ds._pipeline.transforms == ()
+
+    select = selected._pipeline.transforms[-1]
+    assert select(FakeBands()) == (bands, datasets.BANDREMAP["new"])
+
+    with pytest.raises(ValueError, match="unknown sensor"):
+        ds.select_sensor_bands("missing")
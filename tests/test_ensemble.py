@@ -0,0 +1,99 @@
+from unittest import mock
+import numpy as np
+import pytest
+from hydrafloods import ensemble
+from hydrafloods.local import ensemble as local_ensemble
+from hydrafloods.local import fusion
+
+
+def terrain(factor=4, shape=(10, 7), seed=0):
+    rng = np.random.default_rng(seed)
+    hand = rng.gamma(2, 3, (shape[0] * factor, shape[1] * factor))
+    permanent = rng.random(hand.shape) < 0.05
+    return rng.random(shape), hand, permanent
+
+
+@pytest.mark.parametrize("chunk_rows", [3, 256])
+def test_bathtub_members_without_noise_match_bathtub(chunk_rows):
+    wfrac, hand, permanent = terrain()
+    members = local_ensemble.bathtub_members(
+        wfrac,
+        hand.astype(np.float32),
+        np.random.default_rng(0),
+        3,
+        permanent,
+        elv_std_dev=0,
+        chunk_rows=chunk_rows,
+    )
+    expected = fusion.bathtub(wfrac, hand.astype(np.float32), permanent)["water"]
+    assert members.shape == (3,) + hand.shape
+    assert members.dtype == np.uint8
+    for member in members:
+        np.testing.assert_array_equal(member, expected)
+
+
+def test_bathtub_members_are_independent():
+    wfrac, hand, permanent = terrain()
+    members = local_ensemble.bathtub_members(
+        wfrac, hand, np.random.default_rng(0), 4, permanent, chunk_rows=3
+    )
+    assert np.all(members[:, permanent] == 1)
+    assert not np.array_equal(members[0], members[1])
+
+
+def coin_flips(p):
+    # members are independent draws with a fixed per pixel probability
+    def member_func(rng, n):
+        return (rng.random((n,) + p.shape) < p).astype(np.uint8)
+
+    return member_func
+
+
+def test_local_run_all_members():
+    p = np.linspace(0, 1, 50).reshape(5, 10)
+    probability, n = local_ensemble.run(coin_flips(p), n_members=400, batch_size=64)
+    assert n == 400
+    assert probability.dtype == np.float32
+    np.testing.assert_allclose(probability, p, atol=0.1)
+
+
+def test_local_run_stops_on_convergence():
+    p = np.full((5, 10), 0.5)
+    _, n = local_ensemble.run(
+        coin_flips(p), n_members=1000, batch_size=10, tolerance=0.02
+    )
+    assert 20 <= n < 1000
+
+
+@pytest.fixture
+def fake_ee(monkeypatch):
+    # records the sampled member counts of every batch instead of calling the server
+    batches = []
+    monkeypatch.setattr(ensemble, "ee", mock.MagicMock(name="ee"))
+    monkeypatch.setattr(
+        ensemble.cache, "get_info", lambda obj: batches.pop(0) if batches else []
+    )
+    return batches
+
+
+def test_run_carries_sampled_sums_between_batches(fake_ee):
+    batches = fake_ee
+    # probabilities of 0.5, 0.55 and 0.5667 at a sampled pixel, the second pixel is masked
+    batches.extend([[5, -1], [6, -1], [6, -1], [6, -1]])
+    members = mock.MagicMock(side_effect=lambda seeds: seeds)
+    _, n = ensemble.run(
+        members, n_members=100, batch_size=10, tolerance=0.02, region=1, scale=30
+    )
+    assert n == 30
+    # one request per batch, the growing ensemble sum is never requested
+    assert len(batches) == 1
+    assert [c.args[0] for c in members.call_args_list] == [
+        list(range(0, 10)),
+        list(range(10, 20)),
+        list(range(20, 30)),
+    ]
+
+
+def test_run_requires_region_for_tolerance():
+    with pytest.raises(ValueError):
+        ensemble.run(lambda seeds: None, tolerance=0.1)
@@ -0,0 +1,211 @@
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from hydrafloods import fetch
+
+FILES = {
+    "/a/granule.h5": bytes(range(256)) * 40,
+    "/b/granule.h5": b"another granule" * 100,
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    # serves FILES with range requests, faults are read from server.faults per path
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("Range")))
+        if self.path not in FILES:
+            self.send_error(404)
+            return
+        data = FILES[self.path]
+        faults = self.server.faults.get(self.path, [])
+        fault = faults.pop(0) if faults else None
+        if fault == 503:
+            self.send_error(503)
+            return
+
+        offset = 0
+        byte_range = self.headers.get("Range")
+        if byte_range and fault != "ignore_range":
+            offset = int(byte_range.split("=")[1].rstrip("-"))
+            if offset >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(data)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {offset}-{len(data) - 1}/{len(data)}"
+            )
+        else:
+            self.send_response(200)
+
+        body = data[offset:]
+        if fault == "gzip":
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if fault == "truncate":
+            # drop the connection half way through the body
+            self.wfile.write(body[: len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        return
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.requests, httpd.faults = [], {}
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = fetch.DownloadManager(tmp_path, max_workers=2, backoff=0, timeout=5)
+    yield manager
+    manager.close()
+
+
+def partial_path(manager, url):
+    path = manager.directory / fetch._local_name(url)
+    return path.with_name(path.name + ".part")
+
+
+def test_download_resumes_partial(server, manager):
+    url = server.url + "/a/granule.h5"
+    partial_path(manager, url).write_bytes(FILES["/a/granule.h5"][:1000])
+
+    path = manager.download(url)
+
+    assert path.read_bytes() == FILES["/a/granule.h5"]
+    assert server.requests == [("/a/granule.h5", "bytes=1000-")]
+    assert not partial_path(manager, url).exists()
+
+
+def test_download_restarts_when_range_is_ignored(server, manager):
+    url = server.url + "/a/granule.h5"
+    partial_path(manager, url).write_bytes(b"stale")
+    server.faults["/a/granule.h5"] = ["ignore_range"]
+
+    assert manager.download(url).read_bytes() == FILES["/a/granule.h5"]
+
+
+def test_download_retries_server_errors(server, manager):
+    url = server.url + "/a/granule.h5"
+    server.faults["/a/granule.h5"] = [503, 503]
+
+    assert manager.download(url).read_bytes() == FILES["/a/granule.h5"]
+    assert len(server.requests) == 3
+
+
+def test_download_does_not_retry_client_errors(server, manager):
+    with pytest.raises(requests.HTTPError):
+        manager.download(server.url + "/missing.h5")
+    assert len(server.requests) == 1
+
+
+def test_download_gives_up_after_retries(server, tmp_path):
+    server.faults["/a/granule.h5"] = [503] * 5
+    manager = fetch.DownloadManager(tmp_path, retries=2, backoff=0)
+    with pytest.raises(requests.HTTPError):
+        manager.download(server.url + "/a/granule.h5")
+    manager.close()
+    assert len(server.requests) == 3
+
+
+def test_truncated_download_is_resumed(server, tmp_path):
+    url = server.url + "/a/granule.h5"
+    server.faults["/a/granule.h5"] = ["truncate"]
+
+    # small chunks so the bytes before the connection dropped are written
+    manager = fetch.DownloadManager(tmp_path, chunk_size=1024, backoff=0)
+    assert manager.download(url).read_bytes() == FILES["/a/granule.h5"]
+    manager.close()
+    assert len(server.requests) == 2
+    assert server.requests[1][1] == f"bytes={len(FILES['/a/granule.h5']) // 2}-"
+
+
+def test_complete_partial_is_committed_on_416(server, manager):
+    url = server.url + "/a/granule.h5"
+    partial_path(manager, url).write_bytes(FILES["/a/granule.h5"])
+
+    assert manager.download(url).read_bytes() == FILES["/a/granule.h5"]
+    assert len(server.requests) == 1
+
+
+def test_oversized_partial_is_downloaded_again_on_416(server, manager):
+    url = server.url + "/a/granule.h5"
+    partial_path(manager, url).write_bytes(FILES["/a/granule.h5"] + b"garbage")
+
+    assert manager.download(url).read_bytes() == FILES["/a/granule.h5"]
+    assert [r[1] for r in server.requests] == [
+        f"bytes={len(FILES['/a/granule.h5']) + 7}-",
+        None,
+    ]
+
+
+def test_encoded_response_is_not_rejected(server, manager):
+    url = server.url + "/a/granule.h5"
+    server.faults["/a/granule.h5"] = ["gzip"]
+
+    assert manager.download(url).read_bytes() == FILES["/a/granule.h5"]
+    assert len(server.requests) == 1
+
+
+def test_manifest_skips_completed_granules(server, tmp_path):
+    urls = [server.url + "/a/granule.h5", server.url + "/b/granule.h5"]
+    manager = fetch.DownloadManager(tmp_path, backoff=0)
+    paths = manager.fetch(urls + urls[:1])
+    manager.close()
+
+    # granules with the same file name from different urls are kept apart
+    assert len(set(paths)) == 2
+    assert [p.read_bytes() for p in paths] == [
+        FILES["/a/granule.h5"],
+        FILES["/b/granule.h5"],
+    ]
+    assert len(server.requests) == 2
+
+    manager = fetch.DownloadManager(tmp_path, backoff=0)
+    assert manager.fetch(urls) == paths
+    assert len(server.requests) == 2
+
+    # changed files are downloaded again
+    paths[0].write_bytes(b"corrupt")
+    assert manager.download(urls[0]).read_bytes() == FILES["/a/granule.h5"]
+    assert len(server.requests) == 3
+    manager.close()
+
+
+def test_verify_detects_changed_contents(server, tmp_path):
+    url = server.url + "/b/granule.h5"
+    manager = fetch.DownloadManager(tmp_path, verify=True, backoff=0)
+    path = manager.download(url)
+    # same size, different contents
+    path.write_bytes(bytes(reversed(path.read_bytes())))
+
+    assert manager.download(url).read_bytes() == FILES["/b/granule.h5"]
+    assert len(server.requests) == 2
+    manager.close()
+
+
+def test_passed_session_is_not_modified(tmp_path):
+    session = requests.Session()
+    adapters = dict(session.adapters)
+    manager = fetch.DownloadManager(tmp_path, session=session)
+    assert manager.session is session
+    assert session.adapters == adapters
+    manager.close()
+    session.close()
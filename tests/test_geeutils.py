@@ -0,0 +1,41 @@
+from unittest import mock
+import pytest
+from ee.ee_exception import EEException
+from hydrafloods import geeutils
+
+
+@pytest.fixture
+def fake_metadata(monkeypatch):
+    # every request is a (count, offset) tuple, requests for more than max_count
+    # images fail with the given error message
+    state = dict(n=10, max_count=10, message="", requests=[])
+
+    def get_info(obj, ttl=None):
+        if not isinstance(obj, tuple):
+            return state["n"]
+        count, offset = obj
+        state["requests"].append(obj)
+        if count > state["max_count"]:
+            raise EEException(state["message"])
+        return list(range(offset, min(offset + count, state["n"])))
+
+    monkeypatch.setattr(
+        geeutils, "_metadata_request", lambda c, count, offset, p: (count, offset)
+    )
+    monkeypatch.setattr(geeutils.cache, "get_info", get_info)
+    return state
+
+
+@pytest.mark.parametrize("chunk_size", [4, 1000])
+def test_collection_metadata_splits_large_payloads(fake_metadata, chunk_size):
+    fake_metadata.update(n=10, max_count=1, message="User memory limit exceeded.")
+    metadata = geeutils.collection_metadata(mock.MagicMock(), chunk_size=chunk_size)
+    assert metadata == list(range(10))
+    assert max(count for count, _ in fake_metadata["requests"]) == min(chunk_size, 10)
+
+
+def test_collection_metadata_raises_other_errors(fake_metadata):
+    fake_metadata.update(n=8, max_count=1, message="Collection asset not found.")
+    with pytest.raises(EEException, match="not found"):
+        geeutils.collection_metadata(mock.MagicMock(), chunk_size=4)
+    assert all(count == 4 for count, _ in fake_metadata["requests"])
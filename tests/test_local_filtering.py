@@ -0,0 +1,69 @@
+import os
+import numpy as np
+import pytest
+from hydrafloods.local import filtering
+
+# reference outputs written by tests/data/make_filtering_reference.py, the Earth
+# Engine outputs are only written with --ee
+REFERENCE = os.path.join(os.path.dirname(__file__), "data", "filtering_reference.npz")
+EE_REFERENCE = os.path.join(
+    os.path.dirname(__file__), "data", "filtering_reference_ee.npz"
+)
+
+
+@pytest.fixture(scope="module")
+def reference():
+    with np.load(REFERENCE) as data:
+        return dict(data)
+
+
+FILTERS = [
+    ("lee_sigma", dict(window=5)),
+    ("gamma_map", dict(window=7)),
+    ("refined_lee", dict()),
+]
+
+
+@pytest.mark.parametrize("name,kwargs", FILTERS)
+def test_filter_matches_reference(reference, name, kwargs):
+    result = getattr(filtering, name)(reference["patch"], **kwargs)
+    np.testing.assert_array_equal(np.isnan(result), np.isnan(reference[name]))
+    np.testing.assert_allclose(result, reference[name], atol=1e-4)
+
+
+@pytest.mark.skipif(
+    not os.path.exists(EE_REFERENCE), reason="no Earth Engine reference outputs"
+)
+@pytest.mark.parametrize("name,kwargs", FILTERS)
+def test_filter_matches_earth_engine(name, kwargs):
+    with np.load(EE_REFERENCE) as data:
+        patch, expected = data["patch"], data[name]
+    result = getattr(filtering, name)(patch, **kwargs)
+    # pixels within a window of the patch edge see different neighborhoods
+    diff = np.abs(result - expected)[16:-16, 16:-16]
+    assert np.nanmean(diff) < 0.05
+
+
+@pytest.mark.parametrize("name,kwargs", FILTERS)
+def test_chunks_match_single_pass(reference, name, kwargs):
+    func = getattr(filtering, name)
+    single = func(reference["patch"], **kwargs)
+    chunked = func(reference["patch"], chunk_rows=5, **kwargs)
+    np.testing.assert_array_equal(chunked, single)
+
+
+def test_writes_to_out(reference, tmp_path):
+    patch = reference["patch"]
+    out = np.lib.format.open_memmap(
+        str(tmp_path / "out.npy"), mode="w+", dtype=np.float32, shape=patch.shape
+    )
+    result = filtering.gamma_map(patch, chunk_rows=8, out=out)
+    assert result is out
+    np.testing.assert_allclose(out, reference["gamma_map"], atol=1e-4)
+
+
+def test_masked_values_are_no_data(reference):
+    patch = reference["patch"]
+    masked = np.ma.masked_array(np.nan_to_num(patch, nan=-99), mask=np.isnan(patch))
+    result = filtering.lee_sigma(masked, window=5)
+    np.testing.assert_allclose(result, reference["lee_sigma"], atol=1e-4)
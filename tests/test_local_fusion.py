@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+from hydrafloods.local import fusion
+
+
+def scene(shape=(2, 45, 38), seed=0):
+    rng = np.random.default_rng(seed)
+    fine_base = rng.uniform(0.05, 0.4, shape)
+    coarse_base = fine_base + rng.normal(0, 0.02, shape)
+    coarse = coarse_base + rng.normal(0.05, 0.02, shape)
+    return coarse, coarse_base, fine_base
+
+
+def mosaic(shape, results):
+    out = np.full(shape, np.nan, dtype=np.float32)
+    for window, prediction in results:
+        assert np.all(np.isnan(out[(Ellipsis,) + window]))
+        out[(Ellipsis,) + window] = prediction
+    return out
+
+
+def test_tiles_cover_scene_once():
+    covered = np.zeros((45, 38), dtype=int)
+    for read, write, inner in fusion.tiles((45, 38), tile_size=16, halo=5):
+        covered[write] += 1
+        assert np.arange(45)[read[0]][inner[0]].tolist() == list(range(45)[write[0]])
+        assert np.arange(38)[read[1]][inner[1]].tolist() == list(range(38)[write[1]])
+    assert np.all(covered == 1)
+
+
+@pytest.mark.parametrize("tile_size", [7, 16, 64])
+def test_starfm_tiles_match_single_pass(tile_size):
+    coarse, coarse_base, fine_base = scene()
+    dt = np.linspace(1, 3, 45 * 38).reshape(45, 38)
+    expected = fusion.starfm_block(coarse, coarse_base, fine_base, dt, window_size=5)
+    result = mosaic(
+        coarse.shape,
+        fusion.starfm(
+            coarse,
+            coarse_base,
+            fine_base,
+            dt,
+            window_size=5,
+            tile_size=tile_size,
+            n_workers=0,
+        ),
+    )
+    np.testing.assert_allclose(result, expected, rtol=1e-6)
+
+
+def test_starfm_process_pool_matches_single_pass():
+    coarse, coarse_base, fine_base = (band[0] for band in scene())
+    expected = fusion.starfm_block(coarse, coarse_base, fine_base, 2, window_size=3)
+    result = mosaic(
+        coarse.shape,
+        fusion.starfm(
+            coarse, coarse_base, fine_base, 2, window_size=3, tile_size=20, n_workers=2
+        ),
+    )
+    np.testing.assert_allclose(result, expected, rtol=1e-6)
+
+
+def test_distance_kernel():
+    kernel = fusion.distance_kernel(5)
+    assert kernel.sum() == pytest.approx(1)
+    np.testing.assert_allclose(kernel, kernel.T)
+    assert kernel.argmin() == 12
+
+
+def terrain(factor=4, shape=(12, 9), seed=0):
+    rng = np.random.default_rng(seed)
+    hand = rng.gamma(2, 3, (shape[0] * factor, shape[1] * factor))
+    hand[rng.random(hand.shape) < 0.1] = np.nan
+    permanent = rng.random(hand.shape) < 0.05
+    wfrac = rng.random(shape)
+    return wfrac, hand, permanent
+
+
+def brute_force_cdf(values, depths):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (values[..., None] <= depths).sum(axis=-2) / (~np.isnan(values)).sum(
+            axis=-1
+        )[..., None]
+
+
+@pytest.mark.parametrize("step", [1, 0.5])
+def test_bathtub_cdf_matches_brute_force(step):
+    wfrac, hand, permanent = terrain()
+    values = fusion._cell_values(hand, permanent, 4)
+    depth, error = fusion._bathtub_block(wfrac, values, 20, step)
+
+    depths = np.arange(int(round(20 / step)) + 1) * step
+    cdf = brute_force_cdf(values, depths)
+    np.testing.assert_allclose(error, np.abs(cdf - wfrac[..., None]).min(axis=-1))
+
+    # the interpolated depth lies between the levels that bracket the water fraction
+    for (i, j), d in np.ndenumerate(depth):
+        k = min(max(np.searchsorted(cdf[i, j], wfrac[i, j]), 1), depths.size - 1)
+        assert depths[k - 1] - 1e-9 <= d <= depths[k] + 1e-9
+
+
+@pytest.mark.parametrize("step", [1, None])
+def test_bathtub_chunks_match_single_pass(step):
+    wfrac, hand, permanent = terrain()
+    single = fusion.bathtub(wfrac, hand, permanent, step=step)
+    chunked = fusion.bathtub(wfrac, hand, permanent, step=step, chunk_rows=5)
+    for key, value in single.items():
+        np.testing.assert_array_equal(chunked[key], value)
+
+
+def test_bathtub_exact_quantile_fills_water_fraction():
+    wfrac, _, _ = terrain()
+    hand = np.random.default_rng(1).gamma(2, 3, (120, 90))
+    result = fusion.bathtub(wfrac, hand, step=None, max_depth=1000)
+    filled = result["water"].reshape(12, 10, 9, 10).mean(axis=(1, 3))
+    np.testing.assert_allclose(filled, wfrac, atol=0.005 + 1e-9)
+    assert np.all(result["error"] <= 0.005 + 1e-6)
+
+
+def test_bathtub_keeps_permanent_water():
+    wfrac, hand, permanent = terrain()
+    result = fusion.bathtub(np.zeros_like(wfrac), hand, permanent)
+    np.testing.assert_array_equal(result["water"].astype(bool), permanent)
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+from hydrafloods.local import stats
+
+
+def image(shape=(23, 31), seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.normal(10, 3, shape)
+    x[4, 7] = np.nan
+    x[10:14, 2:6] = np.nan
+    return x
+
+
+def brute_force(x, kernel, focus):
+    # weighted count, mean and population variance of the valid pixels around every pixel
+    h, w = x.shape
+    count, mean, variance = (np.full(x.shape, np.nan) for _ in range(3))
+    for i in range(h):
+        for j in range(w):
+            values, weights = [], []
+            for u in range(kernel.shape[0]):
+                for v in range(kernel.shape[1]):
+                    r, c = i + u - focus[0], j + v - focus[1]
+                    if 0 <= r < h and 0 <= c < w and np.isfinite(x[r, c]):
+                        values.append(x[r, c])
+                        weights.append(kernel[u, v])
+            values, weights = np.array(values), np.array(weights)
+            count[i, j] = weights.sum()
+            if count[i, j] > 0:
+                mean[i, j] = (weights * values).sum() / count[i, j]
+                variance[i, j] = (weights * (values - mean[i, j]) ** 2).sum() / count[
+                    i, j
+                ]
+    return dict(count=count, mean=mean, variance=variance)
+
+
+@pytest.mark.parametrize("window,anchor", [(3, None), (4, 2), (7, 4), (9, None)])
+def test_box_stats_matches_brute_force(window, anchor):
+    x = image()
+    expected = brute_force(
+        x, np.ones((window, window)), (window // 2 if anchor is None else anchor,) * 2
+    )
+    result = stats.box_stats(x, window, anchor)
+    for key in ("count", "mean", "variance"):
+        np.testing.assert_allclose(result[key], expected[key], atol=1e-8)
+
+
+def test_box_stats_masked_equals_nan():
+    x = image()
+    masked = np.ma.masked_array(np.nan_to_num(x, nan=1e6), mask=np.isnan(x))
+    for key, value in stats.box_stats(x, 5).items():
+        np.testing.assert_allclose(stats.box_stats(masked, 5)[key], value)
+
+
+def test_box_stats_window_larger_than_image():
+    x = image()[2:7, 3:9]
+    result = stats.box_stats(x, 33)
+    assert np.all(result["count"] == np.isfinite(x).sum())
+    np.testing.assert_allclose(result["mean"], np.nanmean(x))
+    np.testing.assert_allclose(result["variance"], np.nanvar(x))
+
+
+def test_box_stats_all_nan_window():
+    x = np.full((6, 6), np.nan)
+    x[0, 0] = 1.0
+    result = stats.box_stats(x, 3)
+    assert result["count"][5, 5] == 0
+    assert np.isnan(result["mean"][5, 5])
+    assert result["mean"][1, 1] == 1.0
+
+
+@pytest.mark.parametrize("size", [3, 33])
+def test_weighted_stats_matches_brute_force(size):
+    rng = np.random.default_rng(1)
+    x = image()
+    kernel = rng.uniform(0, 1, (size, size))
+    kernel[size // 2, :] = 0
+    expected = brute_force(x, kernel, (size // 2, size // 2))
+    result = stats.weighted_stats(x, kernel)
+    for key in ("count", "mean", "variance"):
+        np.testing.assert_allclose(result[key], expected[key], atol=1e-8)
+
+
+def test_weighted_sum_treats_nan_as_zero():
+    x = image()
+    kernel = np.array([[0, 1, 0], [1, 2, 1], [0, 1, 0]], dtype=float)
+    expected = brute_force(np.nan_to_num(x), kernel, (1, 1))
+    np.testing.assert_allclose(
+        stats.weighted_sum(x, kernel), expected["count"] * expected["mean"]
+    )
@@ -0,0 +1,89 @@
+import ee
+import numpy as np
+import pytest
+from unittest import mock
+from hydrafloods.local import thresholding
+
+
+def bimodal(size=400, seed=0):
+    # water on the left half (-20 dB), land on the right half (-8 dB)
+    rng = np.random.default_rng(seed)
+    img = np.where(np.arange(size) < size // 2, -20.0, -8.0) * np.ones((size, 1))
+    return (img + rng.normal(0, 1.5, (size, size))).astype(np.float32)
+
+
+def brute_force_otsu(counts, means):
+    best, threshold = -np.inf, None
+    mean = (counts * means).sum() / counts.sum()
+    for i in range(counts.size - 1):
+        a, b = counts[: i + 1], counts[i + 1 :]
+        if a.sum() == 0 or b.sum() == 0:
+            continue
+        ma = (a * means[: i + 1]).sum() / a.sum()
+        mb = (b * means[i + 1 :]).sum() / b.sum()
+        bss = a.sum() * (ma - mean) ** 2 + b.sum() * (mb - mean) ** 2
+        if bss > best:
+            best, threshold = bss, means[i]
+    return threshold
+
+
+def test_otsu_matches_brute_force():
+    hist = thresholding.histogram(bimodal(), max_buckets=64)
+    expected = brute_force_otsu(hist["histogram"], hist["bucketMeans"])
+    assert thresholding.otsu(hist) == pytest.approx(expected)
+    assert -18 < thresholding.otsu(hist) < -10
+
+
+@pytest.mark.parametrize("method", ["otsu", "cumulative_otsu"])
+def test_otsu_dispatch(monkeypatch, method):
+    from hydrafloods import thresholding as ee_thresholding
+
+    hist = thresholding.histogram(bimodal(), max_buckets=64)
+    expected = brute_force_otsu(hist["histogram"], hist["bucketMeans"])
+    listed = {k: np.asarray(v).tolist() for k, v in hist.items()}
+    assert getattr(ee_thresholding, method)(listed) == pytest.approx(expected)
+
+    # a dictionary of ee objects is computed on the server, not with numpy
+    fake_ee = mock.MagicMock(name="ee", ComputedObject=ee.ComputedObject)
+    monkeypatch.setattr(ee_thresholding, "ee", fake_ee)
+    server = {
+        "histogram": ee.ComputedObject(None, None, "histogram"),
+        "bucketMeans": ee.ComputedObject(None, None, "bucketMeans"),
+    }
+    getattr(ee_thresholding, method)(server)
+    fake_ee.Dictionary.assert_called_with(server)
+
+
+def test_histogram_ignores_nan():
+    values = np.array([1, 2, np.nan, 3], dtype=np.float32)
+    hist = thresholding.histogram(values, max_buckets=3)
+    assert hist["histogram"].sum() == 3
+
+
+def test_box_statistics_zero_fallbacks():
+    # boxes without initial water have p1 == 0 and a constant box has zero variance,
+    # Earth Engine treats both as false and uses the fallback values
+    img = np.zeros((20, 20), dtype=np.float32)
+    img[:, 10:] = 5
+    stats = thresholding.box_statistics(img, 10, initial_threshold=-1)
+    assert np.all(stats["p1"] == 0.99)
+    assert np.all(stats["m1"] == -25)
+    assert np.all(stats["variance"] == 2)
+
+
+def test_bmax_otsu_separates_classes():
+    # boxes of 60 pixels straddle the class boundary, pure land boxes fall back to
+    # m1 = -25 and stay below the bmax threshold because land is close to -25
+    img = bimodal() - 10
+    water = thresholding.bmax_otsu(
+        img, initial_threshold=-24, grid_size=60, bmax_threshold=0.5
+    )
+    assert water[:, :180].mean() > 0.95
+    assert water[:, 220:].mean() < 0.05
+
+
+def test_edge_otsu_separates_classes():
+    img = bimodal()
+    water = thresholding.edge_otsu(img, initial_threshold=-14, edge_length=20, scale=30)
+    assert water[:, :180].mean() > 0.95
+    assert water[:, 220:].mean() < 0.05
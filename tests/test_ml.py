@@ -0,0 +1,269 @@
+import re
+import numpy as np
+import pytest
+from hydrafloods import ml
+from hydrafloods.local import ml as local_ml
+
+tree = pytest.importorskip("sklearn.tree")
+
+FEATURES = ["b0", "b1", "b2", "b3"]
+
+
+def samples(n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.random((n, len(FEATURES))).astype(np.float32)
+    y = X[:, 0] + np.sin(6 * X[:, 1]) * X[:, 2] + rng.normal(0, 0.05, n)
+    return X, y
+
+
+def test_tree_string_defaults_to_four_decimals():
+    X, y = samples()
+    estimator = tree.DecisionTreeRegressor(max_depth=4, random_state=0).fit(X, y)
+    lines = ml.sklearn_tree_to_string(estimator, FEATURES).splitlines()
+
+    assert len(lines) == estimator.tree_.node_count
+    assert re.fullmatch(r"1\) root 0 0 -?\d+\.\d{4}", lines[0])
+    for line in lines[1:]:
+        assert re.fullmatch(
+            r"\d+\) b\d (<=|>) -?\d+\.\d{4} 0 0 -?\d+\.\d{4}( \*)?", line
+        ), line
+
+
+def test_tree_string_node_numbers():
+    X, y = samples()
+    estimator = tree.DecisionTreeRegressor(max_depth=3, random_state=0).fit(X, y)
+    ids = [
+        int(l.split(")")[0])
+        for l in ml.sklearn_tree_to_string(estimator, FEATURES).splitlines()
+    ]
+    # pre-order with the children of node k numbered 2k and 2k+1
+    assert ids[:4] == [1, 2, 4, 8]
+    assert sorted(ids) == sorted(set(ids))
+    assert all(k // 2 in ids for k in ids[1:])
+
+
+def test_exact_precision_matches_regressor():
+    X, y = samples()
+    estimator = tree.DecisionTreeRegressor(random_state=0).fit(X, y)
+    tree_str = ml.sklearn_tree_to_string(estimator, FEATURES, precision=None)
+    nodes = local_ml.parse_tree(tree_str, FEATURES)
+
+    np.testing.assert_array_equal(local_ml.predict_tree(nodes, X), estimator.predict(X))
+    X_new, _ = samples(seed=1)
+    np.testing.assert_array_equal(
+        local_ml.predict_tree(nodes, X_new), estimator.predict(X_new)
+    )
+
+
+def test_exact_precision_matches_classifier():
+    X, y = samples()
+    labels = np.digitize(y, [0.5, 1.0])
+    estimator = tree.DecisionTreeClassifier(max_depth=8, random_state=0).fit(X, labels)
+    tree_str = ml.sklearn_tree_to_string(estimator, FEATURES, precision=None)
+    nodes = local_ml.parse_tree(tree_str, FEATURES)
+
+    np.testing.assert_array_equal(local_ml.predict_tree(nodes, X), estimator.predict(X))
+
+
+def test_single_leaf_tree():
+    X, _ = samples(10)
+    estimator = tree.DecisionTreeRegressor().fit(X, np.full(10, 2.5))
+    tree_str = ml.sklearn_tree_to_string(estimator, FEATURES)
+    assert tree_str == "1) root 0 0 2.5000 *\n"
+    nodes = local_ml.parse_tree(tree_str, FEATURES)
+    np.testing.assert_array_equal(local_ml.predict_tree(nodes, X), 2.5)
+
+
+@pytest.fixture(scope="module")
+def forest():
+    ensemble = pytest.importorskip("sklearn.ensemble")
+    X, y = samples()
+    model = ensemble.ExtraTreesRegressor(n_estimators=7, random_state=0).fit(X, y)
+    strings = [
+        ml.sklearn_tree_to_string(e, FEATURES, precision=None)
+        for e in model.estimators_
+    ]
+    return model, strings
+
+
+@pytest.mark.parametrize("n_workers", [0, 2])
+def test_predict_ensemble_matches_forest(forest, n_workers):
+    model, strings = forest
+    X, _ = samples(seed=2)
+    prediction = local_ml.predict_ensemble(
+        local_ml.parse_ensemble(strings, FEATURES),
+        X,
+        batch_size=300,
+        n_workers=n_workers,
+    )
+    np.testing.assert_allclose(prediction, model.predict(X), rtol=1e-12)
+
+
+def test_predict_ensemble_rasters_and_trees_separated_by_hash(forest):
+    model, strings = forest
+    X, _ = samples(60, seed=3)
+    forest_nodes = local_ml.parse_ensemble(
+        [s.replace("\n", "#") for s in strings], FEATURES
+    )
+    prediction = local_ml.predict_ensemble(
+        forest_nodes, X.reshape(6, 10, 4), n_workers=0
+    )
+    assert prediction.shape == (6, 10)
+    np.testing.assert_allclose(prediction.ravel(), model.predict(X), rtol=1e-12)
+
+
+def test_predict_ensemble_scales_features(forest):
+    model, strings = forest
+    X, _ = samples(100, seed=4)
+    min_max = {f"{f}_min": -1.0 for f in FEATURES}
+    min_max.update({f"{f}_max": 3.0 for f in FEATURES})
+    prediction = local_ml.predict_ensemble(
+        local_ml.parse_ensemble(strings, FEATURES),
+        X * 4 - 1,
+        FEATURES,
+        min_max,
+        n_workers=0,
+    )
+    np.testing.assert_allclose(prediction, model.predict(X), atol=1e-6)
+
+
+def test_predict_ensemble_majority_vote():
+    # three stumps on b0 voting for classes 0, 1 and 1
+    strings = [
+        "1) root 0 0 0\n2) b0 <= 0.5 0 0 0 *\n3) b0 > 0.5 0 0 1 *\n",
+        "1) root 0 0 0\n2) b0 <= 0.2 0 0 0 *\n3) b0 > 0.2 0 0 1 *\n",
+        "1) root 0 0 0\n2) b0 <= 0.8 0 0 0 *\n3) b0 > 0.8 0 0 1 *\n",
+    ]
+    X = np.array([[0.1, 0, 0, 0], [0.3, 0, 0, 0], [0.6, 0, 0, 0], [0.9, 0, 0, 0]])
+    prediction = local_ml.predict_ensemble(
+        local_ml.parse_ensemble(strings, FEATURES),
+        X,
+        mode="classification",
+        n_workers=0,
+    )
+    np.testing.assert_array_equal(prediction, [0, 0, 1, 1])
+
+    with pytest.raises(ValueError):
+        local_ml.predict_ensemble([], X, mode="vote")
+
+
+@pytest.fixture
+def sample_tables(tmp_path):
+    pd = pytest.importorskip("pandas")
+    rng = np.random.default_rng(0)
+    tables = []
+    for i in range(5):
+        df = pd.DataFrame(
+            {
+                "system:index": [f"{i}_{j}" for j in range(20)],
+                "b0": rng.random(20),
+                "b1": rng.random(20),
+                "label": rng.integers(0, 3, 20),
+                ".geo": "{}",
+            }
+        )
+        df.to_csv(tmp_path / f"samples_{i}.csv", index=False)
+        tables.append(df)
+    return tmp_path, pd.concat(tables, ignore_index=True)
+
+
+def test_read_samples_selects_columns_and_dtypes(sample_tables):
+    path, expected = sample_tables
+    df = ml.read_samples(
+        str(path), ["b0", "b1"], "label", label_dtype=np.uint8, n_workers=2
+    )
+
+    assert list(df.columns) == ["b0", "b1", "label"]
+    assert [str(t) for t in df.dtypes] == ["float32", "float32", "uint8"]
+    # tables are concatenated in file order
+    np.testing.assert_array_equal(df["b0"], expected["b0"].astype(np.float32))
+    np.testing.assert_array_equal(df["label"], expected["label"])
+
+
+def test_read_samples_without_tables(tmp_path):
+    with pytest.raises(ValueError):
+        ml.read_samples(str(tmp_path), ["b0"], "label")
+
+
+def test_read_samples_cache(sample_tables, tmp_path):
+    pytest.importorskip("pyarrow")
+    path, expected = sample_tables
+    cache = tmp_path / "cache" / "samples.arrow"
+    cache.parent.mkdir()
+
+    df = ml.read_samples(str(path), ["b0", "b1"], "label", cache=cache)
+    np.testing.assert_array_equal(df["b1"], expected["b1"].astype(np.float32))
+
+    # later runs read the cache even when the tables are gone
+    for f in path.glob("*.csv"):
+        f.unlink()
+    cached = ml.read_samples(str(path), ["b0", "b1"], "label", cache=cache)
+    assert cached.equals(df)
+
+    with pytest.raises(ValueError):
+        ml.read_samples(
+            str(path), ["b0", "b1"], "label", cache=cache, refresh_cache=True
+        )
+
+
+def feature_matrix(n=20000, seed=0):
+    rng = np.random.default_rng(seed)
+    X = np.column_stack(
+        [
+            rng.normal(0, 1, n),  # gaussian
+            rng.lognormal(0, 1, n),  # skewed
+            rng.integers(0, 3, n),  # categorical
+            np.full(n, 7.0),  # constant, few unique values make it categorical
+        ]
+    ).astype(np.float32)
+    X[:5, 0] = [3.6, -3.7, 3.8, -3.6, 3.7]
+    X[5:8, 1] = [200, 300, 400]
+    return X
+
+
+def test_outlier_mask_rules():
+    X = feature_matrix()
+    mask, report = ml.outlier_mask(X, ["g", "s", "c", "k"])
+
+    assert report["features"] == dict(
+        g="zscore", s="iqr", c="categorical", k="categorical"
+    )
+    assert not mask[:8].any()
+    assert report["total"] == int((~mask).sum())
+
+    # bounds from the same rules computed column by column
+    g, s = X[:, 0].astype(np.float64), X[:, 1]
+    q1, q3 = np.quantile(s, [0.25, 0.75])
+    expected = (np.abs(g - g.mean()) <= 3 * g.std()) & (
+        (s >= q1 - 1.5 * (q3 - q1)) & (s <= q3 + 1.5 * (q3 - q1))
+    )
+    np.testing.assert_array_equal(mask, expected)
+
+
+def test_outlier_mask_ignores_nan():
+    X = feature_matrix()
+    with_nan = X.copy()
+    with_nan[100:300, 0] = np.nan
+    with_nan[200:400, 1] = np.nan
+    with_nan[::7, 3] = np.nan
+
+    mask, report = ml.outlier_mask(with_nan)
+    assert list(report["features"].values()) == [
+        "zscore",
+        "iqr",
+        "categorical",
+        "categorical",
+    ]
+    # rows with nan are only removed for outliers in their other features
+    filled = np.where(np.isnan(with_nan), np.median(X, axis=0), with_nan)
+    expected = ml.outlier_mask(filled)[0]
+    assert not mask[:8].any()
+    assert (mask[100:400] | ~expected[100:400]).all()
+    assert mask[100:400].mean() > 0.9
+
+
+def test_outlier_mask_constant_columns_are_a_no_op():
+    X = np.column_stack([np.full(50, 3.0), np.arange(50.0)])
+    mask, report = ml.outlier_mask(X, alpha=0.01)
+    assert report["features"][0] == "constant"
+    assert mask.all()
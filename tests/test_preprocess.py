@@ -0,0 +1,256 @@
+from collections import OrderedDict
+from types import SimpleNamespace
+import numpy as np
+import pytest
+
+pytest.importorskip("osgeo")
+pytest.importorskip("pyresample")
+pytest.importorskip("xarray")
+from hydrafloods import preprocess
+
+
+class FakeBand:
+    # stands in for a gdal dataset of a VIIRS subdataset
+    def __init__(self, values):
+        self.values = values
+        self.RasterYSize, self.RasterXSize = values.shape
+
+    def ReadAsArray(self, xoff, yoff, xsize, ysize):
+        return self.values[yoff : yoff + ysize, xoff : xoff + xsize].copy()
+
+
+@pytest.fixture
+def viirs_bands(monkeypatch):
+    rng = np.random.default_rng(0)
+    rows, cols = 9, 8
+    coarse = ((rows + 1) // 2, cols // 2)
+    bands = {
+        ("QF", 1): rng.integers(0, 16, coarse),
+        ("QF", 2): rng.integers(0, 16, coarse),
+    }
+    for mode, b in preprocess.VIIRS_BANDS:
+        shape = (rows, cols) if mode == "I" else coarse
+        bands[(mode, b)] = rng.integers(-100, 10000, shape).astype(np.int16)
+
+    monkeypatch.setattr(
+        preprocess,
+        "_viirs_subdataset",
+        lambda infile, mode, b: FakeBand(bands[(mode, b)]),
+    )
+    return bands
+
+
+def expected_viirs(bands, no_data):
+    rows, cols = bands[("I", 1)].shape
+    out = []
+    for mode, b in preprocess.VIIRS_BANDS:
+        values = bands[(mode, b)]
+        if mode == "M":
+            values = np.kron(values, np.ones((2, 2), dtype=values.dtype))[:rows]
+        out.append(np.where(values < 0, no_data, values))
+    cloud = (bands[("QF", 1)] >> 2) & 3
+    shadow = (bands[("QF", 2)] >> 3) & 1
+    qa = np.kron((cloud == 0) & (shadow == 0), np.ones((2, 2)))[:rows, :cols]
+    return np.stack(out + [qa]).astype(np.int16)
+
+
+@pytest.mark.parametrize("block_rows", [3, 4, 512])
+def test_viirs_blocks_match_full_read(viirs_bands, block_rows):
+    expected = expected_viirs(viirs_bands, -999)
+    rows = []
+    for row, block in preprocess._viirs_blocks("granule.h5", block_rows, -999):
+        # blocks stay aligned with the 1km rows
+        assert row % 2 == 0
+        assert row == sum(r.shape[1] for r in rows)
+        rows.append(block)
+    np.testing.assert_array_equal(np.concatenate(rows, axis=1), expected)
+
+
+def read_geotiff(path):
+    from osgeo import gdal
+
+    ds = gdal.Open(str(path))
+    band = ds.GetRasterBand(1)
+    return dict(
+        data=ds.ReadAsArray(),
+        gt=ds.GetGeoTransform(),
+        no_data=band.GetNoDataValue(),
+        block_size=band.GetBlockSize(),
+        overviews=band.GetOverviewCount(),
+    )
+
+
+def test_write_geotiff_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    data = rng.integers(-999, 10000, (600, 520, 2)).astype(np.int16)
+    gt = (100000.0, 30.0, 0.0, 200000.0, 0.0, -30.0)
+    out_name = str(tmp_path / "out.tif")
+
+    result = preprocess.write_geotiff(
+        out_name, data, gt, 32615, no_data=-999, block_rows=128, block_size=256
+    )
+
+    assert result == out_name
+    # the intermediate file is removed
+    assert [p.name for p in tmp_path.iterdir()] == ["out.tif"]
+    written = read_geotiff(out_name)
+    np.testing.assert_array_equal(written["data"], np.moveaxis(data, -1, 0))
+    assert written["gt"] == pytest.approx(gt)
+    assert written["no_data"] == -999
+    assert written["block_size"] == [256, 256]
+    assert written["overviews"] >= 1
+
+
+def test_write_cog_streams_blocks(tmp_path):
+    from osgeo import gdal
+
+    data = np.arange(300 * 200, dtype=np.float32).reshape(300, 200)
+    # blocks can cover any window of the image
+    blocks = (
+        (row, col, data[row : row + 64, col : col + 100])
+        for row in range(0, 300, 64)
+        for col in (0, 100)
+    )
+    out_name = preprocess.write_cog(
+        str(tmp_path / "out.tif"),
+        blocks,
+        200,
+        300,
+        1,
+        (0.0, 1.0, 0.0, 0.0, 0.0, -1.0),
+        4326,
+        dtype=gdal.GDT_Float32,
+    )
+    np.testing.assert_array_equal(read_geotiff(out_name)["data"], data)
+
+
+def test_write_geotiff_rejects_1d(tmp_path):
+    with pytest.raises(ValueError):
+        preprocess.write_geotiff(str(tmp_path / "out.tif"), np.zeros(5), None, 4326)
+
+
+def test_overview_levels():
+    assert preprocess._overview_levels(4096, 1024, 512) == [2, 4, 8]
+    assert preprocess._overview_levels(500, 500, 512) == []
+
+
+@pytest.fixture
+def bil_info(monkeypatch):
+    # records the neighbour searches instead of running them
+    calls = []
+
+    class Swath:
+        def __init__(self, lons, lats):
+            self.lons, self.lats = lons, lats
+
+    def get_bil_info(swath_def, area_def, **kwargs):
+        calls.append(swath_def)
+        n = len(calls)
+        return tuple(np.full(3, n + i) for i in range(4))
+
+    monkeypatch.setattr(preprocess, "_BIL_INFO", OrderedDict())
+    monkeypatch.setattr(preprocess.geometry, "SwathDefinition", Swath)
+    monkeypatch.setattr(preprocess.bilinear, "get_bil_info", get_bil_info)
+    return calls
+
+
+def area(size=10):
+    return SimpleNamespace(
+        proj_str="+proj=merc", shape=(size, size), area_extent=(0, 0, size, size)
+    )
+
+
+def swath(seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.uniform(-180, 180, (6, 5)), rng.uniform(-80, 80, (6, 5))
+
+
+def test_bilinear_info_searches_unrounded_coordinates(bil_info):
+    lons, lats = swath()
+    preprocess._bilinear_info(lons, lats, area(), 25000)
+    np.testing.assert_array_equal(bil_info[0].lons, lons)
+    np.testing.assert_array_equal(bil_info[0].lats, lats)
+
+
+def granule(seed=None, shift=0):
+    # regular swath on a repeating orbit track, jittered by up to 0.01 degrees
+    lats, lons = np.mgrid[20.03:30:0.5, 80.03 + shift : 100 + shift : 0.5]
+    if seed is not None:
+        rng = np.random.default_rng(seed)
+        lons = lons + rng.uniform(-0.01, 0.01, lons.shape)
+        lats = lats + rng.uniform(-0.01, 0.01, lats.shape)
+    return lons, lats
+
+
+def grid_area(lons, lats, res=16000, tile_size=4):
+    # target grid from the global grid tiles covering the swath, plate carree
+    # meters stand in for web mercator
+    x0, y0, x1, y1 = preprocess._grid_tiles(
+        lons * 111320, lats * 111320, (-2e7, -2e7, 2e7, 2e7), res, tile_size
+    )
+    shape = (int(round((y1 - y0) / res)), int(round((x1 - x0) / res)))
+    return SimpleNamespace(
+        proj_str="+proj=merc", shape=shape, area_extent=(x0, y0, x1, y1)
+    )
+
+
+def test_grid_tiles_snap_to_global_grid():
+    lons, lats = granule()
+    extent = grid_area(lons, lats).area_extent
+    for value in extent:
+        assert (value + 2e7) % (16000 * 4) == 0
+
+    # swaths reaching past the grid are clipped to it
+    x0, y0, x1, y1 = preprocess._grid_tiles(
+        np.array([-3e7, 0]), np.array([0, 3e7]), (-2e7, -2e7, 2e7, 2e7), 16000, 4
+    )
+    assert x0 == -2e7 and y1 == 2e7
+
+
+def test_bilinear_info_reuses_orbit_geometry(bil_info):
+    # two granules of the same orbit track with jittered coordinates
+    first_swath, second_swath = granule(seed=0), granule(seed=1)
+    assert not np.array_equal(first_swath[0], second_swath[0])
+    first_area, second_area = grid_area(*first_swath), grid_area(*second_swath)
+    assert first_area == second_area
+
+    first = preprocess._bilinear_info(*first_swath, first_area, 25000)
+    again = preprocess._bilinear_info(*second_swath, second_area, 25000)
+    assert again is first
+    assert len(bil_info) == 1
+
+    # another orbit track, granule length or target grid is a new neighbour search
+    other = granule(seed=2, shift=1)
+    preprocess._bilinear_info(*other, grid_area(*other), 25000)
+    lons, lats = first_swath
+    preprocess._bilinear_info(lons[:-1], lats[:-1], first_area, 25000)
+    preprocess._bilinear_info(lons, lats, area(), 25000)
+    assert len(bil_info) == 4
+
+
+def test_bilinear_info_disk_cache(bil_info, tmp_path, monkeypatch):
+    lons, lats = swath()
+    first = preprocess._bilinear_info(lons, lats, area(), 25000, cache_dir=tmp_path)
+    assert len(list(tmp_path.glob("*.npz"))) == 1
+
+    # a new process only has the files
+    monkeypatch.setattr(preprocess, "_BIL_INFO", OrderedDict())
+    cached = preprocess._bilinear_info(lons, lats, area(), 25000, cache_dir=tmp_path)
+    assert len(bil_info) == 1
+    for a, b in zip(first, cached):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_bilinear_info_evicts_least_recently_used(bil_info, monkeypatch):
+    monkeypatch.setattr(preprocess, "BIL_INFO_CACHE_SIZE", 2)
+    swaths = [swath(i) for i in range(3)]
+    for lons, lats in swaths[:2]:
+        preprocess._bilinear_info(lons, lats, area(), 25000)
+    preprocess._bilinear_info(*swaths[0], area(), 25000)
+    preprocess._bilinear_info(*swaths[2], area(), 25000)
+    assert len(bil_info) == 3
+
+    preprocess._bilinear_info(*swaths[0], area(), 25000)
+    assert len(bil_info) == 3
+    preprocess._bilinear_info(*swaths[1], area(), 25000)
+    assert len(bil_info) == 4
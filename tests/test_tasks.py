@@ -0,0 +1,113 @@
+import pytest
+from hydrafloods import tasks
+
+
+class FakeTask:
+    # stands in for ee.batch.Task, the status is read from a shared dictionary
+    count = 0
+
+    def __init__(self, description, states, fail_start=None):
+        FakeTask.count += 1
+        self.id = f"task_{FakeTask.count}"
+        self.description = description
+        self.fail_start = fail_start
+        states[self.id] = []
+
+    def start(self):
+        if self.fail_start is not None:
+            raise self.fail_start
+
+
+@pytest.fixture
+def states(monkeypatch):
+    states = {}
+
+    def get_task_status(ids):
+        if isinstance(ids, str):
+            ids = [ids]
+        # every poll moves a task one state further, the last state is kept
+        out = []
+        for i in ids:
+            sequence = states[i]
+            state = sequence.pop(0) if len(sequence) > 1 else sequence[0]
+            out.append(dict(id=i, state=state))
+        return out
+
+    monkeypatch.setattr(tasks.ee.data, "getTaskStatus", get_task_status)
+    monkeypatch.setattr(tasks.time, "sleep", lambda s: None)
+    return states
+
+
+def test_success_states():
+    assert "COMPLETED" in tasks.SUCCESS_STATES
+    assert "SUCCEEDED" in tasks.SUCCESS_STATES
+    assert not set(tasks.SUCCESS_STATES) & set(tasks.FAILURE_STATES)
+
+
+def test_wait_for_returns_succeeded(states):
+    task = FakeTask("a", states)
+    states[task.id] = ["PENDING", "RUNNING", "SUCCEEDED"]
+    assert tasks.wait_for(task.id)["state"] in tasks.SUCCESS_STATES
+
+
+def test_wait_for_stops_on_unknown_state(states):
+    task = FakeTask("a", states)
+    states[task.id] = ["RUNNING", "UNKNOWN"]
+    status = tasks.wait_for(task.id, max_unknown_polls=3)
+    assert status["state"] == "UNKNOWN"
+
+
+def test_manager_fails_single_task_on_client_error(states):
+    def export(description, fail_start=None):
+        task = FakeTask(description, states, fail_start)
+        states[task.id] = ["READY", "RUNNING", "COMPLETED"]
+        return task
+
+    manager = tasks.TaskManager(max_concurrent=2, poll_interval=0, max_retries=1)
+    manager.submit(export, description="ok_1")
+    manager.submit(export, description="broken", fail_start=ConnectionError("reset"))
+    manager.submit(export, description="ok_2")
+    records = manager.run()
+
+    states_by_name = {r.description: r.state for r in records}
+    assert states_by_name == dict(ok_1="COMPLETED", broken="FAILED", ok_2="COMPLETED")
+    assert "reset" in records[1].error
+
+
+def test_manager_retries_transient_failures(states, monkeypatch):
+    attempts = []
+
+    def export(description):
+        task = FakeTask(description, states)
+        attempts.append(task.id)
+        final = "FAILED" if len(attempts) == 1 else "COMPLETED"
+        states[task.id] = ["RUNNING", final]
+        return task
+
+    original = tasks.ee.data.getTaskStatus
+
+    def with_error(ids):
+        out = original(ids)
+        for status in out:
+            if status["state"] == "FAILED":
+                status["error_message"] = "Internal error, try again"
+        return out
+
+    monkeypatch.setattr(tasks.ee.data, "getTaskStatus", with_error)
+    manager = tasks.TaskManager(poll_interval=0, max_retries=2)
+    manager.submit(export, description="flaky")
+    record = manager.run()[0]
+
+    assert record.state == "COMPLETED"
+    assert record.attempts == 2
+
+
+def test_manager_stops_tracking_unknown_states(states):
+    def export(description):
+        task = FakeTask(description, states)
+        states[task.id] = ["UNKNOWN"]
+        return task
+
+    manager = tasks.TaskManager(poll_interval=0, max_unknown_polls=2)
+    manager.submit(export, description="lost")
+    assert manager.run()[0].state == "UNKNOWN"
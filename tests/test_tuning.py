@@ -0,0 +1,132 @@
+import json
+from concurrent.futures import Future
+import numpy as np
+import pytest
+from hydrafloods import tuning
+
+pytest.importorskip("sklearn")
+from sklearn.tree import DecisionTreeRegressor
+
+SPACE = {"max_depth": (1, 6), "min_samples_split": [2, 10, 50], "random_state": [0]}
+
+
+def samples(n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.random((n, 3))
+    return X, X[:, 0] + np.sin(6 * X[:, 1]) + rng.normal(0, 0.05, n)
+
+
+@pytest.fixture
+def evaluations(monkeypatch):
+    # counts the evaluations that are run in the calling process
+    calls = []
+    evaluate = tuning._evaluate
+
+    def _evaluate(job):
+        calls.append(job[:2])
+        return evaluate(job)
+
+    monkeypatch.setattr(tuning, "_evaluate", _evaluate)
+    return calls
+
+
+def search(work_dir, X, y, **kwargs):
+    kwargs = dict(dict(space=SPACE, n_candidates=9, eta=3, n_workers=0), **kwargs)
+    return tuning.successive_halving(DecisionTreeRegressor, X, y, work_dir, **kwargs)
+
+
+def test_sample_params():
+    space = dict(SPACE, max_features=(0.1, 0.9))
+    candidates = tuning.sample_params(space, 50, seed=1)
+    assert candidates == tuning.sample_params(space, 50, seed=1)
+    assert all(1 <= c["max_depth"] <= 6 for c in candidates)
+    assert all(isinstance(c["max_depth"], int) for c in candidates)
+    assert all(0.1 <= c["max_features"] <= 0.9 for c in candidates)
+    assert {c["min_samples_split"] for c in candidates} == {2, 10, 50}
+
+
+def test_successive_halving_rungs(tmp_path, evaluations):
+    X, y = samples()
+    best, history = search(tmp_path, X, y)
+
+    # 9 candidates on 33 samples, the best 3 on 99 and the best 1 on all 300
+    rungs = [r["rung"] for r in history]
+    assert rungs == [0] * 9 + [1] * 3 + [2]
+    assert [r["n_samples"] for r in history if r["rung"] == 1] == [99] * 3
+    assert best["rung"] == 2 and best["n_samples"] == 300
+
+    promoted = {r["trial"] for r in history if r["rung"] == 1}
+    first = sorted(
+        (r for r in history if r["rung"] == 0), key=lambda r: r["score"], reverse=True
+    )
+    assert promoted == {r["trial"] for r in first[:3]}
+
+
+def test_successive_halving_resumes(tmp_path, evaluations):
+    X, y = samples()
+    best, history = search(tmp_path, X, y)
+    lines = (tmp_path / "history.jsonl").read_text().splitlines()
+    # drop the last two evaluations as if the search was interrupted
+    (tmp_path / "history.jsonl").write_text("\n".join(lines[:-2]) + "\n")
+    del evaluations[:]
+
+    resumed, resumed_history = search(tmp_path, X, y)
+    dropped = [json.loads(line) for line in lines[-2:]]
+    assert evaluations == [(r["trial"], r["rung"]) for r in dropped]
+    assert resumed["params"] == best["params"]
+    assert len(resumed_history) == len(history)
+
+
+def test_successive_halving_rejects_other_data(tmp_path, evaluations):
+    X, y = samples()
+    search(tmp_path, X, y)
+    assert json.loads((tmp_path / "data.json").read_text())["X_shape"] == [300, 3]
+
+    X_new, y_new = samples(seed=1)
+    with pytest.raises(ValueError):
+        search(tmp_path, X_new, y_new)
+    with pytest.raises(ValueError):
+        search(tmp_path, X[:200], y[:200])
+
+    del evaluations[:]
+    _, history = search(tmp_path, X_new, y_new, reset=True)
+    assert len(evaluations) == len(history) == 13
+    np.testing.assert_array_equal(np.load(tmp_path / "X.npy"), X_new)
+
+
+class FakeExecutor:
+    # runs the first submitted job and leaves the others pending
+    instances = []
+
+    def __init__(self, max_workers=None, initializer=None, initargs=()):
+        initializer(*initargs)
+        self.futures = []
+        self.shutdown_wait = None
+        FakeExecutor.instances.append(self)
+
+    def submit(self, func, job):
+        future = Future()
+        if not self.futures:
+            future.set_result(func(job))
+        self.futures.append(future)
+        return future
+
+    def shutdown(self, wait=True):
+        self.shutdown_wait = wait
+
+
+def test_time_budget_cancels_pending_evaluations(tmp_path, monkeypatch):
+    monkeypatch.setattr(tuning, "ProcessPoolExecutor", FakeExecutor)
+    X, y = samples()
+    best, history = search(tmp_path, X, y, n_workers=2, time_budget=1e-9)
+
+    executor = FakeExecutor.instances[-1]
+    assert len(history) == 1 and best == history[0]
+    assert all(f.cancelled() for f in executor.futures[1:])
+    assert executor.shutdown_wait is False
+
+
+def test_time_budget_without_results(tmp_path):
+    X, y = samples()
+    with pytest.raises(RuntimeError):
+        search(tmp_path, X, y, time_budget=-1)